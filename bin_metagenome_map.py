@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#
+# bin_metagenome_map.py  created 2026-10-19
+
+'''bin_metagenome_map.py  last modified 2026-10-19
+    count samples of the polished metagenome table in map tiles at several zoom levels
+    so maps can show the counts when zoomed out, and only load points when zoomed in
+
+bin_metagenome_map.py -i NCBI_SRA_Metadata_Full_20210404.metagenomes_latlon-fixed.tab > NCBI_SRA_Metadata_Full_20210404.metagenomes_bins.tab
+
+    table generated from polish_metagenome_table.py, compressed or not
+    tiles are the same as web map tiles (like leaflet or OpenStreetMap)
+    as a quadkey, where each digit splits the tile above into 4, so zoom 2 has 16 tiles
+
+bin_metagenome_map.py -i NCBI_SRA_Metadata_Full_20210404.metagenomes_latlon-fixed.tab.gz -z 3 5 7 > NCBI_SRA_Metadata_Full_20210404.metagenomes_bins.tab
+
+    output columns are:
+zoom  quadkey  latitude  longitude  category  year  seq_source  samples
+    one row for each combination of category, year and library source in the tile
+    latitude and longitude are the mean of those samples, not the center of the tile
+    so the rows that pass the filters of the map can be added, weighted by samples
+'''
+
+import sys
+import math
+import gzip
+import time
+import argparse
+
+# web mercator does not reach the poles, so points beyond are put in the top or bottom tiles
+MAX_MERCATOR_LATITUDE = 85.05112878
+
+def latlon_to_quadkey(latitude, longitude, zoom):
+	'''return the quadkey of the web map tile at the zoom level that contains the point, as a string'''
+	latitude = min(max(latitude, -MAX_MERCATOR_LATITUDE), MAX_MERCATOR_LATITUDE)
+	tilecount = 2 ** zoom
+	x_fraction = (longitude + 180.0) / 360.0
+	sine_lat = math.sin(math.radians(latitude))
+	y_fraction = 0.5 - math.log( (1 + sine_lat) / (1 - sine_lat) ) / (4 * math.pi)
+	# longitude of 180 and the clamped latitudes are on the edge, so go in the last tile
+	tile_x = min(max(int(x_fraction * tilecount), 0), tilecount - 1)
+	tile_y = min(max(int(y_fraction * tilecount), 0), tilecount - 1)
+	digits = []
+	for level in range(zoom, 0, -1):
+		mask = 1 << (level - 1)
+		digits.append( str( (1 if tile_x & mask else 0) + (2 if tile_y & mask else 0) ) )
+	return "".join(digits)
+
+def open_table(inputfile):
+	'''return file handle of the table, reading .gz as text'''
+	if inputfile.rsplit('.',1)[-1]=="gz":
+		return gzip.open(inputfile,'rt')
+	return open(inputfile,'r')
+
+def get_category_and_source(lsplits):
+	'''return the category and library source of one split line of the polished table, where source is NA for older tables'''
+	# v2 tables have 3 library columns before the category, older ones end with the category
+	# though either could have extra columns after, from --fuzzy-distance or --country-check
+	if len(lsplits) >= 16:
+		return lsplits[15], lsplits[13]
+	return lsplits[12], "NA"
+
+def bin_samples(inputfile, zoomlevels):
+	'''read the polished table, return dict of zoom, quadkey, category, year and source, to list of samples, sum of latitude and longitude'''
+	bins = {}
+	linecounter = 0
+	no_latlon_counter = 0
+	sys.stderr.write("# Reading {}  {}\n".format(inputfile, time.asctime() ) )
+	for line in open_table(inputfile):
+		line = line.rstrip("\n")
+		if not line or line[0]=="#":
+			continue
+		linecounter += 1
+		lsplits = line.split("\t")
+		try:
+			latitude = float(lsplits[5])
+			longitude = float(lsplits[6])
+		except ValueError: # such as NA
+			no_latlon_counter += 1
+			continue
+		year = lsplits[7]
+		category, seq_source = get_category_and_source(lsplits)
+		for zoom in zoomlevels:
+			binkey = (zoom, latlon_to_quadkey(latitude, longitude, zoom), category, year, seq_source)
+			samplebin = bins.get(binkey, None)
+			if samplebin is None:
+				bins[binkey] = [1, latitude, longitude]
+			else:
+				samplebin[0] += 1
+				samplebin[1] += latitude
+				samplebin[2] += longitude
+	sys.stderr.write("# Counted {} entries in {} bins at {} zoom levels  {}\n".format( linecounter, len(bins), len(zoomlevels), time.asctime() ) )
+	if no_latlon_counter:
+		sys.stderr.write("# {} entries had no lat-lon, skipped\n".format(no_latlon_counter) )
+	return bins
+
+def write_bins(bins, wayout):
+	'''write one line for each bin, sorted by zoom and quadkey'''
+	wayout.write("zoom\tquadkey\tlatitude\tlongitude\tcategory\tyear\tseq_source\tsamples\n")
+	for binkey in sorted(bins):
+		zoom, quadkey, category, year, seq_source = binkey
+		samples, latitude_sum, longitude_sum = bins[binkey]
+		wayout.write( "{}\t{}\t{:.5f}\t{:.5f}\t{}\t{}\t{}\t{}\n".format( zoom, quadkey,
+			latitude_sum / samples, longitude_sum / samples, category, year, seq_source, samples ) )
+
+def main(argv, wayout):
+	if not len(argv):
+		argv.append('-h')
+	parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=__doc__)
+	parser.add_argument('-i','--input', required=True, help="polished table from polish_metagenome_table.py, can be .gz")
+	parser.add_argument('-z','--zoom', type=int, nargs="+", default=[2,4,6,8], help="zoom levels of the tiles [2 4 6 8]")
+	args = parser.parse_args(argv)
+
+	if min(args.zoom) < 0 or max(args.zoom) > 23:
+		parser.error("zoom levels must be from 0 to 23")
+
+	bins = bin_samples(args.input, sorted(set(args.zoom)))
+	write_bins(bins, wayout)
+
+if __name__ == "__main__":
+	main(sys.argv[1:], sys.stdout)
@@ -2,7 +2,7 @@
 #
 # import_geonames_db.py  created 2020-10-27
 
-'''import_geonames_db.py  last modified 2022-01-05
+'''import_geonames_db.py  last modified 2026-10-19
     get stats on geonames database
 
 ~/git/taxonomy_database/import_geonames_db.py featureCodes_en.txt countryInfo.txt allCountries.txt > geonames_placenames_latlon.tab
@@ -10,15 +10,27 @@
     wc geonames_placenames_latlon.tab
   24341155  105196946 1000579979 geonames_placenames_latlon.tab
 
+    or write the unique place names once to an SQLite index, used by polish_metagenome_table.py --geonames-index
+    so each run does not read allCountries.txt again
+~/git/taxonomy_database/import_geonames_db.py featureCodes_en.txt countryInfo.txt allCountries.txt --index geonames_places.sqlite
+
 
     download allCountries.zip from
     https://download.geonames.org/export/dump/
 '''
 
+import os
 import sys
 import time
+import math
+import array
+import sqlite3
+import argparse
 from collections import defaultdict,Counter
 
+# change if the tables of the index change, so old indices are rebuilt
+GEONAMES_INDEX_VERSION = "4"
+
 
 column_defs = '''
 The main 'geoname' table has the following fields :
@@ -106,9 +118,81 @@ def import_geonames_country_codes(country_codes_file, verbose=False):
 	sys.stderr.write("# Found {} country codes\n".format( len(codes_to_country_dict) ) )
 	return codes_to_country_dict
 
-def filter_unique_placenames( redundant_names_to_latlon, redundant_alternate_to_ascii ):
-	'''return dictionary of unique names with latlon'''
-	unique_name_latlon_dict = {} # key is non redundant names, value is latlon tuple
+# countries, states, capitals, continents and oceans, which most misspelled locations are meant to be
+fuzzy_features = ["A.PCLI", "A.ADM1", "P.PPLC", "P.PPLA", "P.PPLA2", "L.CONT", "H.OCN"]
+
+# names given to more than one place cannot be used, so are marked with this instead of keeping every place
+AMBIGUOUS_PLACE = -1
+# coordinates are kept as int32 of 1e-7 degrees, which holds all digits given by GeoNames
+COORDINATE_SCALE = 10000000
+COORDINATE_DIGITS = 7
+
+def degrees_to_fixed(degrees):
+	'''return decimal degrees string as integer of 1e-7 degrees'''
+	return int(round(float(degrees) * COORDINATE_SCALE))
+
+def degrees_format(degrees):
+	'''return number of decimals of the decimal degrees string, plus 8 if it has a sign, so -0.0 is kept'''
+	return min(len(degrees.partition(".")[2]), COORDINATE_DIGITS) + (8 if degrees.startswith("-") else 0)
+
+def fixed_to_degrees(fixed, degreesformat):
+	'''return integer of 1e-7 degrees as decimal degrees string, written as the GeoNames string from degrees_format'''
+	whole, fraction = divmod(abs(fixed), COORDINATE_SCALE)
+	sign = "-" if degreesformat >= 8 else ""
+	digits = degreesformat % 8
+	if not digits:
+		return "{}{}".format( sign, whole )
+	return "{}{}.{}".format( sign, whole, "{:07d}".format(fraction)[:digits] )
+
+def grid_cell(latitude, longitude):
+	'''return number of the 1 degree grid cell of the coordinates, with rows from the south pole and columns from -180'''
+	return ( int(math.floor(latitude)) + 90 ) * 360 + ( int(math.floor(longitude)) + 180 ) % 360
+
+def add_place_name(names_to_place, name, place):
+	'''set the place number of the name, or mark the name as ambiguous if it was already given'''
+	names_to_place[name] = AMBIGUOUS_PLACE if name in names_to_place else place
+
+def add_alternate_name(alternate_to_ascii, name, asciiname):
+	'''set the ascii name of the alternate name, or mark it as ambiguous if it was given for another ascii name'''
+	alternate_to_ascii[name] = asciiname if alternate_to_ascii.get(name, asciiname) == asciiname else AMBIGUOUS_PLACE
+
+class GeonamesPlaces:
+	'''unique place names to place numbers, with latitude and longitude of each place number in int32 arrays
+	    and the format of both in a byte array, so get() returns the same latitude and longitude strings as GeoNames, like GeonamesIndex'''
+	def __init__(self, names_to_place, place_latitudes, place_longitudes, place_formats, fuzzy_names=None, country_cells=None):
+		self.names_to_place = names_to_place
+		self.place_latitudes = place_latitudes
+		self.place_longitudes = place_longitudes
+		self.place_formats = place_formats
+		self.fuzzy_names = fuzzy_names or set()
+		self.country_cells = country_cells or {}
+
+	def get_fuzzy_names(self):
+		return self.fuzzy_names
+
+	def get_country_cells(self):
+		return self.country_cells
+
+	def __len__(self):
+		return len(self.names_to_place)
+
+	def place_latlon(self, place):
+		latlonformat = self.place_formats[place]
+		return [fixed_to_degrees(self.place_latitudes[place], latlonformat // 16), fixed_to_degrees(self.place_longitudes[place], latlonformat % 16)]
+
+	def get(self, name, default=None):
+		place = self.names_to_place.get(name)
+		if place is None:
+			return default
+		return self.place_latlon(place)
+
+	def items(self):
+		for name, place in self.names_to_place.items():
+			yield name, self.place_latlon(place)
+
+def filter_unique_placenames( redundant_names_to_place, redundant_alternate_to_ascii ):
+	'''return dictionary of unique names with place number'''
+	unique_name_place_dict = {} # key is non redundant names, value is place number
 
 	unique_key_counter = 0
 	redundant_key_counter = 0
@@ -117,29 +201,32 @@ def filter_unique_placenames( redundant_names_to_latlon, redundant_alternate_to_
 	alternate_without_unique = 0
 
 	sys.stderr.write("# Filtering keys for unique place names  {}\n".format( time.asctime() ) )
-	for k,v in redundant_names_to_latlon.items():
-		if len(v) == 1:
-			unique_name_latlon_dict[k] = v[0]
+	for k,v in redundant_names_to_place.items():
+		if v != AMBIGUOUS_PLACE:
+			unique_name_place_dict[k] = v
 			unique_key_counter += 1
 		else:
 			redundant_key_counter += 1
 	sys.stderr.write("# {} unique , {} redundant places  {}\n".format( unique_key_counter, redundant_key_counter, time.asctime() ) )
 	sys.stderr.write("# Sorting alternate names  {}\n".format( time.asctime() ) )
 	for k,v in redundant_alternate_to_ascii.items():
-		if len(set(v)) == 1:	# meaning alternate links to 1 name
-			alt_ascii_latlon = unique_name_latlon_dict.get(v[0],[])
-			if alt_ascii_latlon: # meaning was in unique_name_latlon_dict as unique, use the latlon for this name
+		if v != AMBIGUOUS_PLACE:	# meaning alternate links to 1 name
+			alt_ascii_place = unique_name_place_dict.get(v)
+			if alt_ascii_place is not None: # meaning was in unique_name_place_dict as unique, use the place for this name
 				usable_alternates += 1
-				unique_name_latlon_dict[k] = alt_ascii_latlon
-			else: # meaning was not in unique_name_latlon_dict
+				unique_name_place_dict[k] = alt_ascii_place
+			else: # meaning was not in unique_name_place_dict
 				alternate_without_unique += 1
 		else: # alternate has multiple redundant ascii possibilities
 			redundant_alternates += 1
 	sys.stderr.write("# {} usable alternates , {} redundant alternates , {} alternates to non-unique main  {}\n".format( usable_alternates, redundant_alternates, alternate_without_unique, time.asctime() ) )
-	return unique_name_latlon_dict
+	return unique_name_place_dict
 
-def import_geonames_all_countries(geodata_file, feature_desc_dict, country_code_dict, verbose=False):
-	'''read allCountries.txt, return dict of unique placenames with latlon tuple'''
+def read_geonames_places(geodata_file, feature_desc_dict, country_code_dict, verbose=False, needed_names=None):
+	'''read allCountries.txt, return dicts of names to place number, alternate names to ascii name, top level names to place number,
+	    int32 arrays of latitude and longitude of each place number, byte array of their formats, set of names of countries and large places for fuzzy matching,
+	    and dict of grid cells to the set of countries with places in that cell
+	    if a set of needed_names is given, all other names are skipped'''
 
 	us_state_abbvs_to_name = { "AL": "Alabama", "AK": "Alaska", "AZ": "Arizona", "AR": "Arkansas", "CA": "California", "CO": "Colorado", "CT": "Connecticut", "DE": "Delaware", "FL": "Florida", "GA": "Georgia", "HI": "Hawaii", "ID": "Idaho", "IL": "Illinois", "IN": "Indiana", "IA": "Iowa", "KS": "Kansas", "KY": "Kentucky", "LA": "Louisiana", "ME": "Maine", "MD": "Maryland", "MA": "Massachusetts", "MI": "Michigan", "MN": "Minnesota", "MS": "Mississippi", "MO": "Missouri", "MT": "Montana", "NE": "Nebraska", "NV": "Nevada", "NH": "New Hampshire", "NJ": "New Jersey", "NM": "New Mexico", "NY": "New York", "NC": "North Carolina", "ND": "North Dakota", "OH": "Ohio", "OK": "Oklahoma", "OR": "Oregon", "PA": "Pennsylvania", "RI": "Rhode Island", "SC": "South Carolina", "SD": "South Dakota", "TN": "Tennessee", "TX": "Texas", "UT": "Utah", "VT": "Vermont", "VA": "Virginia", "WA": "Washington", "WV": "West Virginia", "WI": "Wisconsin", "WY": "Wyoming", "DC":"Washington DC" }
 
@@ -151,10 +238,33 @@ def import_geonames_all_countries(geodata_file, feature_desc_dict, country_code_
 	state_name_counter = defaultdict(int)
 	ascii_counts_dict = Counter() # counter for each ascii name, showing many are non-unique
 
-	main_names_to_latlon = defaultdict(list) # key is name in ascii, value is list of lat-long strings
-	# if list of strings contains 1 entry after parsing the entire file, then keep the name
-	alternate_to_ascii = defaultdict(list) # key is unicode name, alternate names, value is ascii name
-	top_level_latlon = {} # key is country, val is lat-lon as list
+	main_names_to_place = {} # key is name in ascii, value is place number
+	# if value is not AMBIGUOUS_PLACE after parsing the entire file, then keep the name
+	alternate_to_ascii = {} # key is unicode name, alternate names, value is ascii name
+	top_level_place = {} # key is country, val is place number
+	fuzzy_names = set( country_code_dict.values() ) # names that misspelled locations are compared to
+	country_cells = defaultdict(set) # key is grid cell, value is set of countries with places in that cell
+	place_latitudes = array.array('i') # fixed-point latitude of each place number
+	place_longitudes = array.array('i')
+	place_formats = array.array('B') # degrees_format of latitude * 16 + of longitude, for each place number
+	line_place = None # place number of the current line, only made if one of its names is kept
+	def place_of_line():
+		nonlocal line_place
+		if line_place is None:
+			line_place = len(place_latitudes)
+			place_latitudes.append( degrees_to_fixed(latitude) )
+			place_longitudes.append( degrees_to_fixed(longitude) )
+			place_formats.append( degrees_format(latitude) * 16 + degrees_format(longitude) )
+		return line_place
+	def add_place(name):
+		if needed_names is None or name in needed_names:
+			add_place_name( main_names_to_place, name, place_of_line() )
+	def add_alternate(name, asciiname):
+		if needed_names is None or name in needed_names:
+			add_alternate_name( alternate_to_ascii, name, asciiname )
+	def add_top_level(name):
+		if needed_names is None or name in needed_names:
+			top_level_place[name] = place_of_line()
 
 	countries_w_sra_states = [ "US" , "CH" ]
 	# probaby exclude:
@@ -206,15 +316,17 @@ def import_geonames_all_countries(geodata_file, feature_desc_dict, country_code_
 			feature_code = lsplits[7]
 			combined_feature = "{}.{}".format(feature_class, feature_code)
 			feature_counter[combined_feature] += 1
+			if combined_feature in fuzzy_features:
+				fuzzy_names.add(asciiname)
 
 			# build names for dictionary
-			# any non-unique name will have a dict-list length of >1
+			# any non-unique name will be marked as AMBIGUOUS_PLACE
 			# and cannot be used to ID places
 			if combined_feature=="A.PCLI": # meaning "independent political entity" or high level country ID
 				# records do not have location, then skip and use capital
-				alternate_to_ascii[asciiname].append( country_name )
+				add_alternate( asciiname, country_name )
 				for alternate_name in alternate_names:
-					alternate_to_ascii[alternate_name].append( country_name )
+					add_alternate( alternate_name, country_name )
 				continue
 
 			#
@@ -222,13 +334,16 @@ def import_geonames_all_countries(geodata_file, feature_desc_dict, country_code_
 			#
 			if not latitude or not longitude:
 				continue
+			line_place = None
+			if country_name is not None:
+				country_cells[grid_cell(float(latitude), float(longitude))].add(country_name)
 
 			# of place name alone
 			# #TODO possibly only do this for A features, and only do country+place for P features
-			main_names_to_latlon[asciiname].append( [latitude, longitude] )
-			alternate_to_ascii[unicodename].append( asciiname )
+			add_place( asciiname )
+			add_alternate( unicodename, asciiname )
 			for alternate_name in alternate_names:
-				alternate_to_ascii[alternate_name].append( asciiname )
+				add_alternate( alternate_name, asciiname )
 
 			# meaning entry is the capital, so set each country
 			if combined_feature=="P.PPLC":
@@ -237,31 +352,31 @@ def import_geonames_all_countries(geodata_file, feature_desc_dict, country_code_
 				# also set the country, using strict country pattern of "country:"
 				# individual places should be set at "place" or "country:place"
 				# to distinguish between VA: Vatican: and VA Virginia
-				top_level_latlon["{}:".format(country_code)] = [latitude, longitude]
-				top_level_latlon["{}:".format(country_name)] = [latitude, longitude]
+				add_top_level( "{}:".format(country_code) )
+				add_top_level( "{}:".format(country_name) )
 				country_capital = "{}:{}".format( country_name , asciiname )
-				top_level_latlon[country_capital] = [latitude, longitude]
+				add_top_level( country_capital )
 
 			# try country name for most features, so "Lake Geneva" becomes "Switzerland:Lake Geneva"
 			if country_name is not None:
 				asciiname_w_country = "{}:{}".format( country_name , asciiname )
-				main_names_to_latlon[asciiname_w_country].append( [latitude, longitude] )
+				add_place( asciiname_w_country )
 				unicodename_w_country = "{}:{}".format( country_name , unicodename )
-				alternate_to_ascii[unicodename_w_country].append( asciiname_w_country )
+				add_alternate( unicodename_w_country, asciiname_w_country )
 				for alternate_name in alternate_names:
 					unicodename_w_country = "{}:{}".format( country_name , alternate_name )
-					alternate_to_ascii[unicodename_w_country].append( asciiname_w_country )
+					add_alternate( unicodename_w_country, asciiname_w_country )
 				# only make longer name if country AND admin level 1 are given, mostly for US states 
 				if admin_level_1 and country_code in countries_w_sra_states:
 					asciiname_w_adm1 = "{}:{},{}".format( country_name , admin_level_1 , asciiname )
-					main_names_to_latlon[asciiname_w_adm1].append( [latitude, longitude] )
+					add_place( asciiname_w_adm1 )
 					asciiname_w_state = "{}:{},{}".format( country_name , state_name , asciiname )
-					main_names_to_latlon[asciiname_w_state].append( [latitude, longitude] )
+					add_place( asciiname_w_state )
 					unicodename_w_adm1 = "{}:{},{}".format( country_name , state_name , unicodename )
-					alternate_to_ascii[asciiname_w_adm1].append( asciiname_w_adm1 )
+					add_alternate( asciiname_w_adm1, asciiname_w_adm1 )
 					for alternate_name in alternate_names:
 						unicodename_w_adm1 = "{}:{},{}".format( country_name , state_name , alternate_name )
-						alternate_to_ascii[unicodename_w_adm1].append( asciiname_w_adm1 )
+						add_alternate( unicodename_w_adm1, asciiname_w_adm1 )
 
 	if verbose:
 		for feature in sorted(feature_counter.keys()):
@@ -293,25 +408,66 @@ def import_geonames_all_countries(geodata_file, feature_desc_dict, country_code_
 	if verbose:
 		sys.stderr.write("# Most common was {} \n".format( ascii_counts_dict.most_common(50) ) )
 
+	return main_names_to_place, alternate_to_ascii, top_level_place, place_latitudes, place_longitudes, place_formats, fuzzy_names, dict(country_cells)
+
+def import_geonames_all_countries(geodata_file, feature_desc_dict, country_code_dict, verbose=False):
+	'''read allCountries.txt, return GeonamesPlaces of unique placenames'''
+	main_names_to_place, alternate_to_ascii, top_level_place, place_latitudes, place_longitudes, place_formats, fuzzy_names, country_cells = read_geonames_places(geodata_file, feature_desc_dict, country_code_dict, verbose)
+
 	#
 	# begin sorting the unique placenames
 	#
-	unique_name_to_latlon = filter_unique_placenames( main_names_to_latlon, alternate_to_ascii )
-	sys.stderr.write("# Adding {} top level annotations\n".format( len(top_level_latlon) ) )
-	unique_name_to_latlon.update( top_level_latlon )
-	return unique_name_to_latlon
-
-
-if len(sys.argv)<2:
-	sys.exit(__doc__)
-else:
-	geo_feature_descr_dict = import_geonames_features( sys.argv[1] )
-	geo_country_info_dict = import_geonames_country_codes( sys.argv[2] )
-	unique_name_to_latlon = import_geonames_all_countries( sys.argv[3] , geo_feature_descr_dict , geo_country_info_dict )
-
-	make_table = True
-	if make_table:
-		sys.stderr.write("# Writing geonames {}\n".format( make_table ) )
+	unique_name_to_place = filter_unique_placenames( main_names_to_place, alternate_to_ascii )
+	sys.stderr.write("# Adding {} top level annotations\n".format( len(top_level_place) ) )
+	unique_name_to_place.update( top_level_place )
+	return GeonamesPlaces( unique_name_to_place, place_latitudes, place_longitudes, place_formats, fuzzy_names, country_cells )
+
+
+def write_geonames_index(unique_name_to_latlon, indexfile, geodata_file):
+	'''write the GeonamesPlaces of unique place names to an SQLite table of name, latitude, longitude, keyed by name
+	    a table of names of countries and large places for fuzzy matching, and a table of countries with places in each grid cell'''
+	sys.stderr.write("# Writing {} place names to index {}  {}\n".format( len(unique_name_to_latlon), indexfile, time.asctime() ) )
+	# write to a temporary file, so an unfinished index is never used
+	tempfile = "{}.tmp".format(indexfile)
+	if os.path.isfile(tempfile):
+		os.remove(tempfile)
+	connection = sqlite3.connect(tempfile)
+	connection.execute("PRAGMA journal_mode=OFF")
+	connection.execute("PRAGMA synchronous=OFF")
+	connection.execute("CREATE TABLE places (name TEXT PRIMARY KEY, latitude TEXT, longitude TEXT) WITHOUT ROWID")
+	connection.execute("CREATE TABLE fuzzy_names (name TEXT PRIMARY KEY) WITHOUT ROWID")
+	connection.execute("CREATE TABLE country_cells (cell INTEGER, country TEXT, PRIMARY KEY (cell, country)) WITHOUT ROWID")
+	connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+	connection.executemany("INSERT INTO places VALUES (?,?,?)", ( (k, v[0], v[1]) for k,v in unique_name_to_latlon.items() ) )
+	connection.executemany("INSERT INTO fuzzy_names VALUES (?)", ( (name,) for name in unique_name_to_latlon.get_fuzzy_names() ) )
+	connection.executemany("INSERT INTO country_cells VALUES (?,?)", ( (cell, country) for cell, countries in unique_name_to_latlon.get_country_cells().items() for country in countries ) )
+	connection.executemany("INSERT INTO meta VALUES (?,?)", [ ("version", GEONAMES_INDEX_VERSION), ("source", os.path.abspath(geodata_file)), ("places", str(len(unique_name_to_latlon))) ] )
+	connection.commit()
+	connection.close()
+	os.replace(tempfile, indexfile)
+	sys.stderr.write("# Finished index  {}\n".format( time.asctime() ) )
+
+def main(argv, wayout):
+	if not len(argv):
+		argv.append('-h')
+	parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=__doc__)
+	parser.add_argument('geonames_features', help="GeoNames feature codes, from featureCodes_en.txt")
+	parser.add_argument('geonames_countries', help="GeoNames country info, from countryInfo.txt")
+	parser.add_argument('geonames_data', help="GeoNames data, from allCountries.txt")
+	parser.add_argument('--index', help="write place names to this SQLite index, instead of the table to stdout")
+	parser.add_argument('--verbose', action="store_true", help="print counts of each feature and state")
+	args = parser.parse_args(argv)
+
+	geo_feature_descr_dict = import_geonames_features( args.geonames_features )
+	geo_country_info_dict = import_geonames_country_codes( args.geonames_countries )
+	unique_name_to_latlon = import_geonames_all_countries( args.geonames_data , geo_feature_descr_dict , geo_country_info_dict , args.verbose )
+
+	if args.index:
+		write_geonames_index(unique_name_to_latlon, args.index, args.geonames_data)
+	else:
+		sys.stderr.write("# Writing geonames table  {}\n".format( time.asctime() ) )
 		for k,v in unique_name_to_latlon.items():
-			print( "{}\t{}\t{}".format( k,v[0],v[1] ) , file=sys.stdout )
+			wayout.write( "{}\t{}\t{}\n".format( k,v[0],v[1] ) )
 
+if __name__ == "__main__":
+	main(sys.argv[1:], sys.stdout)
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+#
+# metagenome_map_server.py  created 2026-10-19
+
+'''metagenome_map_server.py  last modified 2026-10-19
+    index the polished metagenome table by lat-lon, category and year, and answer
+    queries of the samples in a map view, in pages, over localhost
+
+    build the index once from the output of polish_metagenome_table.py, compressed or not
+metagenome_map_server.py -i NCBI_SRA_Metadata_Full_20210404.metagenomes_latlon-fixed.tab --index metagenomes_map.sqlite
+
+    then serve queries from the index
+metagenome_map_server.py --index metagenomes_map.sqlite &
+
+    a view is given as bbox=south,west,north,east, and optionally
+    category (one or more, separated by commas), years (first,last), limit and after
+curl "http://localhost:8766/samples?bbox=40,-10,60,30&category=soil,marine&years=2010,2015&limit=1000"
+
+    replies are json with samples as a list of the columns of each row of the table,
+    and next, which is given as after= to get the next page, or null if this was the last page
+    west can be greater than east, for views across 180 degrees
+
+    single queries can also be written as a table to stdout
+metagenome_map_server.py --index metagenomes_map.sqlite --bbox 40 -10 60 30 --category soil --years 2010 2015
+'''
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bin_metagenome_map import open_table, get_category_and_source
+
+MAP_INDEX_VERSION = "1"
+default_page_size = 1000
+max_page_size = 100000
+# views with at least this many samples are read in order of the table, instead of from the rtree
+dense_view_samples = 20000
+
+def read_map_rows(inputfile, skipped):
+	'''generator of tuples of id, latitude, longitude, year, category and line, for each row of the polished table
+	    rows without a lat-lon or year are counted in the skipped list'''
+	sample_id = 0
+	for line in open_table(inputfile):
+		line = line.rstrip("\n")
+		if not line or line[0]=="#":
+			continue
+		lsplits = line.split("\t")
+		try:
+			latitude = float(lsplits[5])
+			longitude = float(lsplits[6])
+			year = int(lsplits[7])
+		except (ValueError, IndexError): # such as NA
+			skipped[0] += 1
+			continue
+		# rows are numbered in the order of the table, so pages come in that order
+		sample_id += 1
+		yield (sample_id, latitude, longitude, year, get_category_and_source(lsplits)[0], line)
+
+def write_map_index(inputfile, indexfile):
+	'''write each row of the polished table to an SQLite index, with an rtree of the lat-lon, and indices of category and year'''
+	sys.stderr.write("# Reading {} into index {}  {}\n".format( inputfile, indexfile, time.asctime() ) )
+	# write to a temporary file, so an unfinished index is never used
+	tempfile = "{}.tmp".format(indexfile)
+	if os.path.isfile(tempfile):
+		os.remove(tempfile)
+	connection = sqlite3.connect(tempfile)
+	connection.execute("PRAGMA journal_mode=OFF")
+	connection.execute("PRAGMA synchronous=OFF")
+	connection.execute("CREATE TABLE samples (id INTEGER PRIMARY KEY, latitude REAL, longitude REAL, year INTEGER, category TEXT, line TEXT)")
+	# rtree keeps 32-bit floats, so boxes are a little larger, and lat-lon of samples are checked again
+	# though points on the edge of a view are never missed, as boxes that overlap the view are kept
+	connection.execute("CREATE VIRTUAL TABLE sample_boxes USING rtree(id, min_lat, max_lat, min_lon, max_lon)")
+	connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+	skipped = [0]
+	connection.executemany("INSERT INTO samples VALUES (?,?,?,?,?,?)", read_map_rows(inputfile, skipped) )
+	if skipped[0]:
+		sys.stderr.write("# {} entries had no lat-lon or year, skipped\n".format(skipped[0]) )
+	samplecount = connection.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+	sys.stderr.write("# Indexing lat-lon, category and year of {} samples  {}\n".format( samplecount, time.asctime() ) )
+	connection.execute("INSERT INTO sample_boxes SELECT id, latitude, latitude, longitude, longitude FROM samples")
+	connection.execute("CREATE INDEX samples_category_year ON samples (category, year)")
+	connection.execute("CREATE INDEX samples_year ON samples (year)")
+	connection.executemany("INSERT INTO meta VALUES (?,?)", [ ("version", MAP_INDEX_VERSION), ("source", os.path.abspath(inputfile)), ("samples", str(samplecount)) ] )
+	connection.commit()
+	# statistics let the query planner choose between the rtree and the category index
+	connection.execute("ANALYZE")
+	connection.commit()
+	connection.close()
+	os.replace(tempfile, indexfile)
+	sys.stderr.write("# Finished index of {} samples  {}\n".format( samplecount, time.asctime() ) )
+
+def open_map_index(indexfile):
+	'''return read-only connection to the index, and the number of samples in it'''
+	if not os.path.isfile(indexfile):
+		sys.exit("ERROR: CANNOT FIND MAP INDEX {}, BUILD IT WITH -i".format(indexfile) )
+	# each thread of the server makes queries, so the connection is not tied to one thread
+	connection = sqlite3.connect("file:{}?mode=ro".format(indexfile), uri=True, check_same_thread=False)
+	index_meta = dict(connection.execute("SELECT key, value FROM meta"))
+	if index_meta.get("version") != MAP_INDEX_VERSION:
+		sys.exit("ERROR: MAP INDEX {} IS VERSION {}, NOT {}, REBUILD WITH -i".format(indexfile, index_meta.get("version"), MAP_INDEX_VERSION) )
+	return connection, int(index_meta.get("samples",0))
+
+def query_samples(connection, bbox, categories=[], years=None, limit=default_page_size, after=0):
+	'''return list of rows of the table as lists of columns within bbox of south, west, north, east
+	    and if given, of any of the categories and years from first to last, and the id for the next page, or None
+	    pages are in the order of the table, starting after the row with id after
+	    raise ValueError if limit is less than 1'''
+	if limit < 1:
+		raise ValueError("limit must be at least 1")
+	south, west, north, east = bbox
+	# views across 180 degrees are split into two boxes
+	lon_ranges = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+	box_queries = []
+	box_parameters = []
+	lon_conditions = []
+	for range_west, range_east in lon_ranges:
+		box_queries.append("SELECT id FROM sample_boxes WHERE max_lat>=? AND min_lat<=? AND max_lon>=? AND min_lon<=?")
+		box_parameters.extend( [south, north, range_west, range_east] )
+		lon_conditions.append("longitude BETWEEN ? AND ?")
+	box_query = " UNION ALL ".join(box_queries)
+	conditions = ["id>?", "latitude BETWEEN ? AND ?", "({})".format( " OR ".join(lon_conditions) )]
+	parameters = [after, south, north]
+	for range_west, range_east in lon_ranges:
+		parameters.extend( [range_west, range_east] )
+	if categories:
+		conditions.append( "category IN ({})".format( ",".join("?" * len(categories)) ) )
+		parameters.extend(categories)
+	if years is not None:
+		conditions.append("year BETWEEN ? AND ?")
+		parameters.extend(years)
+	# small views are found with the rtree, then sorted, while views with many samples are
+	# read in order of the table, as a page is filled after reading only a few times as many rows
+	sparse_count = connection.execute( "SELECT COUNT(*) FROM ({} LIMIT ?)".format(box_query), box_parameters + [dense_view_samples] ).fetchone()[0]
+	if sparse_count < dense_view_samples:
+		conditions.append( "id IN ({})".format(box_query) )
+		parameters.extend(box_parameters)
+	# one more than the page is read, to know if there is a next page
+	sql = "SELECT id, line FROM samples WHERE {} ORDER BY id LIMIT ?".format( " AND ".join(conditions) )
+	parameters.append(limit + 1)
+	rows = connection.execute(sql, parameters).fetchall()
+	next_after = rows[limit-1][0] if len(rows) > limit else None
+	return [ line.split("\t") for sample_id, line in rows[:limit] ], next_after
+
+def read_view_query(query):
+	'''return dict of arguments of query_samples from the parsed query string of a request, or raise ValueError'''
+	if "bbox" not in query:
+		raise ValueError("bbox=south,west,north,east is required")
+	bbox = [float(x) for x in query["bbox"][0].split(",")]
+	if len(bbox) != 4:
+		raise ValueError("bbox must be 4 numbers, south,west,north,east")
+	view = {"bbox":bbox}
+	view["categories"] = [ category for value in query.get("category",[]) for category in value.split(",") if category ]
+	if "years" in query:
+		years = [int(x) for x in query["years"][0].split(",")]
+		if len(years) != 2:
+			raise ValueError("years must be 2 numbers, first,last")
+		view["years"] = years
+	view["limit"] = min( int(query.get("limit",[default_page_size])[0]), max_page_size )
+	if view["limit"] < 1:
+		raise ValueError("limit must be at least 1")
+	view["after"] = int(query.get("after",[0])[0])
+	return view
+
+class MapRequestHandler(BaseHTTPRequestHandler):
+	'''answer GET at /samples with bbox= and optionally category= years= limit= after= in the query'''
+	def do_GET(self):
+		parsedpath = urllib.parse.urlparse(self.path)
+		if parsedpath.path != "/samples":
+			self.send_error(404, "only /samples is available")
+			return
+		try:
+			view = read_view_query( urllib.parse.parse_qs(parsedpath.query) )
+		except ValueError as queryerror:
+			self.send_error(400, str(queryerror))
+			return
+		with self.server.index_lock:
+			samples, next_after = query_samples(self.server.connection, **view)
+			self.server.request_count += 1
+		replydata = json.dumps( {"samples":samples, "next":next_after} ).encode("utf-8")
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(replydata)))
+		# so the map app can fetch from another port
+		self.send_header("Access-Control-Allow-Origin", "*")
+		self.end_headers()
+		self.wfile.write(replydata)
+
+	def log_message(self, format, *args):
+		if self.server.verbose:
+			sys.stderr.write("# {} {}\n".format( format % args, time.asctime() ) )
+
+def main(argv, wayout):
+	if not len(argv):
+		argv.append('-h')
+	parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=__doc__)
+	parser.add_argument('-i','--input', help="polished table from polish_metagenome_table.py, to (re)build the index, can be .gz")
+	parser.add_argument('--index', required=True, help="SQLite index of the samples")
+	parser.add_argument('--bbox', type=float, nargs=4, metavar=("SOUTH","WEST","NORTH","EAST"), help="write samples in this box to stdout, instead of serving")
+	parser.add_argument('--category', nargs="*", default=[], help="with --bbox, only write samples of these categories")
+	parser.add_argument('--years', type=int, nargs=2, metavar=("FIRST","LAST"), help="with --bbox, only write samples from these years")
+	parser.add_argument('--host', default="127.0.0.1", help="address to listen, default only allows local connections [127.0.0.1]")
+	parser.add_argument('-p','--port', type=int, default=8766, help="port to listen [8766]")
+	parser.add_argument('-v','--verbose', action="store_true", help="print each request to stderr")
+	args = parser.parse_args(argv)
+
+	if args.input:
+		write_map_index(args.input, args.index)
+	connection, samplecount = open_map_index(args.index)
+
+	if args.bbox:
+		after = 0
+		while after is not None: # write all pages
+			samples, after = query_samples(connection, args.bbox, args.category, args.years, max_page_size, after)
+			for lsplits in samples:
+				wayout.write( "{}\n".format( "\t".join(lsplits) ) )
+		return
+	if args.input: # only build the index
+		return
+
+	server = ThreadingHTTPServer( (args.host, args.port), MapRequestHandler)
+	server.connection = connection
+	server.index_lock = threading.Lock()
+	server.verbose = args.verbose
+	server.request_count = 0
+	sys.stderr.write("# serving {} samples at http://{}:{}/samples  {}\n".format( samplecount, args.host, args.port, time.asctime() ) )
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		sys.stderr.write("# stopping after {} requests  {}\n".format( server.request_count, time.asctime() ) )
+	server.server_close()
+
+if __name__ == "__main__":
+	main(sys.argv[1:], sys.stdout)
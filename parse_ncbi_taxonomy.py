@@ -2,7 +2,7 @@
 #
 # parse_ncbi_taxonomy.py  created by WRF 2018-04-05
 
-'''parse_ncbi_taxonomy.py  last modified 2022-06-28
+'''parse_ncbi_taxonomy.py  last modified 2026-10-19
 
 parse_ncbi_taxonomy.py -n names.dmp -o nodes.dmp -i species_list.txt
 
@@ -20,15 +20,81 @@ parse_ncbi_taxonomy.py -i sample_ext.tab -n names.dmp -o nodes.dmp --metagenomes
     use the --csv tag as:
 
 parse_ncbi_taxonomy.py -n names.dmp -o nodes.dmp --csv -i wgs_selector.csv
+
+    the names and nodes can be converted once into a compact cache folder
+    which is then reused by later runs, without the need for -n or -o
+    name lookups with the cache also match synonyms and equivalent names
+    ignoring case and extra spaces, so "homo  sapiens" finds Homo sapiens
+
+parse_ncbi_taxonomy.py -n names.dmp -o nodes.dmp merged.dmp --cache taxonomy_20220628_cache --csv -i wgs_selector.csv
+parse_ncbi_taxonomy.py --cache taxonomy_20220628_cache -i species_list.txt
+
+    several tables can be made from one pass of the input, where stdout
+    is the normal table, and the others are written to separate files
+parse_ncbi_taxonomy.py --cache taxonomy_20220628_cache -i sample_w_exp.tab --numbers --samples --header --unique-output sample_kingdom_unique.tab --metagenomes-output metagenomes.tab > sample_kingdom.tab
+
+    samples can be restricted to one or more clades, by taxid
+    such as only arthropods (6656) and cnidarians (6073)
+parse_ncbi_taxonomy.py --cache taxonomy_20220628_cache -i sample_w_exp.tab --numbers --samples --header --within 6656,6073 > sample_kingdom.arthropods_cnidaria.tab
+
+    to count distinct species of each group, such as each phylum per year
+    large groups are estimated with HyperLogLog, unless using --exact
+parse_ncbi_taxonomy.py --cache taxonomy_20220628_cache -i sample_w_exp.tab --numbers --samples --distinct --distinct-by phylum year > phylum_year_species.tab
+
+    for summaries of each study, --lca writes the lowest common ancestor
+    of all samples in each folder (the first column) of the samples table
+parse_ncbi_taxonomy.py --cache taxonomy_20220628_cache -i sample_w_exp.tab --numbers --samples --lca > sample_folder_lca.tab
+
+    after a new taxonomy release, taxdiff.py lists the changed taxids, then
+    an older table is updated by only annotating lines with those taxids
+parse_ncbi_taxonomy.py --cache taxonomy_20220628_cache -i sample_w_exp.tab --numbers --samples --header --update-from sample_kingdom_old.tab --changes taxdiff.tab > sample_kingdom.tab
+
+    from python, whole numpy arrays of taxids can be annotated with the cache
+from parse_ncbi_taxonomy import get_taxonomy_cache, lineage_arrays, node_names
+taxcache = get_taxonomy_cache("taxonomy_20220628_cache")
+kingdoms, phyla, classes = lineage_arrays(taxcache, taxid_array)
+phylum_names = node_names(taxcache, phyla)
+
+    for small inputs without a cache, --lazy first reads the input for the
+    taxids or names, then only keeps those names from names.dmp
+parse_ncbi_taxonomy.py -n names.dmp -o nodes.dmp merged.dmp --lazy -i species_list.txt
+
+    large uncompressed tables can be split into chunks for several processes
+    output is in the same order as the input, and --unique is still global
+parse_ncbi_taxonomy.py --cache taxonomy_20220628_cache -i sample_w_exp.tab --numbers --samples --header --workers 8 > sample_kingdom.tab
+
+    if taxonomy_server.py is running, lookups can be sent there instead
+    which avoids reading the taxonomy again for each run
+parse_ncbi_taxonomy.py --server http://localhost:8765 -i sample_w_exp.tab --numbers --samples --header > sample_kingdom.tab
+
+    if only the counts are needed, such as for taxon_barplot.R, --aggregate
+    writes one line per kingdom-phylum-class instead of one line per sample
+    optionally also split by library source or year of the 12-column table
+parse_ncbi_taxonomy.py --cache taxonomy_20220628_cache -i sample_w_exp.tab --numbers --samples --aggregate --aggregate-by source year > sample_kingdom.counts.tab
 '''
 
+import io
+import re
+import json
 import csv
 import sys
 import os
+import mmap
 import time
 import gzip
+import math
+import array
+import hashlib
+import bisect
 import argparse
+import itertools
+import multiprocessing
+import urllib.request
 from collections import defaultdict
+try: # only needed for lineage_arrays and node_names
+	import numpy
+except ImportError:
+	numpy = None
 
 #nodes.dmp
 #---------
@@ -56,8 +122,12 @@ from collections import defaultdict
 #	unique name				-- the unique variant of this name if name not unique
 #	name class				-- (synonym, common name, ...)
 
-def names_to_nodes(namesfile, metagenomes_only=False):
-	'''read names.dmp and return a dict where name is key and value is the node number'''
+def names_to_nodes(namesfile, metagenomes_only=False, needed_nodes=None, needed_names=None):
+	'''read names.dmp and return a dict where name is key and value is the node number
+	    if needed_nodes or needed_names are given, only names of those nodes, or those names, are kept'''
+	only_needed = needed_nodes is not None or needed_names is not None
+	needed_nodes = needed_nodes or set()
+	needed_names = needed_names or set()
 	name_to_node = {}
 	node_to_name = {}
 	sys.stderr.write("# reading species names from {}  {}\n".format(namesfile, time.asctime() ) )
@@ -72,9 +142,16 @@ def names_to_nodes(namesfile, metagenomes_only=False):
 				# if in metagenome mode, skip species names that do not have "metagenome"
 				if metagenomes_only and species.find("metagenome") == -1:
 					continue
+				if only_needed:
+					if species in needed_names:
+						name_to_node[species] = node
+						node_to_name[node] = species
+					elif node in needed_nodes:
+						node_to_name[node] = species
+					continue
 				name_to_node[species] = node
 				node_to_name[node] = species
-	sys.stderr.write("# counted {} scientific names from {}  {}\n".format( len(name_to_node), namesfile, time.asctime() ) )
+	sys.stderr.write("# counted {} scientific names from {}  {}\n".format( len(node_to_name), namesfile, time.asctime() ) )
 	return name_to_node, node_to_name
 
 def nodes_to_parents(nodesfilelist):
@@ -125,6 +202,1057 @@ def clean_name(seqname):
 		seqname = seqname.replace(s,"")
 	return seqname
 
+################################################################################
+
+# taxonomy cache is a folder of flat binary arrays, all memory-mapped when read
+# arrays of nodes are indexed directly by the taxid, so 9606 is position 9606
+# and -1 means that no node exists for that number
+#
+# parents.i32          parent taxid of each node
+# ranks.u8             rank of each node, as index of the ranks in meta.tab
+# sciname_offsets.i64  start of scientific name of each node in sciname_pool.bin
+# namekey_offsets.i64  start of each sorted name key in namekey_pool.bin
+# namekey_nodes.i32    taxid of each name key, or -1 if the name is ambiguous
+# meta.tab             written last, so an interrupted build is not used
+
+TAXCACHE_VERSION = "4"
+TAXCACHE_META = "meta.tab"
+
+# name classes from names.dmp that are included in the name index
+index_name_classes = ["scientific name", "synonym", "equivalent name", "genbank synonym"]
+
+# for --distinct, HyperLogLog sketches have 2**12 registers, for about 1.6% error
+# groups keep exact sets of taxids until they have more than 1024, then change to a sketch
+hll_precision = 12
+hll_exact_limit = 1024
+
+# for --aggregate-by year, years from 1900 to 2099 in the raw collection date
+year_pattern = re.compile(r"((?:19|20)\d\d)")
+
+def normalize_name(speciesname):
+	'''return name as lowercase with single spaces, as used for keys in the name index'''
+	return " ".join(speciesname.split()).lower()
+
+def write_cache_array(cachedir, filename, values):
+	'''write array or bytes to a file in the cache folder'''
+	with open(os.path.join(cachedir, filename), 'wb') as cachefile:
+		cachefile.write(values)
+
+def read_cache_array(cachedir, filename, typecode=None):
+	'''memory-map a file from the cache folder, and return as array of typecode, or as bytes if no typecode'''
+	cachepath = os.path.join(cachedir, filename)
+	if os.path.getsize(cachepath)==0: # mmap cannot map empty files
+		return array.array(typecode) if typecode else b""
+	with open(cachepath,'rb') as cachefile:
+		cachemap = mmap.mmap(cachefile.fileno(), 0, access=mmap.ACCESS_READ)
+	if typecode is None:
+		return cachemap
+	return memoryview(cachemap).cast(typecode)
+
+def read_cache_meta(cachedir, metaname=TAXCACHE_META):
+	'''read meta.tab from the cache folder, return a dict, which is empty if there is no finished cache'''
+	cache_meta = {}
+	metafile = os.path.join(cachedir, metaname)
+	if os.path.isfile(metafile):
+		for line in open(metafile,'r'):
+			lsplits = line.rstrip("\n").split("\t",1)
+			if len(lsplits)==2:
+				cache_meta[lsplits[0]] = lsplits[1]
+	return cache_meta
+
+def compute_clade_intervals(node_parents):
+	'''return two arrays of the first and last position of each node in a depth-first order of the tree from the root
+	    node X is within clade C if start[C] <= start[X] <= end[C], nodes that are not connected to the root are -1'''
+	nodecount = len(node_parents)
+	# children of node N are children[child_offsets[N]:child_offsets[N+1]]
+	child_counts = array.array('q', bytes(8 * (nodecount+1)))
+	for node, parent in enumerate(node_parents):
+		if 0 <= parent < nodecount and parent != node:
+			child_counts[parent+1] += 1
+	child_offsets = array.array('q', itertools.accumulate(child_counts))
+	next_child = array.array('q', child_offsets)
+	children = array.array('i', bytes(4 * child_offsets[-1]))
+	for node, parent in enumerate(node_parents):
+		if 0 <= parent < nodecount and parent != node:
+			children[next_child[parent]] = node
+			next_child[parent] += 1
+	clade_start = array.array('i', [-1]) * nodecount
+	clade_end = array.array('i', [-1]) * nodecount
+	position = 0
+	node_stack = [1] if nodecount > 1 else []
+	while node_stack: # negative values mark the end of that clade
+		node = node_stack.pop()
+		if node < 0:
+			clade_end[~node] = position - 1
+			continue
+		clade_start[node] = position
+		position += 1
+		node_stack.append(~node)
+		node_stack.extend( children[child_offsets[node]:child_offsets[node+1]] )
+	return clade_start, clade_end
+
+def parents_from_dict(node_to_parent):
+	'''convert dict of parents from nodes_to_parents into an array indexed by node, where missing nodes are -1'''
+	node_parents = array.array('i', [-1]) * (max(int(n) for n in node_to_parent) + 1)
+	for node, parent in node_to_parent.items():
+		node_parents[int(node)] = int(parent)
+	return node_parents
+
+def clade_position(nodenumber, clade_start):
+	'''return the depth-first position of the node, or -1 if the node is not in the tree'''
+	try:
+		node = int(nodenumber)
+	except (TypeError, ValueError):
+		return -1
+	if node < 0 or node >= len(clade_start):
+		return -1
+	return clade_start[node]
+
+def node_in_clades(nodenumber, clade_start, outer_starts, outer_ends):
+	'''return True if the node is inside any of the clades, given as sorted lists of non-overlapping start and end positions'''
+	position = clade_position(nodenumber, clade_start)
+	if position < 0:
+		return False
+	i = bisect.bisect_right(outer_starts, position) - 1
+	return i >= 0 and position <= outer_ends[i]
+
+def preorder_nodes(clade_start):
+	'''return array of all nodes connected to the root in depth-first order, so parents always come before children'''
+	preorder = array.array('i', [-1]) * len(clade_start)
+	for node in range(len(clade_start)):
+		if clade_start[node] >= 0:
+			preorder[clade_start[node]] = node
+	return preorder[:max(clade_start)+1] if len(clade_start) else preorder
+
+def compute_ancestor_jumps(node_parents, clade_start):
+	'''return list of arrays, where array K has the ancestor 2**K levels above each node
+	    the root is its own ancestor, and nodes that are not connected to the root are -1'''
+	nodecount = len(node_parents)
+	parent_jumps = array.array('i', [-1]) * nodecount
+	node_depths = array.array('i', [0]) * nodecount
+	for node in preorder_nodes(clade_start):
+		parent = node_parents[node]
+		if parent == node or clade_start[parent] < 0: # root
+			parent_jumps[node] = node
+		else:
+			parent_jumps[node] = parent
+			node_depths[node] = node_depths[parent] + 1
+	ancestor_jumps = [parent_jumps]
+	for level in range(1, max(1, max(node_depths).bit_length()) ):
+		previous = ancestor_jumps[-1]
+		ancestor_jumps.append( array.array('i', [ previous[up] if up >= 0 else -1 for up in previous ]) )
+	return ancestor_jumps
+
+def compute_lineage_arrays(node_parents, node_ranks, clade_start, rank_codes):
+	'''return three arrays of the kingdom, phylum and class of each node, the same as from get_parent_tree
+	    where -1 is None, and -2 is for deleted nodes, or nodes not connected to the root'''
+	nodecount = len(node_parents)
+	lineages = [array.array('i', [-2]) * nodecount for rank_code in rank_codes]
+	for node in preorder_nodes(clade_start):
+		parent = node_parents[node]
+		for i, (lineage, rank_code) in enumerate(zip(lineages, rank_codes)):
+			if node == 1 or parent == node: # the walk stops at the root, so it is never counted
+				lineage[node] = -1
+			elif lineage[parent] >= 0: # walking up, higher nodes of the same rank would replace it
+				lineage[node] = lineage[parent]
+			elif node_ranks[node] == rank_code or (i==0 and (node==2 or node==2157)): # for bacteria and archaea
+				lineage[node] = node
+			else:
+				lineage[node] = -1
+	return lineages
+
+def node_lca(nodenumber_a, nodenumber_b, clade_start, clade_end, ancestor_jumps):
+	'''return the lowest common ancestor of two nodes as string, or None if either is not in the tree
+	    by moving A up while it is not an ancestor of B, in steps of decreasing powers of 2'''
+	position_a = clade_position(nodenumber_a, clade_start)
+	position_b = clade_position(nodenumber_b, clade_start)
+	if position_a < 0 or position_b < 0:
+		return None
+	node = int(nodenumber_a)
+	if position_a <= position_b <= clade_end[node]:
+		return str(node)
+	for level in reversed(ancestor_jumps):
+		up = level[node]
+		if not clade_start[up] <= position_b <= clade_end[up]:
+			node = up
+	return str(ancestor_jumps[0][node])
+
+def make_clade_filter(clade_start, clade_end, within_nodes):
+	'''return function of node number, which is True if the node is within any of the clades of within_nodes'''
+	intervals = []
+	for nodenumber in within_nodes:
+		node = int(nodenumber)
+		if node < 0 or node >= len(clade_start) or clade_start[node] < 0:
+			sys.stderr.write("WARNING: CLADE {} NOT IN TAXONOMY, IGNORING\n".format(nodenumber) )
+			continue
+		intervals.append( (clade_start[node], clade_end[node]) )
+	# clades are either nested or separate, so only the outermost are needed
+	outer_starts = []
+	outer_ends = []
+	for start, end in sorted(intervals):
+		if outer_ends and start <= outer_ends[-1]:
+			continue
+		outer_starts.append(start)
+		outer_ends.append(end)
+	sys.stderr.write("# keeping nodes within {} clades  {}\n".format( len(outer_starts), time.asctime() ) )
+	return lambda x: node_in_clades(x, clade_start, outer_starts, outer_ends)
+
+def nodes_to_arrays(nodesfilelist):
+	'''read nodes.dmp into arrays indexed by node, return array of parents where missing nodes are -1,
+	    bytearray of rank codes, list of rank names for each code, and dict of rank name to code'''
+	node_parents = array.array('i')
+	node_ranks = bytearray()
+	rank_names = ["no rank"]
+	rank_to_code = {"no rank":0}
+	nodecount = 0
+	maxnode = 0
+	for nodesfile in nodesfilelist:
+		sys.stderr.write("# reading nodes from {}  {}\n".format(nodesfile, time.asctime() ) )
+		for line in open(nodesfile,'r'):
+			line = line.strip()
+			if line:
+				lsplits = [s.strip() for s in line.split("|")]
+				node = int(lsplits[0])
+				if node >= len(node_parents): # grow by at least double, trim at the end
+					grow = max(node + 1, 2 * len(node_parents)) - len(node_parents)
+					node_parents.extend( array.array('i', [-1]) * grow )
+					node_ranks.extend( bytes(grow) )
+				rank = lsplits[2]
+				if rank not in rank_to_code:
+					rank_to_code[rank] = len(rank_names)
+					rank_names.append(rank)
+				if node_parents[node] == -1:
+					nodecount += 1
+					maxnode = max(maxnode, node)
+				node_parents[node] = int(lsplits[1])
+				node_ranks[node] = rank_to_code[rank]
+	del node_parents[maxnode+1:]
+	del node_ranks[maxnode+1:]
+	sys.stderr.write("# counted {} nodes, up to {}  {}\n".format( nodecount, maxnode, time.asctime() ) )
+	return node_parents, node_ranks, rank_names, rank_to_code
+
+def build_taxonomy_cache(namesfile, nodesfilelist, cachedir):
+	'''read names.dmp and nodes.dmp, and write all nodes and the name index as arrays to the cache folder'''
+	if not os.path.isdir(cachedir):
+		os.makedirs(cachedir)
+	# remove the meta of an older cache first, so an interrupted rebuild is not used
+	metafile = os.path.join(cachedir, TAXCACHE_META)
+	if os.path.isfile(metafile):
+		os.remove(metafile)
+
+	node_parents, node_ranks, rank_names, rank_to_code = nodes_to_arrays(nodesfilelist)
+	maxnode = len(node_parents) - 1
+
+	scientific_names = {} # key is taxid as int, value is name
+	namekey_entries = [] # tuples of normalized name, order in file, taxid, if scientific name
+	sys.stderr.write("# reading species names from {}  {}\n".format(namesfile, time.asctime() ) )
+	for line in open(namesfile,'r'):
+		line = line.strip()
+		if line:
+			lsplits = [s.strip() for s in line.split("|")]
+			nameclass = lsplits[3]
+			if nameclass in index_name_classes:
+				node = int(lsplits[0])
+				is_scientific = nameclass=="scientific name"
+				if is_scientific:
+					scientific_names[node] = lsplits[1]
+				namekey_entries.append( (normalize_name(lsplits[1]).encode("utf-8"), len(namekey_entries), node, is_scientific) )
+	sys.stderr.write("# counted {} scientific names and {} indexed names from {}  {}\n".format( len(scientific_names), len(namekey_entries), namesfile, time.asctime() ) )
+
+	# scientific names are written in order of taxid, so the name of node N is pool[offsets[N]:offsets[N+1]]
+	sciname_pool = bytearray()
+	sciname_offsets = array.array('q', [0])
+	for node in range( max(maxnode, max(scientific_names or [0])) + 1 ):
+		sciname_pool.extend( scientific_names.get(node,"").encode("utf-8") )
+		sciname_offsets.append( len(sciname_pool) )
+
+	# sort keys, then resolve duplicate keys
+	# scientific names take priority, and as for the dict, the last one read is kept
+	# otherwise synonyms must all point to one node, or the key is ambiguous
+	namekey_entries.sort()
+	namekey_pool = bytearray()
+	namekey_offsets = array.array('q', [0])
+	namekey_nodes = array.array('i')
+	ambiguous_keys = 0
+	for namekey, entries in itertools.groupby(namekey_entries, key=lambda x: x[0]):
+		entries = list(entries)
+		sci_nodes = [e[2] for e in entries if e[3]]
+		if sci_nodes:
+			key_node = sci_nodes[-1]
+		elif len(set(e[2] for e in entries))==1:
+			key_node = entries[0][2]
+		else:
+			key_node = -1
+			ambiguous_keys += 1
+		namekey_pool.extend(namekey)
+		namekey_offsets.append( len(namekey_pool) )
+		namekey_nodes.append( key_node )
+	sys.stderr.write("# indexed {} name keys, {} were ambiguous  {}\n".format( len(namekey_nodes), ambiguous_keys, time.asctime() ) )
+
+	write_cache_array(cachedir, "parents.i32", node_parents)
+	write_cache_array(cachedir, "ranks.u8", node_ranks)
+	write_cache_array(cachedir, "sciname_pool.bin", sciname_pool)
+	write_cache_array(cachedir, "sciname_offsets.i64", sciname_offsets)
+	write_cache_array(cachedir, "namekey_pool.bin", namekey_pool)
+	write_cache_array(cachedir, "namekey_offsets.i64", namekey_offsets)
+	write_cache_array(cachedir, "namekey_nodes.i32", namekey_nodes)
+	clade_start, clade_end = compute_clade_intervals(node_parents)
+	write_cache_array(cachedir, "clade_start.i32", clade_start)
+	write_cache_array(cachedir, "clade_end.i32", clade_end)
+	# all levels are in one file, each the length of parents
+	ancestor_jumps = compute_ancestor_jumps(node_parents, clade_start)
+	write_cache_array(cachedir, "ancestor_jumps.i32", b"".join(level.tobytes() for level in ancestor_jumps) )
+	rank_codes = [rank_to_code.get(rank, -1) for rank in ["kingdom", "phylum", "class"]]
+	for lineage, filename in zip(compute_lineage_arrays(node_parents, node_ranks, clade_start, rank_codes), ["kingdom.i32", "phylum.i32", "class.i32"]):
+		write_cache_array(cachedir, filename, lineage)
+	with open(os.path.join(cachedir, TAXCACHE_META), 'w') as metafile:
+		metafile.write("version\t{}\n".format(TAXCACHE_VERSION) )
+		metafile.write("names\t{}\n".format( os.path.abspath(namesfile) ) )
+		metafile.write("nodes\t{}\n".format( ",".join(os.path.abspath(n) for n in nodesfilelist) ) )
+		metafile.write("ranks\t{}\n".format( ",".join(rank_names) ) )
+		metafile.write("jump_levels\t{}\n".format( len(ancestor_jumps) ) )
+	sys.stderr.write("# wrote taxonomy cache to {}  {}\n".format(cachedir, time.asctime() ) )
+
+def load_taxonomy_cache(cachedir):
+	'''memory-map all arrays from the cache folder, and return a dict of the arrays'''
+	sys.stderr.write("# reading taxonomy cache from {}  {}\n".format(cachedir, time.asctime() ) )
+	cache_meta = read_cache_meta(cachedir)
+	rank_names = cache_meta["ranks"].split(",")
+	taxcache = {"rank_names": rank_names,
+				"kingdom_code": rank_names.index("kingdom") if "kingdom" in rank_names else -1,
+				"phylum_code": rank_names.index("phylum") if "phylum" in rank_names else -1,
+				"class_code": rank_names.index("class") if "class" in rank_names else -1,
+				"parents": read_cache_array(cachedir, "parents.i32", 'i'),
+				"ranks": read_cache_array(cachedir, "ranks.u8", 'B'),
+				"sciname_pool": read_cache_array(cachedir, "sciname_pool.bin"),
+				"sciname_offsets": read_cache_array(cachedir, "sciname_offsets.i64", 'q'),
+				"namekey_pool": read_cache_array(cachedir, "namekey_pool.bin"),
+				"namekey_offsets": read_cache_array(cachedir, "namekey_offsets.i64", 'q'),
+				"namekey_nodes": read_cache_array(cachedir, "namekey_nodes.i32", 'i'),
+				"clade_start": read_cache_array(cachedir, "clade_start.i32", 'i'),
+				"clade_end": read_cache_array(cachedir, "clade_end.i32", 'i'),
+				"kingdom": read_cache_array(cachedir, "kingdom.i32", 'i'),
+				"phylum": read_cache_array(cachedir, "phylum.i32", 'i'),
+				"class": read_cache_array(cachedir, "class.i32", 'i') }
+	all_jumps = read_cache_array(cachedir, "ancestor_jumps.i32", 'i')
+	nodecount = len(taxcache["parents"])
+	taxcache["ancestor_jumps"] = [ all_jumps[level*nodecount:(level+1)*nodecount] for level in range(int(cache_meta["jump_levels"])) ]
+	sys.stderr.write("# cache has {} name keys for nodes up to {}  {}\n".format( len(taxcache["namekey_nodes"]), len(taxcache["parents"])-1, time.asctime() ) )
+	return taxcache
+
+def get_taxonomy_cache(cachedir, namesfile=None, nodesfilelist=None):
+	'''load the cache folder, first building it from names.dmp and nodes.dmp if it is missing or outdated,
+	    or if it was built from other files than the names.dmp and nodes.dmp that are given'''
+	cache_meta = read_cache_meta(cachedir)
+	if cache_meta.get("version") != TAXCACHE_VERSION:
+		if namesfile is None or not nodesfilelist:
+			sys.exit("ERROR: NO CURRENT TAXONOMY CACHE IN {}, NEED -n AND -o TO BUILD IT".format(cachedir) )
+		build_taxonomy_cache(namesfile, nodesfilelist, cachedir)
+	elif namesfile is not None and nodesfilelist:
+		cache_sources = [ cache_meta.get("names"), cache_meta.get("nodes") ]
+		given_sources = [ os.path.abspath(namesfile), ",".join(os.path.abspath(n) for n in nodesfilelist) ]
+		if cache_sources != given_sources:
+			sys.stderr.write("# taxonomy cache {} was built from {} {}, rebuilding from -n and -o\n".format(cachedir, cache_sources[0], cache_sources[1]) )
+			build_taxonomy_cache(namesfile, nodesfilelist, cachedir)
+	return load_taxonomy_cache(cachedir)
+
+def cache_node_index(taxcache, nodenumber):
+	'''return node number as int if the node exists in the cache, otherwise -1'''
+	try:
+		node = int(nodenumber)
+	except (TypeError, ValueError):
+		return -1
+	if 0 <= node < len(taxcache["parents"]) and taxcache["parents"][node] != -1:
+		return node
+	return -1
+
+def cache_node_to_name(taxcache, nodenumber, metagenomes_only=False):
+	'''return scientific name of the node from the cache, or None'''
+	try:
+		node = int(nodenumber)
+	except (TypeError, ValueError):
+		return None
+	offsets = taxcache["sciname_offsets"]
+	if node < 0 or node + 1 >= len(offsets) or offsets[node]==offsets[node+1]:
+		return None
+	speciesname = taxcache["sciname_pool"][offsets[node]:offsets[node+1]].decode("utf-8")
+	# as in names_to_nodes, metagenome mode ignores names without "metagenome"
+	return filter_metagenome_name(speciesname, metagenomes_only)
+
+def cache_name_to_node(taxcache, speciesname, metagenomes_only=False):
+	'''find the normalized name in the name index by binary search, return node number as string, or None'''
+	namekey = normalize_name(speciesname).encode("utf-8")
+	pool = taxcache["namekey_pool"]
+	offsets = taxcache["namekey_offsets"]
+	lower = 0
+	upper = len(taxcache["namekey_nodes"])
+	while lower < upper:
+		middle = (lower + upper) // 2
+		if pool[offsets[middle]:offsets[middle+1]] < namekey:
+			lower = middle + 1
+		else:
+			upper = middle
+	if lower == len(taxcache["namekey_nodes"]) or pool[offsets[lower]:offsets[lower+1]] != namekey:
+		return None
+	node = taxcache["namekey_nodes"][lower]
+	if node < 0: # ambiguous synonym
+		return None
+	if metagenomes_only and cache_node_to_name(taxcache, node, True) is None:
+		return None
+	return str(node)
+
+def cache_parent_tree(taxcache, nodenumber):
+	'''same as get_parent_tree, but from the lineage arrays of the cache, or walking the parent arrays'''
+	if "kingdom" in taxcache:
+		node = cache_node_index(taxcache, nodenumber)
+		lineage = [taxcache[rank][node] for rank in ["kingdom", "phylum", "class"]] if node >= 0 else [-2, -2, -2]
+		if lineage[0] == -2:
+			sys.stderr.write("WARNING: NODE {} MISSING, CHECK delnodes.dmp\n".format(nodenumber) )
+			return ["Deleted","Deleted","Deleted"]
+		return [str(n) if n >= 0 else None for n in lineage]
+	parents = taxcache["parents"]
+	ranks = taxcache["ranks"]
+	kingdom = None
+	phylum = None
+	pclass = None
+	node = cache_node_index(taxcache, nodenumber)
+	while node != 1:
+		if node == -1 or parents[node] == -1:
+			sys.stderr.write("WARNING: NODE {} MISSING, CHECK delnodes.dmp\n".format(nodenumber) )
+			return ["Deleted","Deleted","Deleted"]
+		if ranks[node]==taxcache["kingdom_code"]:
+			kingdom = str(node)
+		elif ranks[node]==taxcache["phylum_code"]:
+			phylum = str(node)
+		elif ranks[node]==taxcache["class_code"]:
+			pclass = str(node)
+		if node==2 or node==2157: # for bacteria and archaea
+			kingdom = str(node)
+		nodenumber = parents[node]
+		node = nodenumber if 0 <= nodenumber < len(parents) else -1
+	return [kingdom, phylum, pclass]
+
+def lineage_arrays(taxcache, taxids):
+	'''for a numpy array of taxids, return numpy arrays of the kingdom, phylum and class taxids from the cache
+	    where -1 is None, and -2 is for deleted or missing nodes'''
+	if numpy is None:
+		raise ImportError("lineage_arrays needs numpy")
+	taxids = numpy.asarray(taxids, dtype=numpy.int64)
+	is_valid = (taxids >= 0) & (taxids < len(taxcache["parents"]))
+	valid_taxids = numpy.where(is_valid, taxids, 0)
+	lineages = []
+	for rank in ["kingdom", "phylum", "class"]:
+		rank_array = numpy.frombuffer(taxcache[rank], dtype=numpy.int32) # no copy of the memory-mapped file
+		lineages.append( numpy.where(is_valid, rank_array[valid_taxids], -2) )
+	return lineages
+
+def node_names(taxcache, taxids, missing="None"):
+	'''for a numpy array of taxids, return numpy array of scientific names, where nodes without names are given as missing
+	    each name is only decoded once, so this is fast for arrays from lineage_arrays'''
+	if numpy is None:
+		raise ImportError("node_names needs numpy")
+	unique_taxids, name_index = numpy.unique(numpy.asarray(taxids, dtype=numpy.int64), return_inverse=True)
+	unique_names = numpy.array( [cache_node_to_name(taxcache, n) or missing for n in unique_taxids.tolist()], dtype=object)
+	return unique_names[name_index.reshape(-1)].reshape(numpy.shape(taxids))
+
+def filter_metagenome_name(speciesname, metagenomes_only=False):
+	'''return the name, or None if in metagenome mode and the name does not have "metagenome"'''
+	if metagenomes_only and speciesname is not None and speciesname.find("metagenome") == -1:
+		return None
+	return speciesname
+
+def scan_input_keys(inputlines, samples=False, numbers=False, csvmode=False):
+	'''first pass for --lazy, return set of all taxids or species names in the input'''
+	input_keys = set()
+	if csvmode:
+		for lsplits in csv.reader(inputlines):
+			if len(lsplits) > 4:
+				input_keys.add(lsplits[4])
+	else:
+		for line in inputlines:
+			line = line.strip()
+			if line:
+				taxid = get_line_taxid(line, samples, numbers, False)
+				if taxid is not None:
+					input_keys.add(taxid)
+	sys.stderr.write("# found {} distinct {} in the input  {}\n".format( len(input_keys), "taxids" if numbers else "names", time.asctime() ) )
+	return input_keys
+
+def ancestor_nodes(node_parents, nodes):
+	'''return set of the nodes and all of their ancestors as strings, ignoring nodes that are not numbers'''
+	ancestors = set()
+	for nodenumber in nodes:
+		try:
+			node = int(nodenumber)
+		except ValueError:
+			continue
+		while 0 <= node < len(node_parents) and str(node) not in ancestors:
+			ancestors.add(str(node))
+			node = node_parents[node]
+	return ancestors
+
+def make_lookups(cachedir=None, namesfile=None, nodesfilelist=None, metagenomes_only=False, within_nodes=[], lca=False, lazy_keys=None):
+	'''set up lookups from either the cache or the dicts, and return a dict of functions, for name to node, node to name,
+	    node to lineage, and node to rank, then if within_nodes are given, if the node is within those clades,
+	    and if lca, the position of a node and the lowest common ancestor of two nodes, otherwise those are None
+	    if lazy_keys are given, nodes are kept as arrays, and only names of those keys and of ranks in the output are kept
+	    with a cache, the loaded cache is also included as taxcache'''
+	lookups = {"is_within":None, "get_position":None, "get_lca":None, "taxcache":None}
+	if cachedir:
+		taxcache = get_taxonomy_cache(cachedir, namesfile, nodesfilelist)
+		lookups["taxcache"] = taxcache
+		lookups["get_node"] = lambda x: cache_name_to_node(taxcache, x, metagenomes_only)
+		lookups["get_name"] = lambda x: cache_node_to_name(taxcache, x, metagenomes_only)
+		lookups["get_lineage"] = lambda x: cache_parent_tree(taxcache, x)
+		lookups["get_rank"] = lambda x: taxcache["rank_names"][taxcache["ranks"][int(x)]] if cache_node_index(taxcache, x) >= 0 else None
+		clade_start, clade_end = taxcache["clade_start"], taxcache["clade_end"]
+		ancestor_jumps = taxcache["ancestor_jumps"]
+	elif lazy_keys is not None:
+		node_parents, node_ranks, rank_names, rank_to_code = nodes_to_arrays(nodesfilelist)
+		# same keys as the cache, so the tree can be walked by cache_parent_tree
+		nodearrays = {"parents":node_parents, "ranks":node_ranks, "rank_names":rank_names,
+					"kingdom_code":rank_to_code.get("kingdom",-1), "phylum_code":rank_to_code.get("phylum",-1), "class_code":rank_to_code.get("class",-1)}
+		lineage_codes = set( rank_to_code.get(rank,-1) for rank in ["kingdom", "phylum", "class"] )
+		needed_nodes = set( str(node) for node, rank_code in enumerate(node_ranks) if rank_code in lineage_codes and node_parents[node] != -1 )
+		needed_nodes.update( ["2", "2157"] )
+		needed_nodes.update( ancestor_nodes(node_parents, lazy_keys) )
+		name_to_node, node_to_name = names_to_nodes(namesfile, metagenomes_only, needed_nodes, lazy_keys)
+		# for names as input, the ancestors are only known now, but are only needed for names of the LCA
+		if lca:
+			missing_nodes = ancestor_nodes(node_parents, name_to_node.values()).difference(node_to_name)
+			if missing_nodes:
+				node_to_name.update( names_to_nodes(namesfile, metagenomes_only, missing_nodes)[1] )
+		lookups["get_node"] = lambda x: name_to_node.get(x,None)
+		lookups["get_name"] = lambda x: node_to_name.get(x,None)
+		lookups["get_lineage"] = lambda x: cache_parent_tree(nodearrays, x)
+		lookups["get_rank"] = lambda x: rank_names[node_ranks[int(x)]] if cache_node_index(nodearrays, x) >= 0 else None
+		if within_nodes or lca:
+			clade_start, clade_end = compute_clade_intervals(node_parents)
+		if lca:
+			ancestor_jumps = compute_ancestor_jumps(node_parents, clade_start)
+	else:
+		name_to_node, node_to_name = names_to_nodes(namesfile, metagenomes_only)
+		node_to_rank, node_to_parent = nodes_to_parents(nodesfilelist)
+		lookups["get_node"] = lambda x: name_to_node.get(x,None)
+		lookups["get_name"] = lambda x: node_to_name.get(x,None)
+		lookups["get_lineage"] = lambda x: get_parent_tree(x, node_to_rank, node_to_parent)
+		lookups["get_rank"] = lambda x: node_to_rank.get(x,None)
+		# same arrays as in the cache, but only made if needed
+		if within_nodes or lca:
+			node_parents = parents_from_dict(node_to_parent)
+			clade_start, clade_end = compute_clade_intervals(node_parents)
+		if lca:
+			ancestor_jumps = compute_ancestor_jumps(node_parents, clade_start)
+	if within_nodes:
+		lookups["is_within"] = make_clade_filter(clade_start, clade_end, within_nodes)
+	if lca:
+		lookups["get_position"] = lambda x: clade_position(x, clade_start)
+		lookups["get_lca"] = lambda x, y: node_lca(x, y, clade_start, clade_end, ancestor_jumps)
+	return lookups
+
+def fill_server_lookups(server, server_lookups, taxids=[], names=[]):
+	'''ask taxonomy_server.py for all taxids and names that are not already known, and add the replies to the lookup dicts'''
+	new_taxids = [t for t in set(taxids) if t is not None and t not in server_lookups["lineages"]]
+	new_names = [n for n in set(names) if n is not None and n not in server_lookups["nodes"]]
+	if not new_taxids and not new_names:
+		return
+	request_data = json.dumps({"taxids":new_taxids, "names":new_names}).encode("utf-8")
+	server_request = urllib.request.Request("{}/lookup".format(server.rstrip("/")), data=request_data, headers={"Content-Type":"application/json"})
+	with urllib.request.urlopen(server_request) as server_reply:
+		reply = json.loads(server_reply.read().decode("utf-8"))
+	for lookup_type in ["nodes", "names", "lineages"]:
+		server_lookups[lookup_type].update( reply[lookup_type] )
+
+def server_name_to_node(server_lookups, speciesname, metagenomes_only=False):
+	'''return node for a name from the lookups of the server, or None'''
+	node = server_lookups["nodes"].get(speciesname,None)
+	if node is not None and filter_metagenome_name(server_lookups["names"].get(node,None), metagenomes_only) is None:
+		return None
+	return node
+
+def prefetch_from_server(inputlines, server, server_lookups, samples=False, numbers=False, blocksize=100000):
+	'''generator of input lines, where all taxids or names in each block of lines are first looked up in one request'''
+	block = []
+	for line in itertools.chain(inputlines, [None]):
+		if line is not None:
+			block.append(line)
+		if len(block) >= blocksize or (line is None and block):
+			block_ids = [get_line_taxid(l.strip(), samples, numbers, False) for l in block if l.strip()]
+			if numbers:
+				fill_server_lookups(server, server_lookups, taxids=block_ids)
+			else:
+				fill_server_lookups(server, server_lookups, names=block_ids)
+			for blockline in block:
+				yield blockline
+			block = []
+
+def get_line_taxid(line, samples=False, numbers=False, verbose=True):
+	'''return the taxid or species name from one stripped line of the input, or None if columns are missing'''
+	# if reading directly from 4-column samples file, extract sample ID
+	if samples: # only the first columns are needed, so the rest of the line is not split
+		lsplits = line.split("\t", 4)
+		if len(lsplits) < 4: # columns missing somehow, skip
+			if verbose:
+				sys.stderr.write("# ERROR: MISSING COLUMNS IN:\n{}\n".format(line) )
+			return None
+		if numbers:
+			taxid = lsplits[2]
+			if len(lsplits) > 4: # likely tabs in sample alias
+				taxid = lsplits[3]
+		else: # use species name
+			taxid = lsplits[3]
+	else: # otherwise each line is a sample name or number
+		taxid = line
+	return taxid
+
+def new_output_counts():
+	'''return a dict of counts for one output table'''
+	return {"node_tracker":{}, "null_entry_counts":defaultdict(int), "first_entries":[], "skipped":0, "found":0, "written":0, "outside":0}
+
+def annotate_lines(inputlines, wayouts, get_node, get_name, get_lineage, samples=False, numbers=False, output_modes=[(False,False)], within=None):
+	'''annotate each line of the tabular input, write to each of wayouts, and return a list of dicts of the counts for each
+	    output_modes is a list of tuples of unique and metagenomes_only, one for each of wayouts
+	    if within is given, lines are skipped unless within(node) is True'''
+	all_counts = [new_output_counts() for wayout in wayouts]
+	for line in inputlines:
+		line = line.strip()
+		if line:
+			taxid = get_line_taxid(line, samples, numbers)
+			if taxid is None:
+				continue
+
+			# input lines are NCBI numbers, meaning get species name from that
+			if numbers:
+				speciesname = get_name(taxid)
+				node_id = taxid
+			else: # meaning input lines are species names, like Danio rerio
+				speciesname = taxid
+				node_id = get_node(speciesname)
+			if within is not None and not within(node_id):
+				for counts in all_counts:
+					counts["outside"] += 1
+				continue
+			if speciesname is not None: # remove any # that would disrupt downstream analyses
+				speciesname = clean_name(speciesname)
+			normal_outputstring = None # same for all normal mode outputs, so only made once
+			for wayout, (unique, metagenomes_only), counts in zip(wayouts, output_modes, all_counts):
+				out_node, out_name = node_id, speciesname
+				# as in names_to_nodes, metagenome mode ignores names without "metagenome"
+				if metagenomes_only:
+					if numbers:
+						out_name = filter_metagenome_name(speciesname, True)
+					elif node_id is not None and filter_metagenome_name(get_name(node_id), True) is None:
+						out_node = None
+				# add one for each node
+				node_tracker = counts["node_tracker"]
+				node_tracker[out_node] = node_tracker.get(out_node, 0) + 1
+				# in unique mode, if node has been seen before then skip it
+				if unique and node_tracker.get(out_node,0) > 1:
+					counts["skipped"] += 1
+					continue
+
+				if out_node is not None:
+					counts["found"] += 1
+					if metagenomes_only:
+						if out_name is None:
+							counts["skipped"] += 1
+							if unique:
+								counts["first_entries"].append( (out_node, -1, 0) )
+							continue
+						cleaned_line = clean_name(line)
+						# column is redundant with ncbi_category, remove "metagenome" for ease of later indexing
+						metagenome_category = out_name.replace(" metagenome","").strip()
+						outputstring = "{}\t{}\n".format( cleaned_line, metagenome_category )
+					else: # normal mode
+						finalnodes = get_lineage(out_node)
+						if normal_outputstring is None:
+							normal_outputstring = "{}\t{}\t{}\t{}\n".format( out_name, get_name(finalnodes[0]) or "None", get_name(finalnodes[1]) or "None", get_name(finalnodes[2]) or "None" )
+						outputstring = normal_outputstring
+
+						# check for deleted nodes, add to null entries
+						if finalnodes[0]=="Deleted":
+							counts["null_entry_counts"][out_node] += 1
+				else:
+					counts["null_entry_counts"][out_node] += 1
+					outputstring = "{}\tNone\tNone\tNone\n".format( out_name )
+				if unique: # keep line number of first occurrence and if it was null, to combine chunks
+					counts["first_entries"].append( (out_node, counts["written"], counts["null_entry_counts"].get(out_node,0)) )
+				counts["written"] += 1
+				wayout.write( outputstring )
+	return all_counts
+
+def read_changed_nodes(taxdifffile):
+	'''read the table from taxdiff.py, and return a dict where keys are taxids that changed'''
+	changed_nodes = {}
+	for line in open(taxdifffile,'r'):
+		taxid = line.split("\t",1)[0]
+		if taxid and taxid != "taxid":
+			changed_nodes[taxid] = True
+	sys.stderr.write("# read {} changed taxids from {}  {}\n".format( len(changed_nodes), taxdifffile, time.asctime() ) )
+	return changed_nodes
+
+def update_lines(inputlines, oldlines, wayout, changed_nodes, get_node, get_name, get_lineage, samples=False):
+	'''read the input and the older output together, copy the old line unless the taxid has changed, then annotate it again
+	    return a dict of counts for the lines that were annotated again, and the number of lines that were kept'''
+	update_counts = new_output_counts()
+	update_counts["kept"] = 0
+	for line in inputlines:
+		line = line.strip()
+		if line:
+			# each line with a taxid made exactly one line in the older output
+			taxid = get_line_taxid(line, samples, True, False)
+			if taxid is None:
+				continue
+			oldline = next(oldlines, None)
+			if oldline is None:
+				sys.exit("ERROR: OLD OUTPUT ENDED BEFORE THE INPUT, CHECK IF IT IS FROM THE SAME INPUT WITHOUT --unique OR --metagenomes-only")
+			if taxid in changed_nodes:
+				line_counts = annotate_lines([line], [wayout], get_node, get_name, get_lineage, samples, True)[0]
+				for node_id, count in line_counts["null_entry_counts"].items():
+					update_counts["null_entry_counts"][node_id] += count
+				update_counts["found"] += line_counts["found"]
+				update_counts["written"] += line_counts["written"]
+			else:
+				wayout.write(oldline)
+				update_counts["kept"] += 1
+	if next(oldlines, None) is not None:
+		sys.stderr.write("WARNING: OLD OUTPUT HAS MORE LINES THAN THE INPUT, CHECK IF IT IS FROM THE SAME INPUT\n")
+	sys.stderr.write("# kept {} lines from the old output, annotated {} changed lines  {}\n".format( update_counts["kept"], update_counts["written"], time.asctime() ) )
+	return update_counts
+
+def get_sample_year(rawdate):
+	'''return the first plausible 4-digit year from the raw collection date, or NA'''
+	rematch = year_pattern.search(rawdate)
+	if rematch:
+		return rematch.group(1)
+	return "NA"
+
+def aggregate_lines(inputlines, wayout, get_node, get_name, get_lineage, samples=False, numbers=False, unique=False, aggregate_by=[], within=None):
+	'''count lines for each kingdom, phylum and class, and optionally source or year, then write the table of counts to wayout'''
+	group_counts = defaultdict(int) # key is tuple of kingdom, phylum, class, and other groups, value is count
+	lineage_names = {} # key is node ID, value is tuple of list of kingdom, phylum, class names, and if null
+	node_tracker = {} # for --unique, only keys are used
+	null_entry_counts = defaultdict(int)
+	skippedentries = 0
+	foundentries = 0
+	outsideentries = 0 # for --within
+	for line in inputlines:
+		line = line.strip()
+		if line:
+			taxid = get_line_taxid(line, samples, numbers)
+			if taxid is None:
+				continue
+			if numbers:
+				node_id = taxid
+			else:
+				node_id = get_node(taxid)
+			if within is not None and not within(node_id):
+				outsideentries += 1
+				continue
+			if unique:
+				if node_id in node_tracker:
+					skippedentries += 1
+					continue
+				node_tracker[node_id] = 1
+			# as in annotate_lines, deleted nodes are counted as both found and null
+			if node_id not in lineage_names:
+				if node_id is not None:
+					finalnodes = get_lineage(node_id)
+					lineage_names[node_id] = ( [get_name(n) or "None" for n in finalnodes], finalnodes[0]=="Deleted" )
+				else:
+					lineage_names[node_id] = ( ["None", "None", "None"], True )
+			finalnames, is_null = lineage_names[node_id]
+			if node_id is not None:
+				foundentries += 1
+			if is_null:
+				null_entry_counts[node_id] += 1
+			# extra groups need the 12-column table from parse_long_sra_metadata.py
+			group_key = list(finalnames)
+			if aggregate_by:
+				lsplits = line.split("\t")
+				for group in aggregate_by:
+					if len(lsplits) < 12:
+						group_key.append("NA")
+					elif group=="source":
+						group_key.append( lsplits[10] )
+					elif group=="year":
+						group_key.append( get_sample_year(lsplits[6]) )
+			group_counts[tuple(group_key)] += 1
+	wayout.write( "{}\tcount\n".format( "\t".join(["kingdom", "phylum", "class"] + list(aggregate_by)) ) )
+	for group_key, count in sorted(group_counts.items(), key=lambda x: x[1], reverse=True):
+		wayout.write( "{}\t{}\n".format( clean_name("\t".join(group_key)), count ) )
+	sys.stderr.write("# wrote counts for {} groups  {}\n".format( len(group_counts), time.asctime() ) )
+	return {"node_tracker":node_tracker, "null_entry_counts":null_entry_counts,
+			"skipped":skippedentries, "found":foundentries, "written":len(group_counts), "outside":outsideentries}
+
+def lca_lines(inputlines, wayout, get_node, get_name, get_rank, get_position, get_lca, numbers=False, within=None):
+	'''find the lowest common ancestor of all samples in each folder of the samples table, and write one line per folder to wayout
+	    if within is given, samples are skipped unless within(node) is True'''
+	# the LCA of a group is the LCA of the nodes with the first and last depth-first positions
+	# so only those two are kept for each folder, as lists of count, missing count, first position, first node, last position, last node
+	folder_nodes = {}
+	outsidecount = 0
+	for line in inputlines:
+		line = line.strip()
+		if line:
+			taxid = get_line_taxid(line, True, numbers)
+			if taxid is None:
+				continue
+			node_id = taxid if numbers else get_node(taxid)
+			if within is not None and not within(node_id):
+				outsidecount += 1
+				continue
+			folder = line.split("\t",1)[0]
+			folder_group = folder_nodes.get(folder, None)
+			if folder_group is None:
+				folder_group = [0, 0, -1, None, -1, None]
+				folder_nodes[folder] = folder_group
+			folder_group[0] += 1
+			position = get_position(node_id)
+			if position < 0: # deleted or missing node
+				folder_group[1] += 1
+				continue
+			if folder_group[3] is None or position < folder_group[2]:
+				folder_group[2:4] = [position, node_id]
+			if folder_group[5] is None or position > folder_group[4]:
+				folder_group[4:6] = [position, node_id]
+	wayout.write("folder\tsamples\tmissing\tlca_taxid\tlca_name\tlca_rank\n")
+	nullcount = 0
+	for folder, folder_group in folder_nodes.items():
+		if folder_group[3] is None:
+			nullcount += 1
+			lca_node = None
+		else:
+			lca_node = get_lca(folder_group[3], folder_group[5])
+		lca_name = clean_name(get_name(lca_node) or "None") if lca_node else "None"
+		wayout.write("{}\t{}\t{}\t{}\t{}\t{}\n".format( folder, folder_group[0], folder_group[1], lca_node, lca_name, get_rank(lca_node) if lca_node else "None" ) )
+	sys.stderr.write("# wrote LCA for {} folders, {} had no nodes  {}\n".format( len(folder_nodes), nullcount, time.asctime() ) )
+	return {"null_entry_counts":{}, "skipped":0, "found":len(folder_nodes)-nullcount, "written":len(folder_nodes), "outside":outsidecount}
+
+def hll_position(node_id):
+	'''return tuple of register index and rank of the first 1-bit for the hash of the node, for HyperLogLog'''
+	hashvalue = int.from_bytes( hashlib.blake2b(node_id.encode("utf-8"), digest_size=8).digest(), "big" )
+	remainder = hashvalue & ((1 << (64 - hll_precision)) - 1)
+	return hashvalue >> (64 - hll_precision), 64 - hll_precision - remainder.bit_length() + 1
+
+def hll_from_set(nodes):
+	'''return new HyperLogLog registers as bytearray, with all nodes of the set'''
+	registers = bytearray(1 << hll_precision)
+	for node_id in nodes:
+		index, rank = hll_position(node_id)
+		if rank > registers[index]:
+			registers[index] = rank
+	return registers
+
+def hll_estimate(registers):
+	'''return the estimated number of distinct items from HyperLogLog registers'''
+	m = len(registers)
+	estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in registers)
+	zeros = registers.count(0)
+	if estimate <= 2.5 * m and zeros: # small range correction
+		estimate = m * math.log(m / zeros)
+	return int(round(estimate))
+
+def merge_distinct(first, second, exact=False):
+	'''merge two sets or sketches of distinct nodes, and return a set, or a sketch if either is a sketch or the set is too large'''
+	if isinstance(first, set) and isinstance(second, set):
+		first |= second
+		if exact or len(first) <= hll_exact_limit:
+			return first
+		return hll_from_set(first)
+	if isinstance(first, set):
+		first, second = second, first
+	if isinstance(second, set):
+		second = hll_from_set(second)
+	return bytearray( map(max, first, second) )
+
+def count_distinct(distinct_nodes):
+	'''return the number of distinct nodes, exact for sets, or estimated from a sketch'''
+	if isinstance(distinct_nodes, set):
+		return len(distinct_nodes)
+	return hll_estimate(distinct_nodes)
+
+def distinct_lines(inputlines, get_node, get_name, get_lineage, samples=False, numbers=False, distinct_by=["phylum"], exact=False, within=None):
+	'''count samples and distinct species in each group, return dict where key is tuple of the group and value is list of
+	    sample count, and set of taxids, or HyperLogLog sketch when a group has many species, unless exact
+	    and the number of samples skipped as outside of within'''
+	group_counts = {}
+	outsidecount = 0
+	lineage_names = {} # key is node ID, value is dict of kingdom, phylum, class names
+	hll_positions = {} # key is node ID, value is tuple from hll_position, as each is hashed once
+	for line in inputlines:
+		line = line.strip()
+		if line:
+			taxid = get_line_taxid(line, samples, numbers)
+			if taxid is None:
+				continue
+			node_id = taxid if numbers else get_node(taxid)
+			if within is not None and not within(node_id):
+				outsidecount += 1
+				continue
+			if node_id not in lineage_names:
+				finalnodes = get_lineage(node_id) if node_id is not None else [None, None, None]
+				lineage_names[node_id] = dict( zip(["kingdom", "phylum", "class"], [get_name(n) or "None" for n in finalnodes]) )
+			# extra groups need the 12-column table from parse_long_sra_metadata.py
+			lsplits = line.split("\t") if ("source" in distinct_by or "year" in distinct_by) else []
+			group_key = []
+			for group in distinct_by:
+				if group in lineage_names[node_id]:
+					group_key.append( lineage_names[node_id][group] )
+				elif len(lsplits) < 12:
+					group_key.append("NA")
+				elif group=="source":
+					group_key.append( lsplits[10] )
+				elif group=="year":
+					group_key.append( get_sample_year(lsplits[6]) )
+			group_key = tuple(group_key)
+			group_data = group_counts.get(group_key, None)
+			if group_data is None:
+				group_data = [0, set()]
+				group_counts[group_key] = group_data
+			group_data[0] += 1
+			if node_id is None: # counted as sample, but not as species
+				continue
+			if isinstance(group_data[1], set):
+				group_data[1].add(node_id)
+				if not exact and len(group_data[1]) > hll_exact_limit:
+					group_data[1] = hll_from_set(group_data[1])
+			else:
+				if node_id not in hll_positions:
+					hll_positions[node_id] = hll_position(node_id)
+				index, rank = hll_positions[node_id]
+				if rank > group_data[1][index]:
+					group_data[1][index] = rank
+	return group_counts, outsidecount
+
+def write_distinct_counts(group_counts, wayout, distinct_by):
+	'''write the table of sample counts and distinct species of each group to wayout'''
+	wayout.write( "{}\tsamples\tspecies\n".format( "\t".join(distinct_by) ) )
+	for group_key, group_data in sorted(group_counts.items(), key=lambda x: x[1][0], reverse=True):
+		wayout.write( "{}\t{}\t{}\n".format( clean_name("\t".join(group_key)), group_data[0], count_distinct(group_data[1]) ) )
+	sys.stderr.write("# wrote distinct species for {} groups  {}\n".format( len(group_counts), time.asctime() ) )
+
+def split_byte_ranges(inputfilename, chunkcount):
+	'''return list of start and end byte positions for chunks of the file, where each chunk ends after a newline'''
+	filesize = os.path.getsize(inputfilename)
+	boundaries = [0]
+	with open(inputfilename,'rb') as inputfile:
+		for i in range(1, chunkcount):
+			inputfile.seek( max(filesize * i // chunkcount, boundaries[-1]) )
+			inputfile.readline() # move to the end of the current line
+			boundaries.append( inputfile.tell() )
+	boundaries.append(filesize)
+	return [ (start, end) for start, end in zip(boundaries[:-1], boundaries[1:]) if end > start ]
+
+def read_byte_range(inputfilename, start, end, decode=True):
+	'''generator of lines as strings, or as bytes if not decode, between start and end byte positions of the file
+	    strings are split at \\r as well, as lines of files opened as text are, so chunks give the same lines'''
+	with open(inputfilename,'rb') as inputfile:
+		inputfile.seek(start)
+		position = start
+		while position < end:
+			bline = inputfile.readline()
+			if not bline:
+				break
+			position += len(bline)
+			if not decode:
+				yield bline
+				continue
+			line = bline.decode("utf-8")
+			if "\r" in line: # stray \r in a row, or \r\n endings
+				sublines = line.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+				for subline in sublines[:-1]:
+					yield subline + "\n"
+				if sublines[-1]:
+					yield sublines[-1]
+			else:
+				yield line
+
+# set before the worker processes are forked, so all workers share
+# the lookups and the memory-mapped taxonomy cache without copying
+parallel_setup = {}
+
+def annotate_byte_range(byterange):
+	'''worker for --workers, annotate one chunk of the input, return the outputs as strings and the counts'''
+	chunkouts = [io.StringIO() for output_mode in parallel_setup["options"]["output_modes"]]
+	chunklines = parallel_setup["wrap_input"]( read_byte_range(parallel_setup["input"], *byterange) )
+	all_chunk_counts = annotate_lines( chunklines, chunkouts, **parallel_setup["options"] )
+	return [chunkout.getvalue() for chunkout in chunkouts], all_chunk_counts
+
+def distinct_byte_range(byterange):
+	'''worker for --distinct with --workers, count one chunk of the input, return the dict of groups and samples outside of within'''
+	chunklines = parallel_setup["wrap_input"]( read_byte_range(parallel_setup["input"], *byterange) )
+	return distinct_lines( chunklines, **parallel_setup["options"] )
+
+def distinct_in_parallel(inputfilename, workers, distinct_options, wrap_input=None):
+	'''split the input into chunks for each worker, and return the merged dict of groups, and the total samples outside of within'''
+	byteranges = split_byte_ranges(inputfilename, workers * 4)
+	sys.stderr.write("# counting {} chunks with {} workers  {}\n".format( len(byteranges), workers, time.asctime() ) )
+	parallel_setup["input"] = inputfilename
+	parallel_setup["options"] = distinct_options
+	parallel_setup["wrap_input"] = wrap_input or (lambda x: x)
+	total_groups = {}
+	total_outside = 0
+	with multiprocessing.get_context("fork").Pool(workers) as pool:
+		for chunk_groups, chunk_outside in pool.imap_unordered(distinct_byte_range, byteranges):
+			total_outside += chunk_outside
+			for group_key, group_data in chunk_groups.items():
+				if group_key in total_groups:
+					total_groups[group_key][0] += group_data[0]
+					total_groups[group_key][1] = merge_distinct(total_groups[group_key][1], group_data[1], distinct_options["exact"])
+				else:
+					total_groups[group_key] = group_data
+	return total_groups, total_outside
+
+def annotate_in_parallel(inputfilename, workers, wayouts, annotate_options, wrap_input=None):
+	'''split the input into chunks for each worker, write the outputs in the original order, and return the combined counts of each'''
+	byteranges = split_byte_ranges(inputfilename, workers * 4)
+	sys.stderr.write("# annotating {} chunks with {} workers  {}\n".format( len(byteranges), workers, time.asctime() ) )
+	parallel_setup["input"] = inputfilename
+	parallel_setup["options"] = annotate_options
+	parallel_setup["wrap_input"] = wrap_input or (lambda x: x)
+	all_total_counts = [new_output_counts() for wayout in wayouts]
+	with multiprocessing.get_context("fork").Pool(workers) as pool:
+		for chunkoutputs, all_chunk_counts in pool.imap(annotate_byte_range, byteranges):
+			for wayout, chunkoutput, chunk_counts, total_counts in zip(wayouts, chunkoutputs, all_chunk_counts, all_total_counts):
+				node_tracker = total_counts["node_tracker"]
+				# for --unique, a first occurrence in this chunk may have been seen in an earlier chunk
+				# and would have been skipped as non-unique if read in one pass, so undo those counts
+				droplines = set()
+				for node_id, linenumber, nullcount in chunk_counts["first_entries"]:
+					if node_id in node_tracker:
+						if linenumber >= 0:
+							droplines.add(linenumber)
+							chunk_counts["written"] -= 1
+							chunk_counts["skipped"] += 1
+						if node_id is not None:
+							chunk_counts["found"] -= 1
+						chunk_counts["null_entry_counts"][node_id] -= nullcount
+				if droplines: # every output line ends with \n, and names may contain other line breaks, so only split on \n
+					chunkoutput = "".join( l + "\n" for i, l in enumerate(chunkoutput.split("\n")[:-1]) if i not in droplines )
+				wayout.write(chunkoutput)
+				for node_id, count in chunk_counts["node_tracker"].items():
+					node_tracker[node_id] = node_tracker.get(node_id, 0) + count
+				for node_id, count in chunk_counts["null_entry_counts"].items():
+					if count:
+						total_counts["null_entry_counts"][node_id] += count
+				for countname in ["skipped", "found", "written", "outside"]:
+					total_counts[countname] += chunk_counts[countname]
+	return all_total_counts
+
+def report_counts(null_entry_counts, foundentries, skippedentries, writecount, unique=False):
+	'''print the summary of found, null and skipped entries for one output to stderr'''
+	nullentries = sum(null_entry_counts.values())
+	sys.stderr.write("# found tree for {} nodes, could not find for {}  {}\n".format( foundentries, nullentries, time.asctime() ) )
+	if skippedentries:
+		if unique:
+			sys.stderr.write("# wrote {} entries, skipped {} non-unique entries\n".format( writecount, skippedentries ) )
+		else:
+			sys.stderr.write("# wrote {} entries, skipped {} entries\n".format( writecount, skippedentries ) )
+	if nullentries:
+		for k,v in null_entry_counts.items():
+			sys.stderr.write("_NODE_ID\t{}\t{}\n".format( k, v ) )
+
 def main(argv, wayout):
 	if not len(argv):
 		argv.append('-h')
@@ -139,14 +1267,79 @@ def main(argv, wayout):
 	parser.add_argument('--samples', action="store_true", help="read directly from parsed samples file")
 	parser.add_argument('--unique', action="store_true", help="only count first occurrence of a speices")
 	parser.add_argument('--missing-nodes', action="store_true", help="print frequency of missing nodes to stderr")
+	parser.add_argument('--cache', help="folder of taxonomy cache, built from -n and -o if it does not exist")
+	parser.add_argument('--aggregate', action="store_true", help="only write counts of each kingdom, phylum and class")
+	parser.add_argument('--aggregate-by', nargs="*", default=[], choices=["source","year"], help="with --aggregate, also count by library source or year, needs 12-column samples")
+	parser.add_argument('--unique-output', help="also write the --unique table to this file, from the same pass of the input")
+	parser.add_argument('--metagenomes-output', help="also write the --metagenomes-only table to this file, from the same pass of the input")
+	parser.add_argument('--distinct', action="store_true", help="only write counts of samples and distinct species of each group")
+	parser.add_argument('--distinct-by', nargs="*", default=["phylum"], choices=["kingdom","phylum","class","source","year"], help="groups for --distinct, source and year need 12-column samples [phylum]")
+	parser.add_argument('--exact', action="store_true", help="with --distinct, count species exactly, instead of estimating for large groups")
+	parser.add_argument('--lca', action="store_true", help="write the lowest common ancestor of the samples of each folder, needs --samples")
+	parser.add_argument('--update-from', help="older output of the same input, only lines with taxids in --changes are annotated again")
+	parser.add_argument('--changes', help="table of changed taxids from taxdiff.py, for --update-from")
+	parser.add_argument('--within', help="only keep samples within these clades, as comma-separated taxids, such as 6656,6073")
+	parser.add_argument('--lazy', action="store_true", help="read the input twice, first to find taxids or names, then only keep those from -n and -o")
+	parser.add_argument('--server', help="address of taxonomy_server.py, such as http://localhost:8765, instead of -n -o or --cache")
+	parser.add_argument('-w','--workers', type=int, default=1, help="number of processes to annotate chunks of tabular input, not for .gz [1]")
 	args = parser.parse_args(argv)
 
-	name_to_node, node_to_name = names_to_nodes(args.names, args.metagenomes_only)
-	node_to_rank, node_to_parent = nodes_to_parents(args.nodes)
+	if args.aggregate and (args.csv or args.metagenomes_only):
+		parser.error("--aggregate cannot be used with --csv or --metagenomes-only")
+	extra_outputs = [] # tuples of file name, unique, and metagenomes_only
+	if args.unique_output:
+		extra_outputs.append( (args.unique_output, True, False) )
+	if args.metagenomes_output:
+		extra_outputs.append( (args.metagenomes_output, False, True) )
+	if extra_outputs and (args.csv or args.aggregate):
+		parser.error("--unique-output and --metagenomes-output cannot be used with --csv or --aggregate")
+	if args.distinct and (args.csv or args.aggregate or args.lca or args.unique or args.metagenomes_only or extra_outputs or args.update_from):
+		parser.error("--distinct cannot be used with other modes, or --unique or --metagenomes-only")
+	if args.lca and (args.csv or args.aggregate or extra_outputs or args.server or not args.samples):
+		parser.error("--lca needs --samples, and cannot be used with --csv --aggregate --server or extra outputs")
+	if args.update_from and (not args.changes or not args.numbers or args.unique or args.metagenomes_only or args.csv or args.aggregate or args.lca or extra_outputs or args.within):
+		parser.error("--update-from needs --changes and --numbers, and is only for the normal table")
+	if args.lazy and (args.cache or args.server or not args.names or not args.nodes):
+		parser.error("--lazy needs -n and -o, and is not used with --cache or --server")
+	within_nodes = args.within.split(",") if args.within else []
+	if within_nodes and args.server:
+		parser.error("--within needs the taxonomy from -n and -o or --cache, not --server")
+	if not all(n.strip().isdigit() for n in within_nodes):
+		parser.error("--within must be taxid numbers, such as 6656,6073")
+	# names of all species are needed if any output is not metagenome mode
+	metagenome_lookups = args.metagenomes_only and all(output[2] for output in extra_outputs)
+
+	# set up lookups from the server, the cache or the dicts, after that everything is the same
+	if args.server:
+		server_lookups = {"nodes":{}, "names":{}, "lineages":{}}
+		is_within = None
+		get_node = lambda x: server_name_to_node(server_lookups, x, metagenome_lookups)
+		get_name = lambda x: filter_metagenome_name(server_lookups["names"].get(x,None), metagenome_lookups)
+		get_lineage = lambda x: server_lookups["lineages"].get(x, ["Deleted","Deleted","Deleted"])
+		# lines are read in blocks, and each block is looked up in one request
+		wrap_input = lambda x: prefetch_from_server(x, args.server, server_lookups, args.samples, args.numbers)
+	else:
+		lazy_keys = None
+		if args.lazy: # first pass of the input, before reading the taxonomy
+			lazyopentype = gzip.open if args.input.rsplit('.',1)[-1]=="gz" else open
+			with lazyopentype(args.input,'rt') as lazyfile:
+				lazy_keys = scan_input_keys(lazyfile, args.samples, args.numbers, args.csv)
+		lookups = make_lookups(args.cache, args.names, args.nodes, metagenome_lookups, within_nodes, args.lca, lazy_keys)
+		get_node, get_name, get_lineage, is_within = lookups["get_node"], lookups["get_name"], lookups["get_lineage"], lookups["is_within"]
+		wrap_input = lambda x: x
 
-	# metagenome mode overrides making a header
-	if args.header and not args.metagenomes_only:
+	# metagenome mode overrides making a header, and aggregate and lca modes have their own
+	wayouts = [sys.stdout]
+	output_modes = [(args.unique, args.metagenomes_only)]
+	if args.header and not args.metagenomes_only and not args.aggregate and not args.lca and not args.distinct:
 		sys.stdout.write("species\tkingdom\tphylum\tclass\n")
+	for outputfilename, unique, metagenomes_only in extra_outputs:
+		sys.stderr.write("# also writing {} table to {}\n".format( "metagenome" if metagenomes_only else "unique", outputfilename ) )
+		extra_wayout = open(outputfilename,'w')
+		if args.header and not metagenomes_only:
+			extra_wayout.write("species\tkingdom\tphylum\tclass\n")
+		wayouts.append(extra_wayout)
+		output_modes.append( (unique, metagenomes_only) )
 
 	node_tracker = {} # keys are node IDs, values are counts
 
@@ -156,6 +1349,7 @@ def main(argv, wayout):
 	skippedentries = 0 # skipped for --unique or --metagenomes-only
 	foundentries = 0
 	writecount = 0
+	outsideentries = 0 # skipped for --within
 
 	inputfilename = args.input
 	if inputfilename.rsplit('.',1)[-1]=="gz": # autodetect gzip format
@@ -166,18 +1360,26 @@ def main(argv, wayout):
 		sys.stderr.write("# reading species IDs from {}  {}\n".format(inputfilename, time.asctime() ) )
 	# meaning parse NCBI WGS csv file
 	if args.csv:
+		if args.workers > 1:
+			sys.stderr.write("# --csv is read in a single pass, using 1 worker\n")
 		with opentype(inputfilename,'rt') as csvfile:
 			ncbicsv = csv.reader(csvfile)
+			if args.server: # csv files are small, so look up all names at once
+				ncbicsv = list(ncbicsv)
+				fill_server_lookups(args.server, server_lookups, names=[lsplits[4] for lsplits in ncbicsv])
 			for lsplits in ncbicsv:
 				speciesname = lsplits[4]
-				node_id = name_to_node.get(speciesname,None)
+				node_id = get_node(speciesname)
+				if is_within is not None and speciesname != "organism_an" and not is_within(node_id):
+					outsideentries += 1
+					continue
 				if speciesname is not None: # remove any # that would disrupt downstream analyses
 					speciesname = clean_name(speciesname)
 				node_tracker[node_id] = node_tracker.get(node_id, 0) + 1
 				if node_id is not None:
 					foundentries += 1
-					finalnodes = get_parent_tree(node_id, node_to_rank, node_to_parent)
-					finalnodes = [node_to_name.get(n,"None") for n in finalnodes]
+					finalnodes = get_lineage(node_id)
+					finalnodes = [get_name(n) or "None" for n in finalnodes]
 					outputlist = lsplits[0:5] + finalnodes + lsplits[6:]
 					# check for deleted nodes, add to null entries
 					if finalnodes[0]=="Deleted":
@@ -190,74 +1392,55 @@ def main(argv, wayout):
 				outputstring = "{}\n".format( clean_name("\t".join(outputlist)) )
 				writecount += 1
 				sys.stdout.write( outputstring )
+		all_counts = [{"null_entry_counts":null_entry_counts, "skipped":skippedentries, "found":foundentries, "written":writecount, "outside":outsideentries}]
 	# parse tabular output
 	else:
-		for line in opentype(inputfilename,'rt'):
-			line = line.strip()
-			if line:
-				# if reading directly from 4-column samples file, extract sample ID
-				if args.samples:
-					lsplits = line.split("\t")
-					if len(lsplits) < 4: # columns missing somehow, skip
-						sys.stderr.write("# ERROR: MISSING COLUMNS IN:\n{}\n".format(line) )
-						continue
-					if args.numbers:
-						taxid = lsplits[2]
-						if len(lsplits) > 4: # likely tabs in sample alias
-							taxid = lsplits[3]
-					else: # use species name
-						taxid = lsplits[3]
-				else: # otherwise each line is a sample name or number
-					taxid = line
-
-				# input lines are NCBI numbers, meaning get species name from that
-				if args.numbers:
-					speciesname = node_to_name.get(taxid,None)
-					node_id = taxid
-				else: # meaning input lines are species names, like Danio rerio
-					speciesname = taxid
-					node_id = name_to_node.get(speciesname,None)
-				if speciesname is not None: # remove any # that would disrupt downstream analyses
-					speciesname = clean_name(speciesname)
-				# add one for each node
-				node_tracker[node_id] = node_tracker.get(node_id, 0) + 1
-				# in unique mode, if node has been seen before then skip it
-				if args.unique and node_tracker.get(node_id,0) > 1:
-					skippedentries += 1
-					continue
-
-				if node_id is not None:
-					foundentries += 1
-					if args.metagenomes_only:
-						if speciesname is None:
-							skippedentries += 1
-							continue
-						cleaned_line = clean_name(line)
-						# column is redundant with ncbi_category, remove "metagenome" for ease of later indexing
-						metagenome_category = speciesname.replace(" metagenome","").strip()
-						outputstring = "{}\t{}\n".format( cleaned_line, metagenome_category )
-					else: # normal mode
-						finalnodes = get_parent_tree(node_id, node_to_rank, node_to_parent)
-						outputstring = "{}\t{}\t{}\t{}\n".format( speciesname, node_to_name.get(finalnodes[0],"None"), node_to_name.get(finalnodes[1],"None"), node_to_name.get(finalnodes[2],"None") )
-
-						# check for deleted nodes, add to null entries
-						if finalnodes[0]=="Deleted":
-							null_entry_counts[node_id] += 1
-				else:
-					null_entry_counts[node_id] += 1
-					outputstring = "{}\tNone\tNone\tNone\n".format( speciesname )
-				writecount += 1
-				sys.stdout.write( outputstring )
-	nullentries = sum(null_entry_counts.values())
-	sys.stderr.write("# found tree for {} nodes, could not find for {}  {}\n".format( foundentries, nullentries, time.asctime() ) )
-	if skippedentries:
-		if args.unique:
-			sys.stderr.write("# wrote {} entries, skipped {} non-unique entries\n".format( writecount, skippedentries ) )
+		annotate_options = {"get_node":get_node, "get_name":get_name, "get_lineage":get_lineage,
+							"samples":args.samples, "numbers":args.numbers, "output_modes":output_modes, "within":is_within}
+		if args.update_from: # only some lines are annotated, so stays as 1 worker
+			if args.workers > 1:
+				sys.stderr.write("# --update-from reads the old table along with the input, using 1 worker\n")
+			oldopentype = gzip.open if args.update_from.rsplit('.',1)[-1]=="gz" else open
+			oldlines = oldopentype(args.update_from,'rt')
+			if args.header: # header was already written
+				next(oldlines, None)
+			all_counts = [update_lines(wrap_input(opentype(inputfilename,'rt')), oldlines, sys.stdout, read_changed_nodes(args.changes), get_node, get_name, get_lineage, args.samples)]
+		elif args.distinct: # sketches or sets of each chunk are merged
+			distinct_options = {"get_node":get_node, "get_name":get_name, "get_lineage":get_lineage, "samples":args.samples, "numbers":args.numbers,
+								"distinct_by":args.distinct_by, "exact":args.exact, "within":is_within}
+			if args.workers > 1 and opentype is not gzip.open:
+				group_counts, outsidecount = distinct_in_parallel(inputfilename, args.workers, distinct_options, wrap_input)
+			else:
+				if args.workers > 1:
+					sys.stderr.write("# cannot split gzipped input {}, using 1 worker\n".format(inputfilename) )
+				group_counts, outsidecount = distinct_lines(wrap_input(opentype(inputfilename,'rt')), **distinct_options)
+			write_distinct_counts(group_counts, sys.stdout, args.distinct_by)
+			all_counts = [{"null_entry_counts":{}, "skipped":0, "found":sum(g[0] for g in group_counts.values()), "written":len(group_counts), "outside":outsidecount}]
+		elif args.lca: # one line per folder, so stays as 1 worker
+			if args.workers > 1:
+				sys.stderr.write("# --lca keeps all samples of each folder together, using 1 worker\n")
+			all_counts = [lca_lines(wrap_input(opentype(inputfilename,'rt')), sys.stdout, get_node, get_name, lookups["get_rank"], lookups["get_position"], lookups["get_lca"], args.numbers, is_within)]
+		elif args.aggregate: # streaming counts, so stays as 1 worker
+			if args.workers > 1:
+				sys.stderr.write("# --aggregate counts in a single pass, using 1 worker\n")
+			annotate_options.pop("output_modes")
+			all_counts = [aggregate_lines(wrap_input(opentype(inputfilename,'rt')), sys.stdout, unique=args.unique, aggregate_by=args.aggregate_by, **annotate_options)]
+		elif args.workers > 1 and opentype is gzip.open:
+			sys.stderr.write("# cannot split gzipped input {}, using 1 worker\n".format(inputfilename) )
+			all_counts = annotate_lines(wrap_input(opentype(inputfilename,'rt')), wayouts, **annotate_options)
+		elif args.workers > 1:
+			all_counts = annotate_in_parallel(inputfilename, args.workers, wayouts, annotate_options, wrap_input)
 		else:
-			sys.stderr.write("# wrote {} entries, skipped {} entries\n".format( writecount, skippedentries ) )
-	if nullentries:
-		for k,v in null_entry_counts.items():
-			sys.stderr.write("_NODE_ID\t{}\t{}\n".format( k, v ) )
+			all_counts = annotate_lines(wrap_input(opentype(inputfilename,'rt')), wayouts, **annotate_options)
+		for extra_wayout in wayouts[1:]:
+			extra_wayout.close()
+	if is_within is not None:
+		sys.stderr.write("# skipped {} entries outside of clades {}\n".format( all_counts[0]["outside"], args.within ) )
+	# report for each output separately, starting with stdout
+	for i, annotate_counts in enumerate(all_counts):
+		if i:
+			sys.stderr.write("# for {}\n".format( extra_outputs[i-1][0] ) )
+		report_counts(annotate_counts["null_entry_counts"], annotate_counts["found"], annotate_counts["skipped"], annotate_counts["written"], output_modes[i][0])
 
 if __name__ == "__main__":
 	main(sys.argv[1:], sys.stdout)
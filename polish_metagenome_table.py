@@ -3,8 +3,9 @@
 # polish_metagenome_table.py
 # v2022-01-07
 # v2022-06-28 catch for double-decimal deg-min-sec format
+# v2026-10-19 read all lat-lon formats with one pattern
 
-'''polish_metagenome_table.py  last modified 2022-01-07
+'''polish_metagenome_table.py  last modified 2026-10-19
     tidy up formats, fix lat-long info
 
 polish_metagenome_table.py -i metagenomes_ext.tab > metagenomes_latlon-fixed.tab
@@ -22,468 +23,282 @@ parse_ncbi_taxonomy.py -n names.dmp -o nodes.dmp -i NCBI_SRA_Metadata_Full_20191
 
     NOTE: peak memory using geonames is about 15G
 
+    to avoid this, make an index of place names once with import_geonames_db.py
+import_geonames_db.py featureCodes_en.txt countryInfo.txt allCountries.txt --index geonames_places.sqlite
+./polish_metagenome_table.py -i NCBI_SRA_Metadata_Full_20210404.metagenomes.tab --geonames-index geonames_places.sqlite > NCBI_SRA_Metadata_Full_20210404.metagenomes_latlon-fixed.tab
+
+    or for a single run, only keep places that could match locations in the table
+./polish_metagenome_table.py -i NCBI_SRA_Metadata_Full_20210404.metagenomes.tab -g allCountries.txt -c countryInfo.txt --lazy > NCBI_SRA_Metadata_Full_20210404.metagenomes_latlon-fixed.tab
+
+    misspelled locations, like Vietman:Son Trac or sandiego, can be matched to the closest country or large place
+    adding a last column of the corrected location, or NA if none was needed
+./polish_metagenome_table.py -i NCBI_SRA_Metadata_Full_20210404.metagenomes.tab --geonames-index geonames_places.sqlite --fuzzy-distance 2 > NCBI_SRA_Metadata_Full_20210404.metagenomes_latlon-fixed.tab
+
+    lat-lon that is far from the country in the location can be flagged, or fixed if flipping N-S or E-W puts it there
+./polish_metagenome_table.py -i NCBI_SRA_Metadata_Full_20210404.metagenomes.tab --geonames-index geonames_places.sqlite --country-check fix > NCBI_SRA_Metadata_Full_20210404.metagenomes_latlon-fixed.tab
+
+    chunks of the table can be polished by several processes, which share the place names
+./polish_metagenome_table.py -i NCBI_SRA_Metadata_Full_20210404.metagenomes.tab --geonames-index geonames_places.sqlite --workers 8 > NCBI_SRA_Metadata_Full_20210404.metagenomes_latlon-fixed.tab
+
+    the output can also be split into one file per year and category, listed with row counts in partition_index.tab
+./polish_metagenome_table.py -i NCBI_SRA_Metadata_Full_20210404.metagenomes.tab --partition-by year,category --partition-dir latlon-fixed_partitions > NCBI_SRA_Metadata_Full_20210404.metagenomes_latlon-fixed.tab
+
 '''
 
+import os
 import sys
 import re
+import math
 import argparse
 import time
+import sqlite3
+import functools
+import multiprocessing
+import io
 from collections import defaultdict,Counter
 
-def two_part_latlon(latlon, debug=False):
-	'''take latlon with any two part split, and return the true latitude and longitude'''
+from parse_ncbi_taxonomy import split_byte_ranges, read_byte_range
+from import_geonames_db import GEONAMES_INDEX_VERSION, AMBIGUOUS_PLACE, GeonamesPlaces, import_geonames_country_codes, read_geonames_places, filter_unique_placenames, import_geonames_all_countries
+
+# name of the rule that gave the last result of parse_latlon, fix_date_formats or get_geonames_latlon, for --profile
+last_rule = None
+
+def profile_rules(function, rule_profile):
+	'''return function that also counts each call and its time in rule_profile, under the rule that gave the result'''
+	def profiled_function(*args):
+		start = time.perf_counter()
+		result = function(*args)
+		rule_stats = rule_profile.setdefault(last_rule, [0, 0.0])
+		rule_stats[0] += 1
+		rule_stats[1] += time.perf_counter() - start
+		return result
+	return profiled_function
+
+def decode_arguments(function):
+	'''return function that decodes any bytes arguments from the table before calling function'''
+	def decoded_function(*args):
+		return function( *[ a.decode("utf-8") if isinstance(a, bytes) else a for a in args ] )
+	return decoded_function
+
+def report_rule_profile(rule_profile, cache_size):
+	'''print number of values and time for each rule to stderr, slowest in total first'''
+	if cache_size:
+		sys.stderr.write("# values are not counted again when repeats come from the cache, use --cache-size 0 to count every row\n")
+	else:
+		sys.stderr.write("# values are counted for every row\n")
+	sys.stderr.write("# _RULE\trule\tvalues\ttotal_ms\tus_per_value\n")
+	for rule, (hits, seconds) in sorted(rule_profile.items(), key=lambda x: x[1][1], reverse=True):
+		sys.stderr.write("_RULE\t{}\t{}\t{:.1f}\t{:.2f}\n".format( rule, hits, seconds * 1000, seconds * 1000000 / hits ) )
+
+# lat-lon is read in a single scan by one pattern, made of these tokens
+#   number, with - only as a sign at the start, as degrees, and then optionally one of
+#     dash and one or two numbers, as deg-min-sec 42-02-05 or a range 41.44-41.61
+#     mark and minutes, then mark and seconds, where marks include the mangled ? A?? ?a? O? and o
+#   minutes after a space are only allowed after a mark, or if the hemisphere came first, as 48? 15 N or N60 34 56.3
+#   minutes may have a comma as decimal, as 1832,24N
+#   hemisphere, as a single letter N S E W, either before or after the numbers
+#   separators between the two coordinates are any of , ; / : _ or spaces
+#   labels like "VT grassland:" can come before
+latlon_mark = r"""(?:[?°º'"′″]|[AaO]\?|o)+"""
+latlon_minutes = r"\d+(?:[.,]\d+)?"
+def latlon_coordinate_pattern(i):
+	'''return pattern for one coordinate, with groups numbered i'''
+	return ( r"(?:(?P<pre{0}>[NSEW])[\s:]*)?(?P<deg{0}>-?\d+(?:\.\d+)*\.?)"
+		r"(?:-(?P<dash{0}>\d+(?:\.\d+)?(?:-\d+(?:\.\d+)?)?)"
+		r"|(?P<mark{0}>{1})?(?:(?(mark{0})\s?|(?(pre{0})\s|(?!)))(?P<min{0}>{2})(?P<minmark{0}>{1})?"
+		r"(?:(?(minmark{0})\s?|\s)(?P<sec{0}>{2})(?:{1})?)?)?)"
+		r"(?(pre{0})|(?:[\s_]*(?P<post{0}>[NSEW]))?)" ).format(i, latlon_mark, latlon_minutes)
+latlon_re = re.compile( r"\s*(?:[A-Za-z]{2,}[\s:]*)*(?:(?P<hemis>[NS]:[EW])\s+)?" + latlon_coordinate_pattern(1)
+	+ r"[\s,;/:_]+" + latlon_coordinate_pattern(2) + r"\s*" )
+
+def parse_latlon(latlon, debug=False):
+	'''take latlon in any format below, and return the true latitude and longitude, and the kind of fix as
+	    "decimal" for the standard 46.512 N 6.587 E, "dms", "range", or "unusual" for all others,
+	    or None, None, None if the format is unknown'''
 
 	# cases are given below #
 	#########################
 
-	# most basic case
+	# most basic case, as YY.YY NS XX.XX EW
+	#SRA594737	C2b.24.015	SRS2396010	556182	freshwater sediment metagenome	46.512 N 6.587 E	May-2012	Lake sediment_21	Switzerland: Lake Geneva	freshwater sediment metagenome
 	#55.398487 10.420596
 	#SRA172288	8L	SRS646256	749907	sediment metagenome	49.33598. 57.49939	Aug-2009	NA	Canada: Newfoundland	sediment metagenome
-	rematch = re.search("(-?[.\d]+) (-?[.\d]+)", latlon)
-	if rematch:
-		latitude = "{}".format(rematch.group(1))
-		longitude = "{}".format(rematch.group(2))
-		if latitude[-1]==".":
-			latitude = latitude[:-1]
-		return latitude, longitude
+	#SRA116868	N2	SRS518857	717931	groundwater metagenome	35.97730333/84.27347358	Nov-2008	NA	USA: Tennessee	groundwater metagenome
 
 	# mostly correct, but punctuation problems
 	#SRA062712	H1C	SRS464092	938273	hydrocarbon metagenome	57.02, -111.55	2012-06-09	NA	Horse River, Fort McMurray, AB	hydrocarbon metagenome
 	#SRA047479	GC6-296	SRS285023	412755	marine sediment metagenome	73.3565 7.565	NA	NA	NA	marine sediment metagenome
 	#SRA096192	PR5_2012	SRS465068	433727	hot springs metagenome	57.6526333?, -124.0236833?	2012	NA	Canada: Prophet River	hot springs metagenome
 	#SRA123268	LAO-A03-16S	SRS526732	527639	wastewater metagenome	49.5134139o, 006.0179250o	2011-02-23	NA	Luxembourg: Schifflange	wastewater metagenome
-	#SRA123258	LAO-A01-16S	SRS526724	527639	wastewater metagenome	49.5134139?, 006.0179250?	2010-10-04	NA	Luxembourg: Schifflange	wastewater metagenome
 	#SRA175088	BC4_2012_CH4SIP	SRS659670	433727	hot springs metagenome	49.9642500A??, -116.0266500A??		2012	NA	Canada: Buhl Creek	hot springs metagenome
-	rematch = re.search("(-?[.\d]+)[A\?,o]+ (-?[.\d]+)[A\?o]?", latlon)
-	if rematch:
-		latitude = "{}".format(rematch.group(1))
-		longitude = "{}".format(rematch.group(2))
-		return latitude, longitude
-
-	# using underscores to separate numbers, and no decimal place
-	#SRA172088	673Cage	SRS645239	1436733	rat gut metagenome	4075_N, 11188_W	2/27/14	NA	Salt Lake City UT	rat gut metagenome
-	rematch = re.search("(\d+)_?([NS]), (\d+)_?([EW])", latlon)
-	if rematch:
-		latitude = "{}.{}".format(rematch.group(1)[:-2], rematch.group(1)[-2:])
-		lat_hemi = rematch.group(2)
-		longitude = "{}.{}".format(rematch.group(3)[:-2], rematch.group(3)[-2:])
-		long_hemi = rematch.group(4)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, longitude
-
-	# use of question mark as degree sign, or after minutes
-	#SRA050547	PLANT_1	SRS450931	1348798	terrestrial metagenome	60?58N, 7?31E	NA	Plant root	Norway: Finse	terrestrial metagenome
-	#SRA143595	RedSea_2.5m_mixing	SRS619147	408172	marine metagenome	29?28N 34?55E	05.02.2012	10 liters marine bulk water	Gulf of Aqaba	marine metagenome
-	#SRA095215	V6	SRS463186	452919	ice metagenome	77?30?S 106?00?E	Jan-1995/Jan-1998	NA	Antarctica: Lake Vostok	ice metagenome
-	rematch = re.search("(\d+)\?(\d+)\??([NS]),? (\d+)\?(\d+)\??([EW])", latlon)
-	if rematch:
-		latitude = "{}.{}".format(rematch.group(1),rematch.group(2))
-		lat_hemi = rematch.group(3)
-		longitude = "{}.{}".format(rematch.group(4),rematch.group(5))
-		long_hemi = rematch.group(6)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, longitude
-
-	# question mark separator to NS or EW
+	#SRA074245	LM300	SRS1239132	410658	soil metagenome	45.5081? N, 73.5550? W	2011-06-15	NA	Canada: Montreal	soil metagenome
+	#SRA172235	C1	SRS649280	1515737	money metagenome	28.6100A?? N, 77.2300A?? E	2013	NA	India	money metagenome
+	#SRA173038	MLAC_113_031008BA01	SRS650331	433733	human lung metagenome	15.7861A??A?? S, 35.0058A??A?? E	21-Sep-2010	NA	Malawi: Blantyre	human lung metagenome
 	#SRA092129	Athabasca_biofilm	SRS455051	718308	biofilm metagenome	56.72?N, 111.40?W	23-Sep-2010	NA	Canada	biofilm metagenome
 	#SRA129301	Influent sewage	SRS543595	527639	wastewater metagenome	31.3?N 121.5?E	2013-1-7	NA	China: Shanghai, Quyang	wastewater metagenome
 	#21.5A??N 100.5A??E
-	rematch = re.search("([.\d]+)[A\?]+([NS]),? ([.\d]+)[A\?]+([EW])", latlon)
-	if rematch:
-		latitude = "{}".format(rematch.group(1))
-		lat_hemi = rematch.group(2)
-		longitude = "{}".format(rematch.group(3))
-		long_hemi = rematch.group(4)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, longitude
-
-	# where NS and EW are switched
-	#SRA073595	Thr-B	SRS415117	527640	microbial mat metagenome	7649W, 2443N	2/27/10	NA	Bahamas: Highborne Cay	microbial mat metagenome
-	rematch = re.search("(\d+)_?([EW]), (\d+)_?([NS])", latlon)
-	if rematch:
-		latitude = "{}.{}".format(rematch.group(3)[:-2], rematch.group(3)[-2:])
-		lat_hemi = rematch.group(4)
-		longitude = "{}.{}".format(rematch.group(1)[:-2], rematch.group(1)[-2:])
-		long_hemi = rematch.group(2)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, longitude
-
-	# where o is used as degree sign
-#SRA140230	D_42	SRS559158	410658	soil metagenome	37o37N, 101o12E	29-Aug-2011	NA	China: Qinghai-Tibetan Plateau	soil metagenome
-	rematch = re.search("(\d+)o(\d+)([NS]), (\d+)o(\d+)([EW])", latlon)
-	if rematch:
-		latitude = "{}.{}".format(rematch.group(1),rematch.group(2))
-		lat_hemi = rematch.group(3)
-		longitude = "{}.{}".format(rematch.group(4),rematch.group(5))
-		long_hemi = rematch.group(6)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, longitude
 
 	# way off, as NS:EW XX:YY
 	#SRA092006	BLKP83	SRS470040	410658	soil metagenome	N:E 42.4021:128.0947	2010-06-05	NA	China	soil metagenome
-	rematch = re.search("([NS]):([EW]) ([.\d]+):([.\d]+)", latlon)
-	if rematch:
-		latitude = "{}".format(rematch.group(3))
-		lat_hemi = rematch.group(1)
-		longitude = "{}".format(rematch.group(4))
-		long_hemi = rematch.group(2)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, longitude
-
-	# degree minute second separated by ?, with NS EW
+
+	# using underscores to separate numbers, and no decimal place, including where NS and EW are switched
+	#SRA172088	673Cage	SRS645239	1436733	rat gut metagenome	4075_N, 11188_W	2/27/14	NA	Salt Lake City UT	rat gut metagenome
+	#SRA073595	Thr-B	SRS415117	527640	microbial mat metagenome	7649W, 2443N	2/27/10	NA	Bahamas: Highborne Cay	microbial mat metagenome
+
+	# degree minute, with ? or o or A?? as the degree sign, or after minutes
+	#SRA050547	PLANT_1	SRS450931	1348798	terrestrial metagenome	60?58N, 7?31E	NA	Plant root	Norway: Finse	terrestrial metagenome
+	#SRA143595	RedSea_2.5m_mixing	SRS619147	408172	marine metagenome	29?28N 34?55E	05.02.2012	10 liters marine bulk water	Gulf of Aqaba	marine metagenome
+	#SRA095215	V6	SRS463186	452919	ice metagenome	77?30?S 106?00?E	Jan-1995/Jan-1998	NA	Antarctica: Lake Vostok	ice metagenome
+	#SRA140230	D_42	SRS559158	410658	soil metagenome	37o37N, 101o12E	29-Aug-2011	NA	China: Qinghai-Tibetan Plateau	soil metagenome
+	#SRA170498	454Reads_06037.sff	SRS637056	1041057	sea squirt metagenome	17o55 S, 177o16 E	NA	NA	Fiji	sea squirt metagenome
+	#SRA206241	A	SRS775673	1348798	terrestrial metagenome	34?35.80?N, 104?30.05?E	08-Jan-2013	NA	China: Jinjia Cave, Zhang County, Gansu Province	terrestrial metagenome
+	#SRA169453	VAG_001	SRS628861	412755	marine sediment metagenome	-36A??30.783,-73A??01.083	14-Dec-2011	NA	Chile:Concepcion	marine sediment metagenome
+	#SRA134133	29	SRS564079	662107	phyllosphere metagenome	36A? 37.669, -121A? 32.350	2012	NA	USA: Salinas Valley	phyllosphere metagenome
+	#48? 15 N 6? 22 E
+	#10? 8 S, 145? 35 E
+	#15? 36.675 S, 167? 01.258 E
+	#22o 46O? S; 43o 41O? W
+	#S 20 3.229502 W 176 8.015363
+
+	# degree minute second, separated by marks, spaces or -
 	#SRA045429	pig65_colon_med_16S_muc	SRS455279	1176744	pig metagenome	42?02?05?N 93?37?12?W	2010-01-12	NA	USA: Ames, Iowa	pig metagenome
-	rematch = re.search("(\d+)\?(\d+)\?(\d+)\?([NS]) (\d+)\?(\d+)\?(\d+)\?([EW])", latlon)
-	if rematch:
-		latmin = float(rematch.group(2))/60 + float(rematch.group(3))/3600
-		lonmin = float(rematch.group(6))/60 + float(rematch.group(7))/3600
-		latitude = "{}.{}".format(rematch.group(1), str(latmin)[2:8] )
-		lat_hemi = rematch.group(4)
-		longitude = "{}.{}".format(rematch.group(5), str(latmin)[2:8])
-		long_hemi = rematch.group(8)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, longitude
-
-	# degree minute second by ? then nothing for min-sec
-	#37??3610N, 127??0740E
-	rematch = re.search("(\d+)\?\?(\d\d)(\d\d)([NS]), (\d+)\?\?(\d\d)(\d\d)([EW])", latlon)
-	if rematch:
-		latmin = float(rematch.group(2))/60 + float(rematch.group(3))/3600
-		lonmin = float(rematch.group(6))/60 + float(rematch.group(7))/3600
-		latitude = "{}.{}".format(rematch.group(1), str(latmin)[2:8] )
-		lat_hemi = rematch.group(4)
-		longitude = "{}.{}".format(rematch.group(5), str(latmin)[2:8])
-		long_hemi = rematch.group(8)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, longitude
+	#SRA141824	187_1.sff	SRS560593	749906	gut metagenome	42-02-05 N, 93-37-12 W	NA	NA	USA: Ames, Iowa	gut metagenome
+	#SRA172745	Tenerias	SRS647989	717931	groundwater metagenome	25A??32A??10 N, 100A??58A??55 W	Oct-2011NA	Mexico: State of Coahuila	groundwater metagenome
+	#SRA179448	Sed4	SRS685766	1169740	aquatic metagenome	63A? 33 23.4, 12A? 37 29.7	6/17/10	NA	Sweden: Digern_st_rnen	aquatic metagenome
+	#N20?a?33?a?57.9?a? E110?a?04?a?25.2?a?
+	#N60 34 56.3 E14 38 20.5
 
-	#
+	# degree then minutes and seconds with no separator, which are always the first two digits
 	#SRA173834	201107FF13	SRS652490	410658	soil metagenome	60A??581.59N; 15A??4759.30E	juil-11	NA	Lamborn	soil metagenome
+	#SRA127585	municipalAS_12	SRS543795	942017	activated sludge metagenome	34?2824.45S_58?358.42W	2013.04.10	NA	Buenos Aires	activated sludge metagenome
+	#SRA137650	pmoA_seep1	SRS557364	410658	soil metagenome	60?5318,14N,68?4205,75E	19-Jul-2012	NA	Russia: western siberia:khanty-mansiysk	soil metagenome
+	#SRA127724	Reduced2	SRS534538	410658	soil metagenome	48?3013.50 N, 11?2650.80 E	26-Nov-2012	NA	Germany: Scheyern	soil metagenome
+	#SRA172986	Zhang_Yang	SRS659936	410658	soil metagenome	116A??A??5927 E, 30A??A??2808 N	Apr 20th and May 25th,2012	NA	Anqing, Anhui	soil metagenome
+	#37??3610N, 127??0740E
 	#54A??1832,24N; 2A??414,78W
 	#41A??1338.93S 175A??2848.81E
-	rematch = re.search("(\d+)A\?\?(\d\d)([,.\d]+)([NS]);? (\d+)A\?\?(\d\d)([,.\d]+)([EW])", latlon)
-	if rematch:
-		latmin = float(rematch.group(2))/60 + float(rematch.group(3).replace(",","."))/3600
-		lonmin = float(rematch.group(6))/60 + float(rematch.group(7).replace(",","."))/3600
-		latitude = "{}.{}".format(rematch.group(1), str(latmin)[2:8] )
-		lat_hemi = rematch.group(4)
-		longitude = "{}.{}".format(rematch.group(5), str(latmin)[2:8])
-		long_hemi = rematch.group(8)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, longitude
 
-	#N20?a?33?a?57.9?a? E110?a?04?a?25.2?a?
-	rematch = re.search("([NS])(\d+)\?a\?(\d+)\?a\?([.\d]+) ([EW])(\d+)\?a\?(\d+)\?a\?([.\d]+)", latlon)
-	if rematch:
-		latmin = float(rematch.group(2))/60 + float(rematch.group(3))/3600
-		lonmin = float(rematch.group(6))/60 + float(rematch.group(7))/3600
-		latitude = "{}.{}".format(rematch.group(1), str(latmin)[2:8] )
-		lat_hemi = rematch.group(4)
-		longitude = "{}.{}".format(rematch.group(5), str(latmin)[2:8])
-		long_hemi = rematch.group(8)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, longitude
-
-	#SRA206241	A	SRS775673	1348798	terrestrial metagenome	34?35.80?N, 104?30.05?E	08-Jan-2013	NA	China: Jinjia Cave, Zhang County, Gansu Province	terrestrial metagenome
-	rematch = re.search("(\d+)\?([.\d]+)\?([NS]), (\d+)\?([.\d]+)\?([EW])", latlon)
-	if rematch:
-		latmin = float(rematch.group(2))/60
-		lonmin = float(rematch.group(5))/60
-		latitude = "{}.{}".format(rematch.group(1), str(latmin)[2:8] )
-		lat_hemi = rematch.group(3)
-		longitude = "{}.{}".format(rematch.group(4), str(latmin)[2:8] )
-		long_hemi = rematch.group(6)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, latitude
+	# degree minute with . as separator, as degrees.minutes.decimal_minutes
+	#DRA011885	SAMD00291244	DRS180442	412755	marine sediment metagenome	41.10.5983 N 142.12.0328 E	2011-11-14	NA	Japan:off Shimokita Peninsula	AMPLICON	METAGENOMIC	PCR
+	#VT grassland: 44.1.912 N 72.7.769 W
+	# except where the first part is a stray 0
+	#SRA189798	LAO-D49	SRS720730	527639	wastewater metagenome	49.5134139 N 0.006.0179250 E	10/5/11	NA	Luxembourg: Schifflange	wastewater metagenome
 
-	#TODO
+	# ranges, where the first number is used
+	#SRA159216	fungioaklitter	SRS597132	556182	freshwater sediment metagenome	41.44-41.61 N 8.04-8.32 W	2012	NA	Portugal: Northwest	freshwater sediment metagenome
 	#SRA168388	4banana6 months-10D8	SRS650705	870726	food metagenome	15S 130-140E	Jun-2013	NA	Australia: northern prawn fishery	food metagenome
 
+	#TODO
+	# presumably just degree and minutes, though this should be southern hemisphere
+	#SRA169412	Kariega_Water_mouth	SRS628654	1169740	aquatic metagenome	33A?? 406 Lat, 26A?? 410 Long	19-Apr-2011	Water column	South Africa: Kariega Estuary	aquatic metagenome
 	#SRA059385	ISATAB-MBL-4:source:PAL_5_1_2008_01_23 orig	SRS367608	408172	marine metagenome	-66.45-73.03 orig	2008-01-23T04:15:00-06	NA	NA	marine metagenome
-
 	#SRA171032	Mu/10/1796	SRS644255	749906	gut metagenome	52529611; 13.401343	03. Mai 10	NA	Germany: Berlin	gut metagenome
-
-	# for all other cases, return None
-	if debug:
-		print( latlon, file=sys.stderr )
-	return None, None
-
-
-
-
-def one_part_latlon(latlon, debug=False):
-	'''take latlon that does not split at space, and return the true latitude and longitude'''
-	# cases are given below #
-	#########################
-
-	# A?? separated degrees with decimal minutes
-	#SRA169453	VAG_001	SRS628861	412755	marine sediment metagenome	-36A??30.783,-73A??01.083	14-Dec-2011	NA	Chile:Concepcion	marine sediment metagenome
-	rematch = re.search("(-?\d+)A\?\?([.\d]+),(-?\d+)A\?\?([.\d]+)", latlon)
-	if rematch:
-		latmin = float(rematch.group(2))/60
-		lonmin = float(rematch.group(4))/60
-		latitude = "{}.{}".format(rematch.group(1), str(latmin)[2:8] )
-		longitude = "{}.{}".format(rematch.group(3), str(latmin)[2:8] )
-		return latitude, longitude
-
-	# basically correct, / separator
-	#SRA116868	N2	SRS518857	717931	groundwater metagenome	35.97730333/84.27347358	Nov-2008	NA	USA: Tennessee	groundwater metagenome
-	rematch = re.search("(-?[.\d]+)/(-?[.\d]+)", latlon)
-	if rematch:
-		latitude = "{}".format(rematch.group(1))
-		longitude = "{}".format(rematch.group(2))
-		return latitude, longitude
-
-	#SRA127585	municipalAS_12	SRS543795	942017	activated sludge metagenome	34?2824.45S_58?358.42W	2013.04.10	NA	Buenos Aires	activated sludge metagenome
-	#SRA137650	pmoA_seep1	SRS557364	410658	soil metagenome	60?5318,14N,68?4205,75E	19-Jul-2012	NA	Russia: western siberia:khanty-mansiysk	soil metagenome
-	rematch = re.search("(\d+)\?(\d\d)([,.\d]+)([NS])[,_](\d+)\?(\d\d)([,.\d]+)([EW])", latlon)
-	if rematch:
-		latmin = float(rematch.group(2))/60 + float(rematch.group(3).replace(",","."))/3600
-		lonmin = float(rematch.group(6))/60 + float(rematch.group(7).replace(",","."))/3600
-		latitude = "{}.{}".format(rematch.group(1), str(latmin)[2:8] )
-		lat_hemi = rematch.group(4)
-		longitude = "{}.{}".format(rematch.group(5), str(latmin)[2:8])
-		long_hemi = rematch.group(8)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, longitude
-
 	#SRA045571	BII-S-25:sample:MCR_11_1_2009_05_09	SRS258379	408172	marine metagenome	-17.4848-149.8336	2009-05-09T:10	NA	NA	marine metagenome
 	#SRA059384	ISATAB-MBL-5:source:GNL	SRS367594	449393	freshwater metagenome	66.99-51.01	2007-06-20	NA	NA	freshwater metagenome
-
 	#SRA123701	WX_EW_meta	SRS529931	527639	wastewater metagenome	32?a?0?a?56.10-120?a?19?a?50.60	Aug-2013	NA	China: Nanjing	wastewater metagenome
-
 	#SRA030397	LTR_MRC_2008_Bacteria_16SRNA_gene_survey:sample:MOR4_2_011308	SRS173220	408172	marine metagenome	-166.5217	2008-01-13T08:5010	NA	NA	marine metagenome
-
 	#SRA171856	SYSTCO2	SRS643555	412755	marine sediment metagenome	~50S	Feb-2012	NA	Southern Ocean	marine sediment metagenome
 
-	# as above, for all other cases, return None
-	if debug:
-		print( latlon, file=sys.stderr )
-	return None, None
-
-
-
-def six_part_latlon(latlon, debug=False):
-	# presumably degree minute second
-	#SRA179448	Sed4	SRS685766	1169740	aquatic metagenome	63A? 33 23.4, 12A? 37 29.7	6/17/10	NA	Sweden: Digern_st_rnen	aquatic metagenome
-	rematch = re.search("(\d+)A\? (\d+) ([.\d]+), (\d+)A\? (\d+) ([.\d]+)", latlon)
-	if rematch:
-		latmin = float(rematch.group(2))/60 + float(rematch.group(3))/3600
-		lonmin = float(rematch.group(5))/60 + float(rematch.group(6))/3600
-		latitude = "{}.{}".format(rematch.group(1), str(latmin)[2:8] )
-		longitude = "{}.{}".format(rematch.group(4), str(latmin)[2:8] )
-		return latitude, longitude
-
-	#48? 15 N 6? 22 E
-	#10? 8 S, 145? 35 E
-	#15? 36.675 S, 167? 01.258 E
-	rematch = re.search("(\d+)\?? ([.\d]+) ([NS]),? (\d+)\?? ([.\d]+) ([EW])", latlon)
-	if rematch:
-		latmin = float(rematch.group(2))/60
-		lonmin = float(rematch.group(5))/60
-		latitude = "{}.{}".format(rematch.group(1), str(latmin)[2:8] )
-		lat_hemi = rematch.group(3)
-		longitude = "{}.{}".format(rematch.group(4), str(latmin)[2:8] )
-		long_hemi = rematch.group(6)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, latitude
-
-	#22o 46O? S; 43o 41O? W
-	rematch = re.search("(\d+)o (\d+)O\? ([NS]); (\d+)o (\d+)O\? ([EW])", latlon)
-	if rematch:
-		latmin = float(rematch.group(2))/60
-		lonmin = float(rematch.group(5))/60
-		latitude = "{}.{}".format(rematch.group(1), str(latmin)[2:8] )
-		lat_hemi = rematch.group(3)
-		longitude = "{}.{}".format(rematch.group(4), str(latmin)[2:8] )
-		long_hemi = rematch.group(6)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, latitude
-
-	#S 20 3.229502 W 176 8.015363
-	rematch = re.search("([NS]) (\d+) ([.\d]+) ([EW]) (\d+) ([.\d]+)", latlon)
-	if rematch:
-		latmin = float(rematch.group(3))/60
-		lonmin = float(rematch.group(6))/60
-		latitude = "{}.{}".format(rematch.group(2), str(latmin)[2:8] )
-		lat_hemi = rematch.group(1)
-		longitude = "{}.{}".format(rematch.group(5), str(latmin)[2:8] )
-		long_hemi = rematch.group(4)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, latitude
-
-	#VT grassland: 44.1.912 N 72.7.769 W
-	rematch = re.search("(\d+)\.([.\d]+) ([NS]) (\d+)\.([.\d]+) ([EW])", latlon)
-	if rematch:
-		latmin = float(rematch.group(2))/60
-		lonmin = float(rematch.group(5))/60
-		latitude = "{}.{}".format(rematch.group(1), str(latmin)[2:8] )
-		lat_hemi = rematch.group(3)
-		longitude = "{}.{}".format(rematch.group(4), str(latmin)[2:8] )
-		long_hemi = rematch.group(6)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, latitude
-
-	#N60 34 56.3 E14 38 20.5
-	rematch = re.search("([NS])(\d+) (\d+) ([.\d]+) ([EW])(\d+) (\d+) ([.\d]+)", latlon)
-	if rematch:
-		latmin = float(rematch.group(3))/60 + float(rematch.group(4).replace(",","."))/3600
-		lonmin = float(rematch.group(7))/60 + float(rematch.group(8).replace(",","."))/3600
-		latitude = "{}.{}".format(rematch.group(2), str(latmin)[2:8] )
-		lat_hemi = rematch.group(1)
-		longitude = "{}.{}".format(rematch.group(6), str(latmin)[2:8])
-		long_hemi = rematch.group(5)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, longitude
+	global last_rule
+	# most are already YY.YY NS XX.XX EW, so check for that before the full pattern
+	latlonsp = latlon.split(" ")
+	if len(latlonsp)==4 and latlonsp[1] in ["N","S"] and latlonsp[3] in ["E","W"] \
+			and latlonsp[0].replace(".","",1).isdecimal() and latlonsp[2].replace(".","",1).isdecimal() \
+			and float(latlonsp[0]) <= 90 and float(latlonsp[2]) <= 180:
+		latitude = "-" + latlonsp[0] if latlonsp[1]=="S" else latlonsp[0]
+		longitude = "-" + latlonsp[2] if latlonsp[3]=="W" else latlonsp[2]
+		last_rule = "lat-lon:standard decimal"
+		return latitude, longitude, "decimal"
+
+	match = latlon_re.fullmatch(latlon)
+	if match:
+		# groups are hemis, then pre deg dash mark min minmark sec post of each coordinate
+		groups = match.groups()
+		hemis = groups[0].split(":") if groups[0] else [None, None] # as N:E
+		first = (hemis[0] or groups[1] or groups[8], groups[2], groups[3], groups[4], groups[5], groups[7])
+		second = (hemis[1] or groups[9] or groups[16], groups[10], groups[11], groups[12], groups[13], groups[15])
+		# switch order if hemispheres are given as EW first, or NS second
+		if first[0] in ["E","W"] or second[0] in ["N","S"]:
+			first, second = second, first
+		if first[0] not in ["E","W"] and second[0] not in ["N","S"]:
+			latitude, lat_fix = coordinate_degrees(*first, max_degrees=90)
+			longitude, long_fix = coordinate_degrees(*second, max_degrees=180)
+			if latitude is not None and longitude is not None:
+				if "dms" in [lat_fix, long_fix]:
+					fixtype = "dms"
+				elif "range" in [lat_fix, long_fix]:
+					fixtype = "range"
+				elif lat_fix=="decimal" and long_fix=="decimal" and groups[8] and groups[16]:
+					fixtype = "decimal"
+				else:
+					fixtype = "unusual"
+				last_rule = "lat-lon:pattern {}".format(fixtype)
+				return latitude, longitude, fixtype
+		last_rule = "lat-lon:pattern out of range"
+	else:
+		last_rule = "lat-lon:no pattern"
 
-	# presumably just degree and minutes, though this should be southern hemisphere
-	# return None for now #TODO
-	#SRA169412	Kariega_Water_mouth	SRS628654	1169740	aquatic metagenome	33A?? 406 Lat, 26A?? 410 Long	19-Apr-2011	Water column	South Africa: Kariega Estuary	aquatic metagenome
-	rematch = re.search("(\d+)A\?\? (\d+) Lat, (\d+)A\?\? (\d+) Long", latlon)
-	if rematch:
-		latmin = float(rematch.group(2))/60
-		lonmin = float(rematch.group(4))/60
-		latitude = "{}.{}".format(rematch.group(1), str(latmin)[2:8] )
-		longitude = "{}.{}".format(rematch.group(3), str(latmin)[2:8] )
-		return None, None
-	#
+	# for all other cases, return None
 	if debug:
 		print( latlon, file=sys.stderr )
-	return None, None
-
-
-
-
-
-
-def four_part_latlon(latlon, debug=False):
-	# presumably degree minute second separated by A?? with NS, EW
-	#SRA172745	Tenerias	SRS647989	717931	groundwater metagenome	25A??32A??10 N, 100A??58A??55 W	Oct-2011NA	Mexico: State of Coahuila	groundwater metagenome
-	rematch = re.search("(\d+)A\?\?(\d+)A\?\?(\d+) ([NS]), (\d+)A\?\?(\d+)A\?\?(\d+) ([EW])", latlon)
-	if rematch:
-		latmin = float(rematch.group(2))/60 + float(rematch.group(3))/3600
-		lonmin = float(rematch.group(6))/60 + float(rematch.group(7))/3600
-		latitude = "{}.{}".format(rematch.group(1), str(latmin)[2:8] )
-		lat_hemi = rematch.group(4)
-		longitude = "{}.{}".format(rematch.group(5), str(latmin)[2:8] )
-		long_hemi = rematch.group(8)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, longitude
-
-	# mostly normal, includes A?? NS, EW
-	#SRA172235	C1	SRS649280	1515737	money metagenome	28.6100A?? N, 77.2300A?? E	2013	NA	India	money metagenome
-	rematch = re.search("([.\d]+)A\?\? ([NS]), ([.\d]+)A\?\? ([EW])", latlon)
-	if rematch:
-		latitude = "{}".format(rematch.group(1))
-		lat_hemi = rematch.group(2)
-		longitude = "{}".format(rematch.group(3))
-		long_hemi = rematch.group(4)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, longitude
-
-	# degree minute with o as degree symbol NS, EW
-	#SRA170498	454Reads_06037.sff	SRS637056	1041057	sea squirt metagenome	17o55 S, 177o16 E	NA	NA	Fiji	sea squirt metagenome
-	rematch = re.search("(\d+)o(\d+) ([NS]), (\d+)o(\d+) ([EW])", latlon)
-	if rematch:
-		latmin = float(rematch.group(2))/60
-		lonmin = float(rematch.group(5))/60
-		latitude = "{}.{}".format(rematch.group(1), str(latmin)[2:8] )
-		longitude = "{}.{}".format(rematch.group(4), str(latmin)[2:8] )
-		lat_hemi = rematch.group(3)
-		long_hemi = rematch.group(6)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, longitude
-
-	# degree minute with . as separator
-	#DRA011885	SAMD00291244	DRS180442	412755	marine sediment metagenome	41.10.5983 N 142.12.0328 E	2011-11-14	NA	Japan:off Shimokita Peninsula	AMPLICON	METAGENOMIC	PCR
-	rematch = re.search("(\d+)\.(\d+)\.(\d+) ([NS]), (\d+)\.(\d+)\.(\d+) ([EW])", latlon)
-	if rematch:
-		latmin = float(rematch.group(2))/60 + float(rematch.group(3))/3600
-		lonmin = float(rematch.group(6))/60 + float(rematch.group(7))/3600
-		latitude = "{}.{}".format(rematch.group(1), str(latmin)[2:8] )
-		lat_hemi = rematch.group(4)
-		longitude = "{}.{}".format(rematch.group(5), str(latmin)[2:8] )
-		long_hemi = rematch.group(8)
-		if lat_hemi=="S":
-			latitude = "-"+latitude
-		if long_hemi=="W":
-			longitude = "-"+longitude
-		return latitude, longitude
-
-	# appears to have A??A?? as decimal and switched order of EW, NS
-	#SRA172986	Zhang_Yang	SRS659936	410658	soil metagenome	116A??A??5927 E, 30A??A??2808 N	Apr 20th and May 25th,2012	NA	Anqing, Anhui	soil metagenome
-
-	#SRA127724	Reduced2	SRS534538	410658	soil metagenome	48?3013.50 N, 11?2650.80 E	26-Nov-2012	NA	Germany: Scheyern	soil metagenome
+	return None, None, None
 
-	# otherwise return None
-	if debug:
-		print( latlon, file=sys.stderr )
-	return None, None
+def coordinate_degrees(hemi, degrees, dash, mark, minutes, seconds, max_degrees):
+	'''return decimal degrees of one coordinate as a string, with - for S or W, and the kind of fix, or None, None
+	    numbers that are already decimal degrees are returned as they were written'''
+	fixtype = "unusual"
+	if dash:
+		if "-" in dash: # as 42-02-05
+			minutes, seconds = dash.split("-")
+			fixtype = "dms"
+		else: # range as 41.44-41.61, so take the first
+			fixtype = "range"
+	elif minutes is None:
+		degrees = degrees.rstrip(".")
+		if degrees.count(".")==2: # as 41.10.5983
+			degree, minute, decimal_minute = degrees.split(".")
+			if degree.lstrip("-")=="0": # stray 0. before the real number, as 0.006.0179250, keeping the sign
+				degrees = "{}{}.{}".format( "-" if degree[0]=="-" else "", int(minute), decimal_minute )
+			else:
+				degrees, minutes = degree, "{}.{}".format(minute, decimal_minute)
+				fixtype = "dms"
+		elif "." not in degrees and hemi and not mark and len(degrees.lstrip("-")) in [4,5] and int(degrees) > max_degrees:
+			# no decimal place, as 4075_N or 11188_W, otherwise too large numbers are out of range
+			degrees = "{}.{}".format(degrees[:-2], degrees[-2:])
+		elif not mark:
+			fixtype = "decimal"
+	if minutes is None:
+		if degrees.count(".") > 1:
+			return None, None
+		value = float(degrees)
+	else:
+		if "." in degrees:
+			return None, None
+		minutes = minutes.replace(",",".")
+		if seconds is None and len(minutes.split(".")[0]) > 2: # minutes and seconds with no separator, as 3610 or 581.59
+			minutes, seconds = minutes[:2], minutes[2:]
+		elif seconds is not None and "." in minutes:
+			return None, None
+		minutes = float(minutes)
+		seconds = float(seconds.replace(",",".")) if seconds else 0.0
+		if minutes >= 60 or seconds >= 60:
+			return None, None
+		value = abs(int(degrees)) + minutes/60 + seconds/3600
+		if degrees[0]=="-":
+			value = -value
+		degrees = "{:.6f}".format(value)
+	if abs(value) > max_degrees:
+		return None, None
+	if hemi in ["S","W"] and degrees[0]!="-":
+		degrees = "-" + degrees
+	return degrees, fixtype
 
 
 ################################################################################
 
 
 def fix_date_formats(rawdate):
+	global last_rule
 
 	# https://submit.ncbi.nlm.nih.gov/biosample/template/?package=Invertebrate.1.0&action=definition
 	# supported formats include "DD-Mmm-YYYY", "Mmm-YYYY", "YYYY" or ISO 8601 standard "YYYY-mm-dd", "YYYY-mm", "YYYY-mm-ddThh:mm:ss"; 
@@ -496,6 +311,7 @@ def fix_date_formats(rawdate):
 	if rematch:
 		year, month, day = rematch.groups()
 		ymd_format = "{}-{}-{}".format( year, month, day )
+		last_rule = "date:YYYY-mm-dd"
 		return ymd_format
 
 	# if date is DD-Mmm-YYYY format
@@ -505,11 +321,13 @@ def fix_date_formats(rawdate):
 		day, month, year = rematch.groups()
 		monthnum = months.get(month[0:3], "00")
 		ymd_format = "{}-{}-{}".format( year, monthnum, day )
+		last_rule = "date:DD-Mmm-YYYY"
 		return ymd_format
 
 	# if date is only YEAR-MO format
 	rematch = re.search("^(\d\d\d\d)-(\d\d)$", rawdate)
 	if rematch:
+		last_rule = "date:YYYY-mm"
 		return rawdate + "-00"
 
 	# if date is Mmm-YYYY format
@@ -518,261 +336,70 @@ def fix_date_formats(rawdate):
 		month, year = rematch.groups()
 		monthnum = months.get(month[0:3], "00")
 		ymd_format = "{}-{}-00".format( year, monthnum )
+		last_rule = "date:Mmm-YYYY"
 		return ymd_format
 
 	# if date is only YEAR
 	rematch = re.search("^(\d\d\d\d)$", rawdate)
 	if rematch:
+		last_rule = "date:YYYY"
 		return rawdate + "-00-00"
 
 	# for all other cases, return all zeroes
+	last_rule = "date:unknown"
 	return "0000-00-00"
 
 
 ################################################################################
 
 
-def import_geonames_features(geofeatures_file):
-	'''read featureCodes_en.txt, return a dict'''
-	feature_desc_dict = {"A.":"administrative definition", "H.":"hydrological type", 
-						"L.":"land use type", "P.":"populated type",
-						"R.":"road type", "S.":"spot building type",
-						"T.":"terrain type", "U.":"undersea type", "V.":"vegetation type" }
-	sys.stderr.write("# Reading feature descriptions from {}\n".format(geofeatures_file) )
-	for line in open(geofeatures_file,'r'):
-		if line and line[0] != "#": # remove comments
-			lsplits = line.split("\t")
-	# features are 3 column tab delimited, of
-	#code	name	description
-	#H.LKO	oxbow lake	a crescent-shaped lake commonly found adjacent to meandering streams
-			feature_code = lsplits[0]
-			feature_type = lsplits[1]
-			feature_desc = lsplits[2].strip()
-			feature_desc_dict[feature_code] = feature_type
-	sys.stderr.write("# Found {} feature codes\n".format( len(feature_desc_dict) ) )
-	return feature_desc_dict
-
-def import_geonames_country_codes(country_codes_file, verbose=False):
-	'''read countryInfo.txt, return a dict'''
-	#  0       1              2    3          4       5     6            7           8           9   10             11              12       13                 14                   15          16          17          18
-	#ISO	ISO3	ISO-Numeric	fips	Country	Capital	Area(in sq km)	Population	Continent	tld	CurrencyCode	CurrencyName	Phone	Postal Code Format	Postal Code Regex	Languages	geonameid	neighbours	EquivalentFipsCode
-	#AD	AND	020	AN	Andorra	Andorra la Vella	468	77006	EU	.ad	EUR	Euro	376	AD###	^(?:AD)*(\d{3})$	ca	3041565	ES,FR	
-	#AE	ARE	784	AE	United Arab Emirates	Abu Dhabi	82880	9630959	AS	.ae	AED	Dirham	971			ar-AE,fa,en,hi,ur	290557	SA,OM	
-	#AF	AFG	004	AF	Afghanistan	Kabul	647500	37172386	AS	.af	AFN	Afghani	93			fa-AF,ps,uz-AF,tk	1149361	TM,CN,IR,TJ,PK,UZ	
-	codes_to_country_dict = {"USA" : "United States" , "UK" : "United Kingdom" , "UAE": "United Arab Emirates"}
-
-	sys.stderr.write("# Reading country codes from {}  {}\n".format(country_codes_file, time.asctime() ) )
-	for line in open(country_codes_file,'r'):
-		line = line.rstrip()
-		if line and line[0]!="#":
-			lsplits = line.split("\t")
-			two_letter_code = lsplits[0].strip()
-			country_name = lsplits[4].strip()
-			codes_to_country_dict[two_letter_code] = country_name
-	sys.stderr.write("# Found {} country codes\n".format( len(codes_to_country_dict) ) )
-	return codes_to_country_dict
-
-def filter_unique_placenames( redundant_names_to_latlon, redundant_alternate_to_ascii ):
-	'''return dictionary of unique names with latlon'''
-	unique_name_latlon_dict = {} # key is non redundant names, value is latlon tuple
-
-	unique_key_counter = 0
-	redundant_key_counter = 0
-	usable_alternates = 0
-	redundant_alternates = 0
-	alternate_without_unique = 0
-
-	sys.stderr.write("# Filtering keys for unique place names  {}\n".format( time.asctime() ) )
-	for k,v in redundant_names_to_latlon.items():
-		if len(v) == 1:
-			unique_name_latlon_dict[k] = v[0]
-			unique_key_counter += 1
-		else:
-			redundant_key_counter += 1
-	sys.stderr.write("# {} unique , {} redundant places  {}\n".format( unique_key_counter, redundant_key_counter, time.asctime() ) )
-	sys.stderr.write("# Sorting alternate names  {}\n".format( time.asctime() ) )
-	for k,v in redundant_alternate_to_ascii.items():
-		if len(set(v)) == 1:	# meaning alternate links to 1 name
-			alt_ascii_latlon = unique_name_latlon_dict.get(v[0],[])
-			if alt_ascii_latlon: # meaning was in unique_name_latlon_dict as unique, use the latlon for this name
-				usable_alternates += 1
-				unique_name_latlon_dict[k] = alt_ascii_latlon
-			else: # meaning was not in unique_name_latlon_dict
-				alternate_without_unique += 1
-		else: # alternate has multiple redundant ascii possibilities
-			redundant_alternates += 1
-	sys.stderr.write("# {} usable alternates , {} redundant alternates , {} alternates to non-unique main  {}\n".format( usable_alternates, redundant_alternates, alternate_without_unique, time.asctime() ) )
-	return unique_name_latlon_dict
-
-def import_geonames_all_countries(geodata_file, feature_desc_dict, country_code_dict, verbose=False):
-	'''read allCountries.txt, return dict of unique placenames with latlon tuple'''
-
-	us_state_abbvs_to_name = { "AL": "Alabama", "AK": "Alaska", "AZ": "Arizona", "AR": "Arkansas", "CA": "California", "CO": "Colorado", "CT": "Connecticut", "DE": "Delaware", "FL": "Florida", "GA": "Georgia", "HI": "Hawaii", "ID": "Idaho", "IL": "Illinois", "IN": "Indiana", "IA": "Iowa", "KS": "Kansas", "KY": "Kentucky", "LA": "Louisiana", "ME": "Maine", "MD": "Maryland", "MA": "Massachusetts", "MI": "Michigan", "MN": "Minnesota", "MS": "Mississippi", "MO": "Missouri", "MT": "Montana", "NE": "Nebraska", "NV": "Nevada", "NH": "New Hampshire", "NJ": "New Jersey", "NM": "New Mexico", "NY": "New York", "NC": "North Carolina", "ND": "North Dakota", "OH": "Ohio", "OK": "Oklahoma", "OR": "Oregon", "PA": "Pennsylvania", "RI": "Rhode Island", "SC": "South Carolina", "SD": "South Dakota", "TN": "Tennessee", "TX": "Texas", "UT": "Utah", "VT": "Vermont", "VA": "Virginia", "WA": "Washington", "WV": "West Virginia", "WI": "Wisconsin", "WY": "Wyoming", "DC":"Washington DC" }
-
-	ch_canton_abbvs_to_name = {"ZH":"Zürich", "BE":"Bern", "LU":"Luzern", "UR":"Uri", "SZ":"Schwyz", "OW":"Obwalden", "NW":"Nidwalden", "GL":"Glarus", "ZG":"Zug" , "FR":"Fribourg", "SO":"Solothurn", "BS":"Basel-Stadt", "BL":"Basel-Landschaft", "SH":"Schaffhausen", "AR":"Appenzell Ausserrhoden", "AI":"Appenzell Innerrhoden", "SG":"St. Gallen", "GR":"Graubünden", "AG":"Aargau", "TG":"Thurgau", "TI":"Ticino", "VD":"Vaud", "VS":"Valais", "NE":"Neuchâtel", "GE":"Geneva", "JU":"Jura" }
-
-	entry_counter = 0 # total entries
-	no_country_entries = 0 # features without a country tag, such as 
-	feature_counter = defaultdict(int)
-	state_name_counter = defaultdict(int)
-	ascii_counts_dict = Counter() # counter for each ascii name, showing many are non-unique
-
-	main_names_to_latlon = defaultdict(list) # key is name in ascii, value is list of lat-long strings
-	# if list of strings contains 1 entry after parsing the entire file, then keep the name
-	alternate_to_ascii = defaultdict(list) # key is unicode name, alternate names, value is ascii name
-	top_level_latlon = {} # key is country, val is lat-lon as list
-
-	countries_w_sra_states = [ "US" , "CH" ]
-	# probaby exclude:
-	#Belgium:BRU	502
-	#Belgium:VLG	10173
-	#Belgium:WAL	9462
-	#United Kingdom:ENG	44470
-	#United Kingdom:NIR	1596
-	#United Kingdom:SCT	13105
-	#United Kingdom:WLS	4680
-
-	sys.stderr.write("# Reading place names and locations from {}  {}\n".format(geodata_file, time.asctime() ) )
-	for line in open(geodata_file,'r'):
-		line = line.strip()
-		if line and line[0] != "#": # remove comments
-			entry_counter += 1
-			if entry_counter % 1000000 == 0:
-				sys.stderr.write("# {}  {}\n".format(entry_counter, time.asctime() ) )
-
-			lsplits = line.split("\t")
-
-			asciiname = lsplits[2]
-
-			unicodename = lsplits[1]
-			alternate_names = set(lsplits[3].split(","))
-			country_code = lsplits[8] # AQ for Antarctica
-			if not country_code: # may be empty string
-				no_country_entries += 1
-			country_name = country_code_dict.get(country_code,None)
-
-			admin_level_1 = lsplits[10] # for states
-			if country_code == "US":
-				state_name = us_state_abbvs_to_name.get(admin_level_1,None)
-			elif country_code == "AU":
-				state_name = admin_level_1.replace("State of ", "")
-			elif country_code == "CH":
-				state_name = ch_canton_abbvs_to_name.get(admin_level_1,None)
-			else:
-				state_name = admin_level_1
-			country_state_str = "{}:{}".format( country_name , admin_level_1 )
-			state_name_counter[country_state_str] += 1
-
-			ascii_counts_dict[asciiname] += 1
-
-			latitude = lsplits[4]
-			longitude = lsplits[5]
-
-			feature_class = lsplits[6]
-			feature_code = lsplits[7]
-			combined_feature = "{}.{}".format(feature_class, feature_code)
-			feature_counter[combined_feature] += 1
-
-			# build names for dictionary
-			# any non-unique name will have a dict-list length of >1
-			# and cannot be used to ID places
-			if combined_feature=="A.PCLI": # meaning "independent political entity" or high level country ID
-				# records do not have location, then skip and use capital
-				alternate_to_ascii[asciiname].append( country_name )
-				for alternate_name in alternate_names:
-					alternate_to_ascii[alternate_name].append( country_name )
-				continue
-
-			#
-			# set the lat lon
-			#
-			if not latitude or not longitude:
-				continue
-
-			# of place name alone
-			# #TODO possibly only do this for A features, and only do country+place for P features
-			main_names_to_latlon[asciiname].append( [latitude, longitude] )
-			alternate_to_ascii[unicodename].append( asciiname )
-			for alternate_name in alternate_names:
-				alternate_to_ascii[alternate_name].append( asciiname )
-
-			# meaning entry is the capital, so set each country
-			if combined_feature=="P.PPLC":
-			# 323786	Ankara	Ankara	ANK,Anakara,Ancara,Ancyra,Ang-ka-la,Angkara,Angora,Anguriyah,Ankar,Ankara,Ankara khot,Ankaro,Ankuara,Ankura,Ankyra,Ankyra (Ankyra),Anqara,Enguri,Engüri,Enqere,akara,an ka la,angkala,ankara,anqrh,anqrt,xangkara,Ăng-kā-lá,,,	39.91987	32.85427	P	PPLC	TR		68				3517182	850	874	Europe/Istanbul	2019-09-05
-			# TR	TUR	792	TU	Turkey	Ankara	780580	82319724	AS	.tr	TRY	Lira	90	#####	^(\d{5})$	tr-TR,ku,diq,az,av	298795	SY,GE,IQ,IR,GR,AM,AZ,BG	
-				# also set the country, using strict country pattern of "country:"
-				# individual places should be set at "place" or "country:place"
-				# to distinguish between VA: Vatican: and VA Virginia
-				top_level_latlon["{}:".format(country_code)] = [latitude, longitude]
-				top_level_latlon["{}:".format(country_name)] = [latitude, longitude]
-				country_capital = "{}:{}".format( country_name , asciiname )
-				top_level_latlon[country_capital] = [latitude, longitude]
-
-			# try country name for most features, so "Lake Geneva" becomes "Switzerland:Lake Geneva"
-			if country_name is not None:
-				asciiname_w_country = "{}:{}".format( country_name , asciiname )
-				main_names_to_latlon[asciiname_w_country].append( [latitude, longitude] )
-				unicodename_w_country = "{}:{}".format( country_name , unicodename )
-				alternate_to_ascii[unicodename_w_country].append( asciiname_w_country )
-				for alternate_name in alternate_names:
-					unicodename_w_country = "{}:{}".format( country_name , alternate_name )
-					alternate_to_ascii[unicodename_w_country].append( asciiname_w_country )
-				# only make longer name if country AND admin level 1 are given, mostly for US states 
-				if admin_level_1 and country_code in countries_w_sra_states:
-					asciiname_w_adm1 = "{}:{},{}".format( country_name , admin_level_1 , asciiname )
-					main_names_to_latlon[asciiname_w_adm1].append( [latitude, longitude] )
-					asciiname_w_state = "{}:{},{}".format( country_name , state_name , asciiname )
-					main_names_to_latlon[asciiname_w_state].append( [latitude, longitude] )
-					unicodename_w_adm1 = "{}:{},{}".format( country_name , state_name , unicodename )
-					alternate_to_ascii[asciiname_w_adm1].append( asciiname_w_adm1 )
-					for alternate_name in alternate_names:
-						unicodename_w_adm1 = "{}:{},{}".format( country_name , state_name , alternate_name )
-						alternate_to_ascii[unicodename_w_adm1].append( asciiname_w_adm1 )
-
-	if verbose:
-		for feature in sorted(feature_counter.keys()):
-			ft_outline = "{0}\t{1}\t{2}\n".format( feature, feature_desc_dict.get(feature,"-"), feature_counter.get(feature,0) )
-			sys.stderr.write(ft_outline)
-
-		for state_name in sorted(state_name_counter.keys()):
-			sn_outline = "{0}\t{1}\n".format(state_name, state_name_counter.get(state_name,0) )
-			sys.stderr.write(sn_outline)
-
-	feature_sum = sum(feature_counter.values())
-	sys.stderr.write("# Found {} place names  {}\n".format(feature_sum, time.asctime() ) )
-
-	# prove that each ascii name occurs exactly once
-	# without country codes
-	# Most common was [('San Antonio', 2791), ('San Jose', 2647), ('First Baptist Church', 2639), 
-	# ('The Church of Jesus Christ of Latter Day Saints', 2175), ('Santa Rosa', 1896), ('San Francisco', 1862), 
-	# ('San Isidro', 1791), ('La Esperanza', 1711), ('San Juan', 1710), ('Church of Christ', 1657), 
-	# ('San Miguel', 1621), ('Mill Creek', 1533), ('Spring Creek', 1513), ('First Presbyterian Church', 1342), 
-	# ('San Pedro', 1285), ('Dry Creek', 1266), ('Santa Cruz', 1251), ('Santa Maria', 1247), ('San Rafael', 1194), 
-	# ('Rampur', 1171), ('Buenavista', 1140), ('Krajan', 1126), ('Stormyra', 1103), ('Mount Zion Church', 1098), 
-	# ('Bear Creek', 1083), ('Bethel Church', 1075), ('Mud Lake', 1071), ('Santa Rita', 1001), ('El Porvenir', 990), 
-	# ('La Palma', 989), ('Cerro Colorado', 973), ('First United Methodist Church', 954), ('Buenos Aires', 919), 
-	# ('Kingdom Hall of Jehovahs Witnesses', 904), ('Haugen', 898), ('San Luis', 890), ('La Laguna', 886), 
-	# ('Buena Vista', 868), ('Ojo de Agua', 860), ('Rock Creek', 849), ('Santa Ana', 848), ('El Carmen', 817), 
-	# ('El Rincon', 815), ('Church of God', 812), ('Santa Lucia', 806), ('Indian Creek', 803), 
-	# ('Long Lake', 798), ('Cedar Creek', 792), ('Santa Elena', 776), ('Saint Johns Church', 774)] 
-	# need to prefix country code to make places unique
-	if verbose:
-		sys.stderr.write("# Most common was {} \n".format( ascii_counts_dict.most_common(50) ) )
-
-	#
-	# begin sorting the unique placenames
-	#
-	unique_name_to_latlon = filter_unique_placenames( main_names_to_latlon, alternate_to_ascii )
-	sys.stderr.write("# Adding {} top level annotations\n".format( len(top_level_latlon) ) )
-	unique_name_to_latlon.update( top_level_latlon )
-	return unique_name_to_latlon
-
-
+class GeonamesIndex:
+	'''place names from the SQLite index of import_geonames_db.py, with get() like the dict from import_geonames_all_countries'''
+	def __init__(self, indexfile):
+		if not os.path.isfile(indexfile):
+			sys.exit("ERROR: CANNOT FIND GEONAMES INDEX {}, BUILD IT WITH import_geonames_db.py --index".format(indexfile) )
+		self.indexfile = indexfile
+		self.connection = None
+		self.connection_pid = None
+		index_meta = dict(self.connect().execute("SELECT key, value FROM meta"))
+		if index_meta.get("version") != GEONAMES_INDEX_VERSION:
+			sys.exit("ERROR: GEONAMES INDEX {} IS VERSION {}, NOT {}, REBUILD WITH import_geonames_db.py".format(indexfile, index_meta.get("version"), GEONAMES_INDEX_VERSION) )
+		self.place_count = int(index_meta.get("places",0))
+
+	def connect(self):
+		'''return the connection of this process, as one connection cannot be shared by forked --workers'''
+		if self.connection_pid != os.getpid():
+			# read-only, so many runs and workers can share one index
+			self.connection = sqlite3.connect("file:{}?mode=ro".format(self.indexfile), uri=True)
+			self.connection_pid = os.getpid()
+		return self.connection
+
+	def get(self, name, default=None):
+		row = self.connect().execute("SELECT latitude, longitude FROM places WHERE name=?", (name,) ).fetchone()
+		if row is None:
+			return default
+		return list(row)
+
+	def get_fuzzy_names(self):
+		return [ row[0] for row in self.connect().execute("SELECT name FROM fuzzy_names") ]
+
+	def get_country_cells(self):
+		country_cells = defaultdict(set)
+		for cell, country in self.connect().execute("SELECT cell, country FROM country_cells"):
+			country_cells[cell].add(country)
+		return dict(country_cells)
+
+# other names for countries in locations, to the names in countryInfo.txt
+country_aliases = { "US":"United States", "USA":"United States", "Viet nam":"Vietnam", "Viet Nam":"Vietnam", "Czech Republic":"Czechia",
+	"Korea":"South Korea", "The Gambia":"Gambia", "The Bahamas":"Bahamas", "Commonwealth of Puerto Rico":"Puerto Rico", "PuertoRico":"Puerto Rico",
+	"Republic of Ireland":"Ireland", "Cote dIvoire":"Ivory Coast" }
 
 def get_geonames_latlon(location, geonames_places, debug=False):
 	'''check if place has a geonames lat lon or use capital city by country, and return lat and lon'''
+	global last_rule
 	if geonames_places.get(location, False):
 		latitude, longitude = geonames_places.get(location)
+		last_rule = "location:location"
 		return latitude, longitude, location
 
 	country_place_splits = location.split(":",1)
@@ -783,27 +410,11 @@ def get_geonames_latlon(location, geonames_places, debug=False):
 		country_strict = "{}:".format(country)
 		if geonames_places.get(country_strict, False):
 			latitude, longitude = geonames_places.get(country_strict)
+			last_rule = "location:country only"
 			return latitude, longitude, False # flag for country only
 		place = False
 
-	if country=="US" or country=="USA":
-		country = "United States"
-	elif country=="Viet nam" or country=="Viet Nam":
-		country = "Vietnam"	
-	elif country=="Czech Republic":
-		country = "Czechia"
-	elif country=="Korea":
-		country = "South Korea"
-	elif country=="The Gambia":
-		country = "Gambia"
-	elif country=="The Bahamas":
-		country = "Bahamas"
-	elif country=="Commonwealth of Puerto Rico" or country=="PuertoRico":
-		country = "Puerto Rico"
-	elif country=="Republic of Ireland":
-		country = "Ireland"
-	elif country=="Cote dIvoire":
-		country = "Ivory Coast"
+	country = country_aliases.get(country, country)
 
 	if place=="Unspecified": # country given, but not place ERA815140 ERA1217322 ERA730222
 		place = False
@@ -811,40 +422,48 @@ def get_geonames_latlon(location, geonames_places, debug=False):
 	if place:
 		if geonames_places.get(place, False):
 			latitude, longitude = geonames_places.get(place)
+			last_rule = "location:place"
 			return latitude, longitude, place
 
 		location_no_space = "{}:{}".format( country, place )
 		if geonames_places.get(location_no_space, False):
 			latitude, longitude = geonames_places.get(location_no_space)
+			last_rule = "location:country:place"
 			return latitude, longitude, location_no_space
 
 		if country=="China": # many cities are not annotated as "Shi" like "Beijing Shi"
 			china_city_with_shi = "{}:{} Shi".format( country, place )
 			if geonames_places.get(china_city_with_shi, False):
 				latitude, longitude = geonames_places.get(china_city_with_shi)
+				last_rule = "location:country:place Shi"
 				return latitude, longitude, china_city_with_shi
 
 		place_comma_splits = [ x.strip() for x in place.split(",",1) ]
 		co_pl_comma_no_space = "{}:{}".format( country, ",".join(place_comma_splits) )
 		if geonames_places.get(co_pl_comma_no_space, False):
 			latitude, longitude = geonames_places.get(co_pl_comma_no_space)
+			last_rule = "location:country:place,place"
 			return latitude, longitude, co_pl_comma_no_space
 		elif geonames_places.get(place_comma_splits[-1], False):
 			latitude, longitude = geonames_places.get(place_comma_splits[-1])
+			last_rule = "location:last of place,place"
 			return latitude, longitude, place_comma_splits[-1]
 		if country=="United States":
 			swap_US_state_and_city = "{}:{}".format( country, ",".join(place_comma_splits[::-1]) )
 			if geonames_places.get(swap_US_state_and_city, False):
 				latitude, longitude = geonames_places.get(swap_US_state_and_city)
+				last_rule = "location:United States:city,state"
 				return latitude, longitude, swap_US_state_and_city
 
 		place_dot_splits = [ x.strip() for x in place.split(":",1) ]
 		co_pl_dot_no_space = "{}:{}".format( country, ",".join(place_dot_splits) )
 		if geonames_places.get(co_pl_dot_no_space, False):
 			latitude, longitude = geonames_places.get(co_pl_dot_no_space)
+			last_rule = "location:country:place:place"
 			return latitude, longitude, co_pl_dot_no_space
 		elif geonames_places.get(place_dot_splits[-1], False):
 			latitude, longitude = geonames_places.get(place_dot_splits[-1])
+			last_rule = "location:last of place:place"
 			return latitude, longitude, place_dot_splits[-1]
 
 	# known exceptions #TODO
@@ -882,330 +501,682 @@ def get_geonames_latlon(location, geonames_places, debug=False):
 	no_line_country = "{}:".format( country.replace("_"," ") )
 	if geonames_places.get(no_line_country, False):
 		latitude, longitude = geonames_places.get(no_line_country)
+		last_rule = "location:country of any place"
 		return latitude, longitude, False # flag for country only
 
 	# meaning search did not work
 	#print( "location {}   {}   {}".format(location, country, place), file=sys.stdout )
+	last_rule = "location:not found"
 	return None, None, None
 
+def fuzzy_key(name):
+	'''return name in lower case without spaces or punctuation, so sandiego is the same as San Diego'''
+	return "".join( c for c in name.lower() if c.isalnum() )
+
+def key_deletions(key, distance):
+	'''return set of the key and all strings made by deleting up to distance characters'''
+	deletions = {key}
+	last_deletions = {key}
+	for i in range(distance):
+		last_deletions = { d[:j] + d[j+1:] for d in last_deletions for j in range(len(d)) }
+		deletions.update(last_deletions)
+	return deletions
+
+def edit_distance(first, second, limit):
+	'''return number of insertions, deletions, substitutions and swaps of neighbors to change first into second
+	    or any number over limit, if it is more than that'''
+	before_last_row = None
+	last_row = list(range(len(second) + 1))
+	for i in range(1, len(first) + 1):
+		row = [i] + [0] * len(second)
+		for j in range(1, len(second) + 1):
+			row[j] = min( last_row[j] + 1, row[j-1] + 1, last_row[j-1] + (first[i-1] != second[j-1]) )
+			if i > 1 and j > 1 and first[i-1] == second[j-2] and first[i-2] == second[j-1]:
+				row[j] = min( row[j], before_last_row[j-2] + 1 )
+		if min(row) > limit:
+			return limit + 1
+		before_last_row, last_row = last_row, row
+	return last_row[-1]
+
+class FuzzyPlaceIndex:
+	'''SymSpell index of place names, where names within an edit distance share a deletion of the first characters
+	    so only names sharing a deletion with the query are compared'''
+	def __init__(self, names, max_distance, prefix_length=7):
+		self.max_distance = max_distance
+		self.prefix_length = prefix_length
+		self.key_to_names = {} # key is fuzzy_key, value is set of names with that key
+		self.deletion_to_keys = defaultdict(list) # key is deletion of key prefix, value is list of keys
+		for name in names:
+			key = fuzzy_key(name)
+			if not key:
+				continue
+			if key in self.key_to_names:
+				self.key_to_names[key].add(name)
+				continue
+			self.key_to_names[key] = {name}
+			for deletion in key_deletions(key[:prefix_length], max_distance):
+				self.deletion_to_keys[deletion].append(key)
+
+	def find(self, name):
+		'''return the one name closest to the query name, or None if none are close enough or several are equally close'''
+		key = fuzzy_key(name)
+		# allow fewer changes for short names, as almost any 3 letters are 1 change from some place
+		distance_limit = min( self.max_distance, len(key) // 3 )
+		best_distance = distance_limit + 1
+		best_keys = []
+		compared_keys = set()
+		for deletion in key_deletions(key[:self.prefix_length], distance_limit):
+			for candidate in self.deletion_to_keys.get(deletion, []):
+				if candidate in compared_keys or abs(len(candidate) - len(key)) > distance_limit:
+					continue
+				compared_keys.add(candidate)
+				distance = edit_distance(key, candidate, distance_limit)
+				if distance > distance_limit: # names over the limit are never matches, even if nothing is closer
+					continue
+				if distance < best_distance:
+					best_distance = distance
+					best_keys = [candidate]
+				elif distance == best_distance:
+					best_keys.append(candidate)
+		best_names = set()
+		for best_key in best_keys:
+			best_names.update( self.key_to_names[best_key] )
+		if len(best_names) == 1:
+			return best_names.pop()
+		return None
+
+def get_geonames_latlon_fuzzy(location, geonames_places, fuzzy_index=None):
+	'''as get_geonames_latlon, and if nothing was found, try again with the closest names for the country and place
+	    return lat, lon, flag, and the corrected location if it was found that way, otherwise None'''
+	global last_rule
+	latitude, longitude, geonames_flag = get_geonames_latlon(location, geonames_places)
+	if latitude is not None or fuzzy_index is None:
+		return latitude, longitude, geonames_flag, None
+	location_parts = [ part.strip() for part in location.split(":",1) ]
+	corrected_parts = [ fuzzy_index.find(part) or part for part in location_parts ]
+	if corrected_parts != location_parts:
+		corrected_location = ":".join(corrected_parts)
+		latitude, longitude, geonames_flag = get_geonames_latlon(corrected_location, geonames_places)
+		if latitude is not None:
+			last_rule = "location:fuzzy"
+			return latitude, longitude, geonames_flag, corrected_location
+	last_rule = "location:fuzzy not found"
+	return None, None, None, None
+
+class CountryGrid:
+	'''countries of GeoNames places in each cell of a 1 degree grid, to check that coordinates are near the named country'''
+	def __init__(self, cell_countries):
+		self.cell_countries = cell_countries
+		self.countries = set()
+		for countries in cell_countries.values():
+			self.countries.update(countries)
+
+	def near_country(self, latitude, longitude, country):
+		'''return True if the country has any place in the cell of the coordinates or the 8 cells around it'''
+		row = int(math.floor(latitude)) + 90
+		column = int(math.floor(longitude)) + 180
+		for cell_row in range(row - 1, row + 2):
+			for cell_column in range(column - 1, column + 2):
+				if country in self.cell_countries.get( cell_row * 360 + cell_column % 360, () ):
+					return True
+		return False
+
+def negate_degrees(degrees):
+	'''return decimal degrees string with the opposite sign'''
+	return degrees[1:] if degrees[0]=="-" else "-" + degrees
+
+def check_country(latitude, longitude, location, country_grid):
+	'''return latitude and longitude near the country named in the location, and a flag of
+	    ok if they already were, flipped-lon, flipped-lat, flipped-both or swapped if that change puts them in the country,
+	    far if no change does, or NA if the location does not name a country'''
+	global last_rule
+	country = location.split(":",1)[0].strip()
+	country = country_aliases.get(country, country)
+	if country not in country_grid.countries:
+		last_rule = "country:not a country"
+		return latitude, longitude, "NA"
+	if country_grid.near_country(float(latitude), float(longitude), country):
+		last_rule = "country:ok"
+		return latitude, longitude, "ok"
+	# E-W mirror images are the most common error, so are tried first
+	for flag, new_latitude, new_longitude in [ ("flipped-lon", latitude, negate_degrees(longitude)), ("flipped-lat", negate_degrees(latitude), longitude),
+			("flipped-both", negate_degrees(latitude), negate_degrees(longitude)), ("swapped", longitude, latitude) ]:
+		if abs(float(new_latitude)) <= 90 and country_grid.near_country(float(new_latitude), float(new_longitude), country):
+			last_rule = "country:{}".format(flag)
+			return new_latitude, new_longitude, flag
+	last_rule = "country:far"
+	return latitude, longitude, "far"
+
+class GeonamesNameRecorder:
+	'''dict-like that finds nothing, but keeps every name tried by get_geonames_latlon, so all names that could match are known'''
+	def __init__(self):
+		self.names = set()
+
+	def get(self, name, default=None):
+		self.names.add(name)
+		return default
+
+def read_input_locations(inputfile):
+	'''return set of all location names from the input table'''
+	locations = set()
+	for line in open(inputfile,'r'):
+		lsplits = line.split("\t")
+		if len(lsplits) > 8 and lsplits[8] != "NA":
+			locations.add(lsplits[8])
+	return locations
+
+def import_geonames_for_locations(geodata_file, feature_desc_dict, country_code_dict, locations, verbose=False):
+	'''read allCountries.txt keeping only names that could match any of the locations, return GeonamesPlaces of unique placenames
+	    names are unique or not as if the whole file was read, as all places with those names are kept'''
+	name_recorder = GeonamesNameRecorder()
+	for location in locations:
+		get_geonames_latlon(location, name_recorder)
+	needed_names = name_recorder.names
+	sys.stderr.write("# {} locations in the input could match {} place names  {}\n".format( len(locations), len(needed_names), time.asctime() ) )
+	# alternate names are used by their ascii name, which can also be an alternate name of another
+	# so read again with those names until no more are needed
+	while True:
+		main_names_to_place, alternate_to_ascii, top_level_place, place_latitudes, place_longitudes, place_formats, fuzzy_names, country_cells = read_geonames_places(geodata_file, feature_desc_dict, country_code_dict, verbose, needed_names)
+		ascii_names = set( v for v in alternate_to_ascii.values() if v != AMBIGUOUS_PLACE and v is not None )
+		if ascii_names.issubset(needed_names):
+			break
+		sys.stderr.write("# reading again for {} ascii names of alternate names  {}\n".format( len(ascii_names - needed_names), time.asctime() ) )
+		needed_names.update(ascii_names)
+
+	unique_name_to_place = filter_unique_placenames( main_names_to_place, alternate_to_ascii )
+	sys.stderr.write("# Adding {} top level annotations\n".format( len(top_level_place) ) )
+	unique_name_to_place.update( top_level_place )
+	return GeonamesPlaces( unique_name_to_place, place_latitudes, place_longitudes, place_formats, fuzzy_names, country_cells )
+
 
 # BEGIN MAIN CODE BLOCK
 ##################################################
 ##################################################
 
-def main(argv, wayout):
-	if not len(argv):
-		argv.append('-h')
-	parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=__doc__)
-	parser.add_argument('-i','--input', help="raw SRA extended metadata file, from parse_ncbi_taxonomy.py")
-	parser.add_argument('-c','--geonames-countries', help="optional GeoNames country info, from countryInfo.txt")
-	parser.add_argument('-g','--geonames-data', help="optional GeoNames data, from allCountries.txt")
-	parser.add_argument('--verbose', action="store_true", help="make verbose")
-	args = parser.parse_args(argv)
-
-	
-	#
-	# READ OPTIONAL GEONAMES DATABASE
-	#
-	geo_feature_descr_dict = {} # use blank to make things run anyway
-	if args.geonames_data and args.geonames_countries:
-		print( "# Importing optional geonames database for location searches  {}".format(time.asctime()), file=sys.stderr )
-		geo_country_info_dict = import_geonames_country_codes( args.geonames_countries , args.verbose )
-		unique_name_to_latlon = import_geonames_all_countries( args.geonames_data , geo_feature_descr_dict , geo_country_info_dict , args.verbose )
+# includes typo of 'not availalble' and 'missisng_1'
+missing_variants = ["missing", "Missing", "MISSING", "NA", "N/A", "na", "n/a", "n/A", "N.A.", "NOT APPLICABLE", "Not Applicable", "Not applicable", "not applicable", "not appicable", "not determined", "not recorded", "not collected", "Not collected", "Not Collected", "NOT COLLECTED", "not available", "Not available", "Not Available", "not availalble", "not provided", "Not provided", "Unknown", "unknown", "-", "None", "none", "missisng_1", "missisng_2", "missisng_3", "missisng_4", "NULL", "?", "AE", "Unspecified", "NO_VALUE"]
 
+nc_variants = ["large intestine", "blood", "Vosges", "V5-V9", "Kolkata", "diverse", "bacteria", "Morvan mountains", "lab", "Synthetic mixture of 18 yeast/bacteria/archaeal species", ""]
 
-	#
-	# FIX LAT-LON INFORMATION
-	#
+# lines of the table are read as bytes, so the variants are compared as bytes
+missing_bytes = frozenset( v.encode("utf-8") for v in missing_variants )
+nc_bytes = frozenset( v.encode("utf-8") for v in nc_variants )
 
+def new_polish_counts():
+	'''return dict of counters for each kind of fix or removal, all 0'''
 	# The geographical coordinates of the location where the sample was collected. 
 	# Specify as degrees latitude and longitude in format "d[d.dddd] N|S d[dd.dddd] W|E", eg, 38.98 N 77.11 W
-	# counters for various missing data
-	dms_counter = 0
-	range_counter = 0
-	one_part_fix = 0
-	two_part_fix = 0
-	four_part_fix = 0
-	six_part_fix = 0
-
-	non_nsew_counter = 0 # latlon format is not NSEW
-	void_counter = 0 # latlon is VOID from previous steps
-	missing_latlon_counter = 0 # latlon is given as one of the missing_variants
-
-	loc_field_counter = 0 # something is in the location field
-	loc_na_counter = 0 # location is NA from previous steps
-	missing_loc_counter = 0 # location is one of the missing_variants
-	no_location_counter = 0 # location is blank
-
-	match_any_loc_counter = 0 # number of times that the latlon was missing, but found some address in geonames
-	found_exact_location = 0 # found precise location beyond just country
-	country_only_names = 0 # number of cases that only had country level ID
-
-	cannot_find_loc_counter = 0 # location given, but cannot get lat lon from geonames
-
-	# samples with EITHER a valid lat-lon (even if bad) or valid location (even if not found)
-	any_source_position = 0
-	# this should be forbidden, but happens anyway
-	no_source_position_given = 0 # counter for samples with not latlon AND no given location
-
-	# counters for date correction
-	no_date_counter = 0
-	has_date_counter = 0
-	strange_date = 0
-
-	# includes typo of 'not availalble' and 'missisng_1'
-	missing_variants = ["missing", "Missing", "MISSING", "NA", "N/A", "na", "n/a", "n/A", "N.A.", "NOT APPLICABLE", "Not Applicable", "Not applicable", "not applicable", "not appicable", "not determined", "not recorded", "not collected", "Not collected", "Not Collected", "NOT COLLECTED", "not available", "Not available", "Not Available", "not availalble", "not provided", "Not provided", "Unknown", "unknown", "-", "None", "none", "missisng_1", "missisng_2", "missisng_3", "missisng_4", "NULL", "?", "AE", "Unspecified", "NO_VALUE"]
-
-	nc_variants = ["large intestine", "blood", "Vosges", "V5-V9", "Kolkata", "diverse", "bacteria", "Morvan mountains", "lab", "Synthetic mixture of 18 yeast/bacteria/archaeal species", ""]
-	nc_counter = 0
-
-	entry_count = 0
-	print_count = 0
-	sys.stderr.write("# Reading {}\n".format(args.input) )
-	for line in open(args.input,'r'):
-		entry_count += 1
+	return {
+		# counters for various missing data
+		"dms_counter":0,
+		"range_counter":0,
+		"unusual_fix":0,
+
+		"non_nsew_counter":0, # latlon format is not NSEW
+		"void_counter":0, # latlon is VOID from previous steps
+		"missing_latlon_counter":0, # latlon is given as one of the missing_variants
+
+		"loc_field_counter":0, # something is in the location field
+		"loc_na_counter":0, # location is NA from previous steps
+		"missing_loc_counter":0, # location is one of the missing_variants
+		"no_location_counter":0, # location is blank
+
+		"match_any_loc_counter":0, # number of times that the latlon was missing, but found some address in geonames
+		"found_exact_location":0, # found precise location beyond just country
+		"country_only_names":0, # number of cases that only had country level ID
+		"fuzzy_location_counter":0, # found only after correcting the spelling of the location
+
+		"cannot_find_loc_counter":0, # location given, but cannot get lat lon from geonames
+
+		"country_near_counter":0, # lat-lon is near the country of the location
+		"country_flip_counter":0, # lat-lon is in the country only after flipping a sign or swapping
+		"country_far_counter":0, # lat-lon is far from the country, even after flipping
+
+		# samples with EITHER a valid lat-lon (even if bad) or valid location (even if not found)
+		"any_source_position":0,
+		# this should be forbidden, but happens anyway
+		"no_source_position_given":0, # counter for samples with not latlon AND no given location
+
+		# counters for date correction
+		"no_date_counter":0,
+		"has_date_counter":0,
+		"strange_date":0,
+
+		"nc_counter":0,
+
+		"entry_count":0,
+		"print_count":0
+	}
+
+partition_fields = ["year", "category"]
+
+class PartitionWriter:
+	'''output lines of each partition by year and/or category, written to one file per partition in outputdir
+	    lines are kept until there are buffer_size bytes, so few files are open at once
+	    without outputdir, lines are only kept, to be added to the writer of the main process with add_chunk'''
+	def __init__(self, outputdir, partition_by, buffer_size=64000000):
+		self.outputdir = outputdir
+		self.partition_by = partition_by
+		self.buffer_size = buffer_size
+		self.buffers = defaultdict(list)
+		self.buffered_bytes = 0
+		self.rows = Counter()
+		self.filenames = {}
+		if outputdir is not None and not os.path.isdir(outputdir):
+			os.makedirs(outputdir)
+
+	def partition_key(self, year, category):
+		'''return tuple of the values of each partition field, in the order of partition_by'''
+		values = {"year":year, "category":category}
+		return tuple( values[field] for field in self.partition_by )
+
+	def add(self, key, line):
+		self.buffers[key].append(line)
+		self.rows[key] += 1
+		self.buffered_bytes += len(line)
+		if self.outputdir is not None and self.buffered_bytes > self.buffer_size:
+			self.flush()
+
+	def add_chunk(self, chunk_buffers):
+		'''add lines of each partition from one chunk of --workers, in the order of the chunks'''
+		for key, lines in chunk_buffers.items():
+			self.buffers[key].extend(lines)
+			self.rows[key] += len(lines)
+			self.buffered_bytes += sum(len(line) for line in lines)
+		if self.buffered_bytes > self.buffer_size:
+			self.flush()
+
+	def partition_filename(self, key):
+		'''return file name of the partition, as the values joined by _ with only letters, numbers, . and -'''
+		filename = self.filenames.get(key, None)
+		if filename is None:
+			basename = "_".join( re.sub("[^A-Za-z0-9.-]+", "_", value) for value in key )
+			filename = "{}.tab".format(basename)
+			usednames = set(self.filenames.values())
+			suffix = 1
+			while filename in usednames: # such as categories that differ only by punctuation
+				suffix += 1
+				filename = "{}.{}.tab".format(basename, suffix)
+			self.filenames[key] = filename
+			# files from an earlier run are replaced
+			open(os.path.join(self.outputdir, filename), 'wb').close()
+		return filename
+
+	def flush(self):
+		for key, lines in self.buffers.items():
+			with open(os.path.join(self.outputdir, self.partition_filename(key)), 'ab') as partitionfile:
+				partitionfile.write( b"".join(lines) )
+		self.buffers.clear()
+		self.buffered_bytes = 0
+
+	def close(self):
+		'''write remaining lines, and the index of rows in each partition, return the name of the index'''
+		self.flush()
+		indexfilename = os.path.join(self.outputdir, "partition_index.tab")
+		with open(indexfilename, 'w') as indexfile:
+			indexfile.write( "{}\trows\tfile\n".format( "\t".join(self.partition_by) ) )
+			for key in sorted(self.rows):
+				indexfile.write( "{}\t{}\t{}\n".format( "\t".join(key), self.rows[key], self.partition_filename(key) ) )
+		return indexfilename
+
+def polish_lines(lines, wayout, cached_functions, use_geonames, fuzzy_column=False, country_check=None, partitions=None):
+	'''fix lat-lon, location and date of each line of the table, write kept lines to wayout, and return dict of counts
+	    lines are bytes, and only the lat-lon, date and location are decoded, so wayout must take bytes
+	    if partitions is a PartitionWriter, also add each kept line to the partition of its year and category
+	    if fuzzy_column, add a column of the corrected location for fuzzy matches, otherwise NA
+	    if country_check is flag or fix, add a column of the check of lat-lon against the country, and for fix, use the changed lat-lon'''
+	counts = new_polish_counts()
+	for line in lines:
+		counts["entry_count"] += 1
 		has_latlon_field = True
 		has_location_field = True
 		bad_latlon = False
 		location_found = False
+		fuzzy_location = None
+		country_flag = "NA"
 
 		# basic pattern should split line into 10 columns
 #    sample    alias    accession  taxonID   scientific name   lat-lon  date  source  location   sample type
 #       0         1          2         3              4           5     6     7        8         9
 #SRA191450	112451830	SRS723069	646099	human metagenome	NA	NA	stool	NA	human metagenome
 #SRA594737	C2b.24.015	SRS2396010	556182	freshwater sediment metagenome	46.512 N 6.587 E	May-2012	Lake sediment_21	Switzerland: Lake Geneva	freshwater sediment metagenome
-		lsplits = line.split("\t")
+		# columns after the location are never changed, so are kept as one piece
+		if line.endswith(b"\r\n"):
+			line = line[:-2] + b"\n"
+		lsplits = line.split(b"\t", 9)
 		raw_latlon = lsplits[5]
 		location_name = lsplits[8]
 
 		# remove obvious ones
-		if raw_latlon=="VOID": # VOID should derive from previous steps
-			void_counter += 1
+		if raw_latlon==b"VOID": # VOID should derive from previous steps
+			counts["void_counter"] += 1
 			has_latlon_field = False
-		elif raw_latlon in missing_variants:
-			missing_latlon_counter += 1
+		elif raw_latlon in missing_bytes:
+			counts["missing_latlon_counter"] += 1
 			has_latlon_field = False
-		elif raw_latlon in nc_variants:
-			nc_counter += 1
+		elif raw_latlon in nc_bytes:
+			counts["nc_counter"] += 1
 			has_latlon_field = False
-		elif raw_latlon == "":
-			missing_latlon_counter += 1
+		elif raw_latlon == b"":
+			counts["missing_latlon_counter"] += 1
 			has_latlon_field = False
 
 		# check if the sample at least has a location
-		if location_name == "NA":
-			loc_na_counter += 1
+		if location_name == b"NA":
+			counts["loc_na_counter"] += 1
 			has_location_field = False
-		elif location_name in nc_variants: # table entry is blank
-			no_location_counter += 1
+		elif location_name in nc_bytes: # table entry is blank
+			counts["no_location_counter"] += 1
 			has_location_field = False
-		elif location_name in missing_variants:
-			missing_loc_counter += 1
+		elif location_name in missing_bytes:
+			counts["missing_loc_counter"] += 1
 			has_location_field = False
 		else:
-			loc_field_counter += 1
+			counts["loc_field_counter"] += 1
 
 		# sample cannot be plotted, remove from table
 		if has_latlon_field is False and has_location_field is False:
-			no_source_position_given += 1
+			counts["no_source_position_given"] += 1
 			continue
-		any_source_position += 1
+		counts["any_source_position"] += 1
 
 ################################################################################
 
 		# parse NCBI format lat-lon
 		# all entries should be like this
 		# lat-lon is generally YY.YY NS XX.XX EW
-		# should split into 4 pieces to [YY.YY, NS, XX.XX, EW]
+		# but many are not, so all formats are read by the same tokens
 		if has_latlon_field is True:
-			latlonsp = raw_latlon.split(" ")
-			# if not, skip
-			if len(latlonsp) == 4:
-				latitude, lat_hemi, longitude, long_hemi = latlonsp
-
-				# check for degree minute seconds
-#SRA141824	187_1.sff	SRS560593	749906	gut metagenome	42-02-05 N, 93-37-12 W	NA	NA	USA: Ames, Iowa	gut metagenome
-#SRA159216	fungioaklitter	SRS597132	556182	freshwater sediment metagenome	41.44-41.61 N 8.04-8.32 W	2012	NA	Portugal: Northwest	freshwater sediment metagenome
-
-				if latitude.count("-")==2:
-					dms_counter += 1
-					degree, minutes, seconds = map(float,latitude.split("-"))
-					latitude = str(degree + minutes/60 + seconds/3600)
-				elif latitude.count("-")==1:
-					range_counter += 1
-					latitude = latitude.split("-")[0]
-				elif latitude.count(".")==2 and latitude.count("-")==0:
-					dms_counter += 1
-					degree, minutes, seconds = map(float,latitude.split("."))
-					latitude = str(degree + minutes/60 + seconds/3600)
-				if longitude.count("-")==2:
-					degree, minutes, seconds = map(float,longitude.split("-"))
-					longitude = str(degree + minutes/60 + seconds/3600)
-				elif longitude.count("-")==1:
-					longitude = longitude.split("-")[0]
-				elif longitude.count(".")==2 and longitude.count("-")==0:
-					degree, minutes, seconds = map(float,longitude.split("."))
-					longitude = str(degree + minutes/60 + seconds/3600)
-
-				# fix hemispheres to coordinates
-				lat_hemi = lat_hemi.replace(",","")
-				if lat_hemi=="S":
-					latitude = "-"+latitude
-				if long_hemi=="W":
-					longitude = "-"+longitude
-
-	#SRA173038	MLAC_113_031008BA01	SRS650331	433733	human lung metagenome	15.7861A??A?? S, 35.0058A??A?? E	21-Sep-2010	NA	Malawi: Blantyre	human lung metagenome
-
-				# check for further weird cases
-	#SRA134133	29	SRS564079	662107	phyllosphere metagenome	36A? 37.669, -121A? 32.350	2012	NA	USA: Salinas Valley	phyllosphere metagenome
-				if lat_hemi not in ["N", "S"]:
-					non_nsew_counter += 1
-					bad_latlon = True
-
-				# remove terminal ? for cases below
-	#SRA074245	LM300	SRS1239132	410658	soil metagenome	45.5081? N, 73.5550? W	2011-06-15	NA	Canada: Montreal	soil metagenome
-				if latitude and latitude[-1]=="?":
-					latitude = latitude.replace("?","")
-				if longitude and longitude[-1]=="?":
-					longitude = longitude.replace("?","")
-
-	#SRA189798	LAO-D49	SRS720730	527639	wastewater metagenome	49.5134139 N 0.006.0179250 E	10/5/11	NA	Luxembourg: Schifflange	wastewater metagenome
-				if longitude.find("0.006")==0:
-					longitude = longitude.replace("0.00","")
-
-			# for entries with weird splits
-			elif len(latlonsp) == 2:
-				latitude, longitude = two_part_latlon(raw_latlon)
-				if latitude is None:
-					non_nsew_counter += 1
-					bad_latlon = True
-				else:
-					two_part_fix += 1
-			elif len(latlonsp) == 6:
-				latitude, longitude = six_part_latlon(raw_latlon)
-				if latitude is None:
-					non_nsew_counter += 1
-					bad_latlon = True
-				else:
-					six_part_fix += 1
-			elif len(latlonsp) == 1:
-				latitude, longitude = one_part_latlon(raw_latlon)
-				if latitude is None:
-					non_nsew_counter += 1
-					bad_latlon = True
-				else:
-					one_part_fix += 1
-			else:
-				non_nsew_counter += 1
+			latitude, longitude, fixtype = cached_functions["lat-lon"](raw_latlon)
+			if latitude is None:
+				counts["non_nsew_counter"] += 1
 				bad_latlon = True
-
-			if bad_latlon is False:
-				# check for final errors in 4-part
-				latmatch = re.search("^(-?[.\d]+)$", latitude)
-				lonmatch = re.search("^(-?[.\d]+)$", longitude)
-				if not latmatch or not lonmatch:
-					latitude, longitude = four_part_latlon(raw_latlon)
-					if latitude is None:
-						non_nsew_counter += 1
-						bad_latlon = True
-					else:
-						four_part_fix += 1
+			elif fixtype=="dms":
+				counts["dms_counter"] += 1
+			elif fixtype=="range":
+				counts["range_counter"] += 1
+			elif fixtype=="unusual":
+				counts["unusual_fix"] += 1
 
 
 		# if using geonames
-		if args.geonames_data and args.geonames_countries:
+		if use_geonames:
 			if has_location_field is True:
 				# no latlon given in the first place or is erroneous
 				if has_latlon_field is False or bad_latlon is True:
-					latitude, longitude, geonames_flag = get_geonames_latlon( location_name, unique_name_to_latlon )
+					latitude, longitude, geonames_flag, fuzzy_location = cached_functions["location"](location_name)
 					if latitude is None: # meaning found the latitude
-						cannot_find_loc_counter += 1
+						counts["cannot_find_loc_counter"] += 1
 						continue
 					else:
 						location_found = True
-						match_any_loc_counter += 1
+						counts["match_any_loc_counter"] += 1
+						if fuzzy_location is not None:
+							counts["fuzzy_location_counter"] += 1
 						if geonames_flag is True: # meaning exact match found
-							found_exact_location += 1
+							counts["found_exact_location"] += 1
 						else: # flag for country only found
-							country_only_names += 1
+							counts["country_only_names"] += 1
 		else: # no geonames
 			if bad_latlon is True or has_latlon_field is False: # could not use latlon and no location given
 				continue
 
 		if bad_latlon is True and location_found is False:
-			cannot_find_loc_counter += 1
+			counts["cannot_find_loc_counter"] += 1
 			continue
 
-	
+
+		# check that lat-lon from the table is near the named country
+		if country_check and has_latlon_field is True and bad_latlon is False and has_location_field is True:
+			checked_latitude, checked_longitude, country_flag = cached_functions["country"](latitude, longitude, location_name)
+			if country_flag=="ok":
+				counts["country_near_counter"] += 1
+			elif country_flag=="far":
+				counts["country_far_counter"] += 1
+			elif country_flag!="NA":
+				counts["country_flip_counter"] += 1
+				if country_check=="fix":
+					latitude, longitude = checked_latitude, checked_longitude
 
 		# fix the date to the same format
 		rawdate = lsplits[6]
-		fixed_date = fix_date_formats(rawdate)
+		fixed_date = cached_functions["date"](rawdate)
 		if fixed_date=="0000-00-00":
-			no_date_counter += 1
+			counts["no_date_counter"] += 1
 		else:
-			has_date_counter += 1
+			counts["has_date_counter"] += 1
 		fixed_year = int(fixed_date.split("-")[0])
 		if 0000 < fixed_year < 1990 or fixed_year > 2100:
-			strange_date += 1
-		lsplits[6] = "{}\t{}\t{}".format( *fixed_date.split("-") )
+			counts["strange_date"] += 1
+		lsplits[6] = "{}\t{}\t{}".format( *fixed_date.split("-") ).encode("utf-8")
+		if partitions is not None: # category is the last column from parse_ncbi_taxonomy.py, before any added here
+			category = lsplits[-1].rstrip(b"\n").rsplit(b"\t",1)[-1].decode("utf-8")
 
 		# reassign split
-		lsplits[5] = "{}\t{}".format(latitude, longitude)
+		lsplits[5] = "{}\t{}".format(latitude, longitude).encode("utf-8")
+		if fuzzy_column:
+			lsplits[-1] = "{}\t{}\n".format( lsplits[-1].rstrip(b"\n").decode("utf-8"), fuzzy_location or "NA" ).encode("utf-8")
+		if country_check:
+			lsplits[-1] = "{}\t{}\n".format( lsplits[-1].rstrip(b"\n").decode("utf-8"), country_flag ).encode("utf-8")
 		# print line
-		print_count += 1
-		sys.stdout.write( "\t".join(lsplits) )
+		counts["print_count"] += 1
+		outputline = b"\t".join(lsplits)
+		wayout.write(outputline)
+		if partitions is not None:
+			partitions.add( partitions.partition_key(fixed_date.split("-")[0], category), outputline )
+	return counts
+
+def cache_counts(cached_functions):
+	'''return dict of field to list of times parsed, times reused, and values kept, for each cached function'''
+	return { field: [cached_function.cache_info().misses, cached_function.cache_info().hits, cached_function.cache_info().currsize] for field, cached_function in cached_functions.items() }
+
+# set before the worker processes are forked, so all workers share the
+# geonames places without copying, and each worker keeps its own caches
+polish_setup = {}
+
+def polish_byte_range(byterange):
+	'''worker for --workers, polish one chunk of the input, return the output as bytes and the counts'''
+	chunkout = io.BytesIO()
+	rule_profile = polish_setup["rule_profile"]
+	if rule_profile is not None: # only count this chunk
+		rule_profile.clear()
+	# lines of each partition are sent back with the chunk, and written by the main process
+	chunk_partitions = PartitionWriter(None, polish_setup["partition_by"]) if polish_setup["partition_by"] else None
+	cache_before = cache_counts(polish_setup["cached_functions"])
+	chunk_counts = polish_lines( read_byte_range(polish_setup["input"], *byterange, decode=False), chunkout, polish_setup["cached_functions"], polish_setup["use_geonames"], polish_setup["fuzzy_column"], polish_setup["country_check"], chunk_partitions )
+	cache_after = cache_counts(polish_setup["cached_functions"])
+	# values kept are counted per worker, as later chunks of that worker reuse the same cache
+	chunk_counts["cache"] = { field: [cache_after[field][0] - cache_before[field][0], cache_after[field][1] - cache_before[field][1], {os.getpid(): cache_after[field][2]}] for field in cache_after }
+	chunk_counts["profile"] = rule_profile
+	chunk_counts["partitions"] = dict(chunk_partitions.buffers) if chunk_partitions is not None else None
+	return chunkout.getvalue(), chunk_counts
+
+def polish_in_parallel(inputfilename, workers, wayout, cached_functions, use_geonames, rule_profile=None, fuzzy_column=False, country_check=None, partitions=None):
+	'''split the input into chunks for each worker, write the output in the original order, and return the combined counts'''
+	byteranges = split_byte_ranges(inputfilename, workers * 4)
+	sys.stderr.write("# polishing {} chunks with {} workers  {}\n".format( len(byteranges), workers, time.asctime() ) )
+	polish_setup["input"] = inputfilename
+	polish_setup["cached_functions"] = cached_functions
+	polish_setup["use_geonames"] = use_geonames
+	polish_setup["rule_profile"] = rule_profile
+	polish_setup["fuzzy_column"] = fuzzy_column
+	polish_setup["country_check"] = country_check
+	polish_setup["partition_by"] = partitions.partition_by if partitions is not None else None
+	total_counts = new_polish_counts()
+	total_counts["cache"] = { field: [0, 0, {}] for field in cached_functions }
+	total_counts["profile"] = {} if rule_profile is not None else None
+	with multiprocessing.get_context("fork").Pool(workers) as pool:
+		for chunkoutput, chunk_counts in pool.imap(polish_byte_range, byteranges):
+			wayout.write(chunkoutput)
+			for field, (parsed, reused, kept) in chunk_counts.pop("cache").items():
+				total_counts["cache"][field][0] += parsed
+				total_counts["cache"][field][1] += reused
+				for pid, currsize in kept.items():
+					total_counts["cache"][field][2][pid] = max( currsize, total_counts["cache"][field][2].get(pid, 0) )
+			chunk_partitions = chunk_counts.pop("partitions")
+			if chunk_partitions is not None:
+				partitions.add_chunk(chunk_partitions)
+			chunk_profile = chunk_counts.pop("profile")
+			if chunk_profile is not None:
+				for rule, (hits, seconds) in chunk_profile.items():
+					rule_stats = total_counts["profile"].setdefault(rule, [0, 0.0])
+					rule_stats[0] += hits
+					rule_stats[1] += seconds
+			for countname, count in chunk_counts.items():
+				total_counts[countname] += count
+	for field in total_counts["cache"]:
+		total_counts["cache"][field][2] = sum(total_counts["cache"][field][2].values())
+	return total_counts
 
+def main(argv, wayout):
+	if not len(argv):
+		argv.append('-h')
+	parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=__doc__)
+	parser.add_argument('-i','--input', help="raw SRA extended metadata file, from parse_ncbi_taxonomy.py")
+	parser.add_argument('-c','--geonames-countries', help="optional GeoNames country info, from countryInfo.txt")
+	parser.add_argument('-g','--geonames-data', help="optional GeoNames data, from allCountries.txt")
+	parser.add_argument('--geonames-index', help="optional index of GeoNames places from import_geonames_db.py --index, instead of -g and -c")
+	parser.add_argument('--fuzzy-distance', type=int, default=0, help="find misspelled locations within this many changes of a country or large place, and add a column of the corrected location [0]")
+	parser.add_argument('--country-check', choices=["flag","fix"], help="check that lat-lon is near the country of the location, and add a column of ok, far, or the sign flip that puts it there, and with fix, use the flipped lat-lon")
+	parser.add_argument('--lazy', action="store_true", help="with -g and -c, only keep places that could match locations in the input, reading allCountries.txt again only while alternate names point to ascii names not yet kept")
+	parser.add_argument('--cache-size', type=int, default=100000, help="number of raw lat-lon, date and location values to remember for each, 0 to parse every row [100000]")
+	parser.add_argument('-w','--workers', type=int, default=1, help="number of processes to polish chunks of the input [1]")
+	parser.add_argument('--partition-by', help="also write the output to one file per year and/or category, as year,category, in --partition-dir")
+	parser.add_argument('--partition-dir', help="folder for files of each partition and partition_index.tab, with --partition-by")
+	parser.add_argument('--profile', action="store_true", help="print number of values and time for each lat-lon, date and location rule, with --cache-size 0 to count every row")
+	parser.add_argument('--verbose', action="store_true", help="make verbose")
+	args = parser.parse_args(argv)
 
-	# count fixes of non standard formats
-	weird_fixes = one_part_fix + two_part_fix + four_part_fix + six_part_fix
+	if args.fuzzy_distance and not (args.geonames_index or (args.geonames_data and args.geonames_countries)):
+		parser.error("--fuzzy-distance needs --geonames-index, or -g and -c")
+	if args.country_check and not (args.geonames_index or (args.geonames_data and args.geonames_countries)):
+		parser.error("--country-check needs --geonames-index, or -g and -c")
+	partition_by = args.partition_by.split(",") if args.partition_by else []
+	if any(field not in partition_fields for field in partition_by) or len(set(partition_by)) < len(partition_by):
+		parser.error("--partition-by must be year, category, or both separated by a comma")
+	if partition_by and not args.partition_dir:
+		parser.error("--partition-by needs --partition-dir")
+	if args.fuzzy_distance and args.lazy and not args.geonames_index:
+		parser.error("--fuzzy-distance cannot be used with --lazy, as corrected names would not be kept")
+
+	# count and time each rule for values that are parsed, not those taken from the cache
+	rule_profile = {} if args.profile else None
+	profiled = (lambda function: profile_rules(function, rule_profile)) if args.profile else (lambda function: function)
+
+	# rows from the same study repeat the same raw values, so each value is parsed once
+	cached_functions = {}
+	# values are cached as bytes from the table, so are only decoded when first parsed
+	cached_functions["lat-lon"] = functools.lru_cache(maxsize=args.cache_size)( profiled( decode_arguments(parse_latlon) ) )
+	cached_functions["date"] = functools.lru_cache(maxsize=args.cache_size)( profiled( decode_arguments(fix_date_formats) ) )
 
+	
+	#
+	# READ OPTIONAL GEONAMES DATABASE
+	#
+	geo_feature_descr_dict = {} # use blank to make things run anyway
+	use_geonames = False
+	if args.geonames_index:
+		unique_name_to_latlon = GeonamesIndex(args.geonames_index)
+		print( "# Using index of {} geonames places from {} for location searches  {}".format(unique_name_to_latlon.place_count, args.geonames_index, time.asctime()), file=sys.stderr )
+		use_geonames = True
+	elif args.geonames_data and args.geonames_countries:
+		print( "# Importing optional geonames database for location searches  {}".format(time.asctime()), file=sys.stderr )
+		geo_country_info_dict = import_geonames_country_codes( args.geonames_countries , args.verbose )
+		if args.lazy:
+			input_locations = read_input_locations(args.input)
+			unique_name_to_latlon = import_geonames_for_locations( args.geonames_data , geo_feature_descr_dict , geo_country_info_dict , input_locations , args.verbose )
+		else:
+			unique_name_to_latlon = import_geonames_all_countries( args.geonames_data , geo_feature_descr_dict , geo_country_info_dict , args.verbose )
+		use_geonames = True
+	if use_geonames:
+		fuzzy_index = None
+		if args.fuzzy_distance:
+			fuzzy_index = FuzzyPlaceIndex(unique_name_to_latlon.get_fuzzy_names(), args.fuzzy_distance)
+			print( "# Indexed {} names for fuzzy matching within {} changes  {}".format(len(fuzzy_index.key_to_names), args.fuzzy_distance, time.asctime()), file=sys.stderr )
+		cached_functions["location"] = functools.lru_cache(maxsize=args.cache_size)( profiled( decode_arguments( lambda location: get_geonames_latlon_fuzzy(location, unique_name_to_latlon, fuzzy_index) ) ) )
+		if args.country_check:
+			country_grid = CountryGrid(unique_name_to_latlon.get_country_cells())
+			print( "# Found places of {} countries in {} grid cells  {}".format(len(country_grid.countries), len(country_grid.cell_countries), time.asctime()), file=sys.stderr )
+			cached_functions["country"] = functools.lru_cache(maxsize=args.cache_size)( profiled( decode_arguments( lambda latitude, longitude, location: check_country(latitude, longitude, location, country_grid) ) ) )
 
 
+	#
+	# FIX LAT-LON INFORMATION
+	#
+	sys.stderr.write("# Reading {}\n".format(args.input) )
+	# lines are written as bytes, straight to the buffer under stdout
+	wayout.flush()
+	byteout = getattr(wayout, "buffer", wayout)
+	partitions = PartitionWriter(args.partition_dir, partition_by) if partition_by else None
+	if args.workers > 1:
+		counts = polish_in_parallel(args.input, args.workers, byteout, cached_functions, use_geonames, rule_profile, args.fuzzy_distance > 0, args.country_check, partitions)
+	else:
+		counts = polish_lines(open(args.input,'rb'), byteout, cached_functions, use_geonames, args.fuzzy_distance > 0, args.country_check, partitions)
+		counts["cache"] = cache_counts(cached_functions)
+		counts["profile"] = rule_profile
+
 	# report final latlon stats
-	sys.stderr.write("# Counted {} entries, wrote {} entries\n".format(entry_count, print_count) )
-	sys.stderr.write("# {}/{} entries had either latlon position or location\n".format(any_source_position, entry_count) )
-	sys.stderr.write("# {}/{} entries had no latlon position or location given\n".format(no_source_position_given, entry_count) )
+	sys.stderr.write("# Counted {} entries, wrote {} entries\n".format(counts["entry_count"], counts["print_count"]) )
+	sys.stderr.write("# {}/{} entries had either latlon position or location\n".format(counts["any_source_position"], counts["entry_count"]) )
+	sys.stderr.write("# {}/{} entries had no latlon position or location given\n".format(counts["no_source_position_given"], counts["entry_count"]) )
 	print( "#" , file=sys.stderr )
 	# based on latlon info
-	if void_counter:
-		sys.stderr.write("# {} entries had 'VOID' as lat-lon from previous steps, removed\n".format(void_counter) )
-	if missing_latlon_counter:
-		sys.stderr.write("# {} entries did not include lat-lon (missing, not collected, etc.), removed\n".format(missing_latlon_counter) )
-	if nc_counter:
-		sys.stderr.write("# {} entries had other values as lat-lon, removed\n".format(nc_counter) )
-	if non_nsew_counter:
-		sys.stderr.write("# {} entries had an unknown format of lat-lon, removed\n".format(non_nsew_counter) )
-	if dms_counter:
-		sys.stderr.write("# {} entries had lat-lon as deg-min-sec format, fixed\n".format(dms_counter) )
-	if range_counter:
-		sys.stderr.write("# {} entries had lat-lon as a range, fixed\n".format(range_counter) )
-	if weird_fixes:
-		sys.stderr.write("# {} entries had unusual formats, fixed\n".format(weird_fixes) )
+	if counts["void_counter"]:
+		sys.stderr.write("# {} entries had 'VOID' as lat-lon from previous steps, removed\n".format(counts["void_counter"]) )
+	if counts["missing_latlon_counter"]:
+		sys.stderr.write("# {} entries did not include lat-lon (missing, not collected, etc.), removed\n".format(counts["missing_latlon_counter"]) )
+	if counts["nc_counter"]:
+		sys.stderr.write("# {} entries had other values as lat-lon, removed\n".format(counts["nc_counter"]) )
+	if counts["non_nsew_counter"]:
+		sys.stderr.write("# {} entries had an unknown format of lat-lon, removed\n".format(counts["non_nsew_counter"]) )
+	if counts["dms_counter"]:
+		sys.stderr.write("# {} entries had lat-lon as deg-min-sec format, fixed\n".format(counts["dms_counter"]) )
+	if counts["range_counter"]:
+		sys.stderr.write("# {} entries had lat-lon as a range, fixed\n".format(counts["range_counter"]) )
+	if counts["unusual_fix"]:
+		sys.stderr.write("# {} entries had unusual formats, fixed\n".format(counts["unusual_fix"]) )
 	print( "#" , file=sys.stderr )
 
 	# report location stats
-	if loc_na_counter:
-		sys.stderr.write("# {} entries had 'NA' as location from previous steps\n".format(loc_na_counter) )
-	if missing_loc_counter:
-		sys.stderr.write("# {} entries had other (missing) values as lat-lon\n".format(missing_loc_counter) )
-	if no_location_counter:
-		sys.stderr.write("# {} entries had a blank location\n".format(no_location_counter) )
-	if loc_field_counter:
-		sys.stderr.write("# {}/{} total samples had a valid location given\n".format(loc_field_counter, entry_count) )
-	if match_any_loc_counter:
-		sys.stderr.write("# {} entries had no lat-lon, but found something from geonames\n".format(match_any_loc_counter) )
-	if country_only_names:
-		sys.stderr.write("# {} entries had no lat-lon, but found only country ID from geonames\n".format(country_only_names) )
-	if cannot_find_loc_counter:
-		sys.stderr.write("# {} entries had a location, but the latlon could not be determined\n".format(cannot_find_loc_counter) )
+	if counts["loc_na_counter"]:
+		sys.stderr.write("# {} entries had 'NA' as location from previous steps\n".format(counts["loc_na_counter"]) )
+	if counts["missing_loc_counter"]:
+		sys.stderr.write("# {} entries had other (missing) values as lat-lon\n".format(counts["missing_loc_counter"]) )
+	if counts["no_location_counter"]:
+		sys.stderr.write("# {} entries had a blank location\n".format(counts["no_location_counter"]) )
+	if counts["loc_field_counter"]:
+		sys.stderr.write("# {}/{} total samples had a valid location given\n".format(counts["loc_field_counter"], counts["entry_count"]) )
+	if counts["match_any_loc_counter"]:
+		sys.stderr.write("# {} entries had no lat-lon, but found something from geonames\n".format(counts["match_any_loc_counter"]) )
+	if counts["country_only_names"]:
+		sys.stderr.write("# {} entries had no lat-lon, but found only country ID from geonames\n".format(counts["country_only_names"]) )
+	if counts["fuzzy_location_counter"]:
+		sys.stderr.write("# {} entries were found from geonames only by fuzzy matching of the location, flagged\n".format(counts["fuzzy_location_counter"]) )
+	if counts["cannot_find_loc_counter"]:
+		sys.stderr.write("# {} entries had a location, but the latlon could not be determined\n".format(counts["cannot_find_loc_counter"]) )
+	if counts["country_near_counter"]:
+		sys.stderr.write("# {} entries had lat-lon near the country of the location\n".format(counts["country_near_counter"]) )
+	if counts["country_flip_counter"]:
+		sys.stderr.write("# {} entries had lat-lon in the country only after flipping N-S, E-W or swapping, {}\n".format(counts["country_flip_counter"], "fixed" if args.country_check=="fix" else "flagged") )
+	if counts["country_far_counter"]:
+		sys.stderr.write("# {} entries had lat-lon far from the country of the location, flagged\n".format(counts["country_far_counter"]) )
 	print( "#" , file=sys.stderr )
 
 	# report date stats
-	if has_date_counter:
-		sys.stderr.write("# {} entries had acceptable date format, {} were missing date\n".format( has_date_counter, no_date_counter ) )
-	if strange_date:
-		sys.stderr.write("# {} entries had improbable sample dates (before 1990)\n".format(strange_date) )
+	if counts["has_date_counter"]:
+		sys.stderr.write("# {} entries had acceptable date format, {} were missing date\n".format( counts["has_date_counter"], counts["no_date_counter"] ) )
+	if counts["strange_date"]:
+		sys.stderr.write("# {} entries had improbable sample dates (before 1990)\n".format(counts["strange_date"]) )
+	print( "#" , file=sys.stderr )
+
+	# report how often each raw value was seen before
+	for field, (parsed, reused, kept) in counts["cache"].items():
+		sys.stderr.write("# {} values parsed {} times, and reused {} times, {} kept at the end\n".format( field, parsed, reused, kept ) )
+	if args.profile:
+		report_rule_profile(counts["profile"], args.cache_size)
+	if partitions is not None:
+		indexfilename = partitions.close()
+		sys.stderr.write("# Wrote {} partitions by {}, listed in {}  {}\n".format( len(partitions.rows), args.partition_by, indexfilename, time.asctime() ) )
 
 
 if __name__ == "__main__":
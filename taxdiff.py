@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+#
+# taxdiff.py  created 2026-10-19
+
+'''taxdiff.py  last modified 2026-10-19
+    compare two taxonomy caches from parse_ncbi_taxonomy.py, and list all taxids
+    where the name or kingdom, phylum or class changed, or that were merged, deleted or added
+
+    each cache is made once from that release of names.dmp nodes.dmp and merged.dmp
+parse_ncbi_taxonomy.py -n taxonomy_20220628/names.dmp -o taxonomy_20220628/nodes.dmp taxonomy_20220628/merged.dmp --cache taxonomy_20220628_cache -i species_list.txt > /dev/null
+
+taxdiff.py --old taxonomy_20220117_cache --new taxonomy_20220628_cache > taxdiff_20220117_20220628.tab
+
+    then only the changed rows of an older table are annotated again
+parse_ncbi_taxonomy.py --cache taxonomy_20220628_cache -i sample_w_exp.tab --numbers --samples --header --update-from sample_kingdom_20220117.tab --changes taxdiff_20220117_20220628.tab > sample_kingdom.tab
+
+    output columns are:
+taxid  change  new_taxid  old_name  new_name  old_kingdom  old_phylum  old_class  new_kingdom  new_phylum  new_class
+    where change is one of deleted, merged, added, or name and/or lineage
+'''
+
+import sys
+import time
+import argparse
+
+from parse_ncbi_taxonomy import get_taxonomy_cache, cache_node_to_name, clean_name
+
+def node_status(taxcache, node):
+	'''return "missing" if the node is not in the cache, "merged" if only from merged.dmp, otherwise "node"'''
+	if node >= len(taxcache["parents"]) or taxcache["parents"][node] == -1:
+		return "missing"
+	# merged.dmp has no rank, so these are the only nodes with an empty rank
+	if taxcache["rank_names"][taxcache["ranks"][node]] == "":
+		return "merged"
+	return "node"
+
+def raw_name(taxcache, node):
+	'''return scientific name of the node as bytes from the cache, or empty if there is none'''
+	offsets = taxcache["sciname_offsets"]
+	if node + 1 >= len(offsets):
+		return b""
+	return taxcache["sciname_pool"][offsets[node]:offsets[node+1]]
+
+def lineage_ids(taxcache, node):
+	'''return tuple of kingdom, phylum and class from the lineage arrays, where -1 is None and -2 is deleted'''
+	if node >= len(taxcache["parents"]):
+		return (-2, -2, -2)
+	return (taxcache["kingdom"][node], taxcache["phylum"][node], taxcache["class"][node])
+
+def lineage_names(taxcache, lineage):
+	'''return list of names for the kingdom, phylum and class, as written by parse_ncbi_taxonomy.py'''
+	return [ clean_name(cache_node_to_name(taxcache, n) or "None") if n >= 0 else ("Deleted" if n == -2 else "None") for n in lineage ]
+
+def compare_caches(oldcache, newcache, wayout):
+	'''write one line for each changed node to wayout, and return a dict of counts of each change'''
+	nodecount = max(len(oldcache["parents"]), len(newcache["parents"]))
+	# lineages are also changed if the name of the kingdom, phylum or class changed, so find those first
+	renamed_nodes = {}
+	for node in range(nodecount):
+		if node_status(oldcache, node)=="node" and node_status(newcache, node)=="node" and raw_name(oldcache, node) != raw_name(newcache, node):
+			renamed_nodes[node] = True
+	sys.stderr.write("# found {} nodes with changed names  {}\n".format( len(renamed_nodes), time.asctime() ) )
+
+	change_counts = {}
+	wayout.write("taxid\tchange\tnew_taxid\told_name\tnew_name\told_kingdom\told_phylum\told_class\tnew_kingdom\tnew_phylum\tnew_class\n")
+	for node in range(nodecount):
+		old_status = node_status(oldcache, node)
+		new_status = node_status(newcache, node)
+		if old_status=="missing" and new_status=="missing":
+			continue
+		old_taxid = oldcache["parents"][node] if old_status=="merged" else node
+		new_taxid = node
+		old_lineage = lineage_ids(oldcache, node)
+		new_lineage = lineage_ids(newcache, node)
+		if new_status=="merged":
+			new_taxid = newcache["parents"][node]
+		if new_status=="missing":
+			change = "deleted"
+		elif old_status=="missing":
+			change = "added"
+		elif new_status=="merged" and (old_status!="merged" or oldcache["parents"][node]!=new_taxid):
+			change = "merged"
+		elif old_status=="merged" and new_status!="merged": # merged nodes that are now separate are also new
+			change = "added"
+		else: # nodes merged to the same node in both are changed if that node changed
+			changes = []
+			if new_taxid in renamed_nodes:
+				changes.append("name")
+			if old_lineage != new_lineage or any(n in renamed_nodes for n in new_lineage):
+				changes.append("lineage")
+			if not changes:
+				continue
+			change = ",".join(changes)
+		change_counts[change] = change_counts.get(change, 0) + 1
+		outputlist = [str(node), change, str(new_taxid),
+					clean_name(cache_node_to_name(oldcache, old_taxid) or "None"), clean_name(cache_node_to_name(newcache, new_taxid) or "None")]
+		outputlist.extend( lineage_names(oldcache, old_lineage) + lineage_names(newcache, new_lineage) )
+		wayout.write( "{}\n".format( "\t".join(outputlist) ) )
+	return change_counts
+
+def main(argv, wayout):
+	if not len(argv):
+		argv.append('-h')
+	parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=__doc__)
+	parser.add_argument('--old', required=True, help="taxonomy cache folder of the older release")
+	parser.add_argument('--new', required=True, help="taxonomy cache folder of the newer release")
+	args = parser.parse_args(argv)
+
+	oldcache = get_taxonomy_cache(args.old)
+	newcache = get_taxonomy_cache(args.new)
+	change_counts = compare_caches(oldcache, newcache, wayout)
+	sys.stderr.write("# found {} changed nodes  {}\n".format( sum(change_counts.values()), time.asctime() ) )
+	for change, count in sorted(change_counts.items()):
+		sys.stderr.write("# {}\t{}\n".format( change, count ) )
+
+if __name__ == "__main__":
+	main(sys.argv[1:], sys.stdout)
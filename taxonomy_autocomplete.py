@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+#
+# taxonomy_autocomplete.py  created 2026-10-19
+
+'''taxonomy_autocomplete.py  last modified 2026-10-19
+    complete species names from a prefix, using the name index of the taxonomy cache
+    including synonyms, ranked by the number of samples in the clade of each name
+
+    build the completion index once in the cache folder, with counts from the samples table
+taxonomy_autocomplete.py --cache taxonomy_20220628_cache --samples-table sample_w_exp.tab
+
+    then find the top completions
+taxonomy_autocomplete.py --cache taxonomy_20220628_cache -p Hormiph
+
+    or from taxonomy_server.py, if started with the same cache
+curl "http://localhost:8765/complete?prefix=Hormiph&k=10"
+
+    output columns are:
+prefix  name_key  taxid  scientific_name  clade_samples
+'''
+
+import os
+import sys
+import time
+import heapq
+import hashlib
+import array
+import argparse
+import itertools
+
+from parse_ncbi_taxonomy import get_taxonomy_cache, write_cache_array, read_cache_array, read_cache_meta, \
+	get_line_taxid, cache_node_to_name, normalize_name
+
+COMPLETE_META = "complete_meta.tab"
+# completions for prefixes up to this length are precomputed, as those match the most names
+complete_prefix_length = 4
+complete_top_k = 20
+# longer prefixes that match more names than this use the list of keys ordered by samples
+complete_scan_limit = 20000
+
+def count_node_samples(samplesfile, nodecount):
+	'''read the samples table from parse_long_sra_metadata.py, return array of number of samples of each node'''
+	node_samples = array.array('q', bytes(8 * nodecount))
+	sys.stderr.write("# counting samples of each taxid from {}  {}\n".format(samplesfile, time.asctime() ) )
+	for line in open(samplesfile,'r'):
+		line = line.strip()
+		if line:
+			taxid = get_line_taxid(line, True, True, False)
+			if taxid is not None and taxid.isdigit() and int(taxid) < nodecount:
+				node_samples[int(taxid)] += 1
+	sys.stderr.write("# counted {} samples  {}\n".format( sum(node_samples), time.asctime() ) )
+	return node_samples
+
+def clade_sample_counts(taxcache, node_samples):
+	'''return array of the number of samples of each node and all nodes below it, from the sums of depth-first positions'''
+	clade_start = taxcache["clade_start"]
+	clade_end = taxcache["clade_end"]
+	position_samples = array.array('q', bytes(8 * (len(clade_start) + 1)))
+	for node, position in enumerate(clade_start):
+		if position >= 0:
+			position_samples[position+1] = node_samples[node]
+	cumulative = array.array('q', itertools.accumulate(position_samples))
+	clade_samples = array.array('q', bytes(8 * len(clade_start)))
+	for node, position in enumerate(clade_start):
+		if position >= 0:
+			clade_samples[node] = cumulative[clade_end[node]+1] - cumulative[position]
+	return clade_samples
+
+def namekey_at(taxcache, keyindex):
+	'''return the normalized name key at the index as bytes'''
+	offsets = taxcache["namekey_offsets"]
+	return taxcache["namekey_pool"][offsets[keyindex]:offsets[keyindex+1]]
+
+def prefix_key_range(taxcache, prefixkey):
+	'''return start and end index of all name keys beginning with the prefix, by binary search'''
+	bounds = []
+	for searchkey in [prefixkey, prefixkey + b"\xff"]: # 0xff never occurs in utf-8
+		lower = 0
+		upper = len(taxcache["namekey_nodes"])
+		while lower < upper:
+			middle = (lower + upper) // 2
+			if namekey_at(taxcache, middle) < searchkey:
+				lower = middle + 1
+			else:
+				upper = middle
+		bounds.append(lower)
+	return bounds[0], bounds[1]
+
+def cache_fingerprint(taxcache):
+	'''return hash of the name keys and their taxids, as a string, which changes when the cache is rebuilt from other names'''
+	namehash = hashlib.sha1()
+	for cachearray in ["namekey_offsets", "namekey_pool", "namekey_nodes"]:
+		namehash.update(taxcache[cachearray])
+	return namehash.hexdigest()
+
+def build_completion_index(taxcache, cachedir, node_samples=None):
+	'''write samples of each name key, keys ordered by samples, and the top completions of short prefixes to the cache folder'''
+	namekey_nodes = taxcache["namekey_nodes"]
+	if node_samples is None: # without counts, completions are alphabetical
+		node_samples = array.array('q', bytes(8 * len(taxcache["parents"])))
+	clade_samples = clade_sample_counts(taxcache, node_samples)
+	namekey_samples = array.array('q', [ clade_samples[node] if node >= 0 else -1 for node in namekey_nodes ])
+	# ambiguous keys have no node, so are not completed
+	keys_by_samples = array.array('i', sorted( (i for i in range(len(namekey_nodes)) if namekey_nodes[i] >= 0), key=lambda i: -namekey_samples[i] ) )
+	sys.stderr.write("# ranked {} name keys by samples  {}\n".format( len(keys_by_samples), time.asctime() ) )
+
+	# as keys are read from most to fewest samples, the first K of each prefix are the top K
+	prefix_tops = {}
+	for keyindex in keys_by_samples:
+		namekey = namekey_at(taxcache, keyindex)
+		for length in range(1, min(len(namekey), complete_prefix_length) + 1):
+			top_keys = prefix_tops.setdefault(namekey[:length], [])
+			if len(top_keys) < complete_top_k:
+				top_keys.append(keyindex)
+	prefix_pool = bytearray()
+	prefix_offsets = array.array('q', [0])
+	prefix_top = array.array('i')
+	for prefixkey in sorted(prefix_tops):
+		prefix_pool.extend(prefixkey)
+		prefix_offsets.append( len(prefix_pool) )
+		top_keys = prefix_tops[prefixkey]
+		prefix_top.extend( top_keys + [-1] * (complete_top_k - len(top_keys)) )
+	sys.stderr.write("# stored top {} completions for {} short prefixes  {}\n".format( complete_top_k, len(prefix_tops), time.asctime() ) )
+
+	write_cache_array(cachedir, "namekey_samples.i64", namekey_samples)
+	write_cache_array(cachedir, "keys_by_samples.i32", keys_by_samples)
+	write_cache_array(cachedir, "prefix_pool.bin", prefix_pool)
+	write_cache_array(cachedir, "prefix_offsets.i64", prefix_offsets)
+	write_cache_array(cachedir, "prefix_top.i32", prefix_top)
+	with open(os.path.join(cachedir, COMPLETE_META), 'w') as metafile:
+		metafile.write("cache_version\t{}\n".format( read_cache_meta(cachedir).get("version") ) )
+		# offsets in the index point into the name keys, so the index is only used with the same keys
+		metafile.write("namekey_hash\t{}\n".format( cache_fingerprint(taxcache) ) )
+		metafile.write("prefix_length\t{}\n".format(complete_prefix_length) )
+		metafile.write("top_k\t{}\n".format(complete_top_k) )
+
+def load_completion_index(taxcache, cachedir):
+	'''memory-map the completion index into taxcache, return False if it was not built for this cache'''
+	complete_meta = read_cache_meta(cachedir, COMPLETE_META)
+	if complete_meta.get("cache_version") != read_cache_meta(cachedir).get("version") or int(complete_meta.get("top_k",0)) != complete_top_k \
+			or int(complete_meta.get("prefix_length",0)) != complete_prefix_length \
+			or complete_meta.get("namekey_hash") != cache_fingerprint(taxcache):
+		return False
+	taxcache["namekey_samples"] = read_cache_array(cachedir, "namekey_samples.i64", 'q')
+	taxcache["keys_by_samples"] = read_cache_array(cachedir, "keys_by_samples.i32", 'i')
+	taxcache["prefix_pool"] = read_cache_array(cachedir, "prefix_pool.bin")
+	taxcache["prefix_offsets"] = read_cache_array(cachedir, "prefix_offsets.i64", 'q')
+	taxcache["prefix_top"] = read_cache_array(cachedir, "prefix_top.i32", 'i')
+	return True
+
+def short_prefix_top(taxcache, prefixkey):
+	'''return list of precomputed top key indices for a short prefix, by binary search of the prefixes'''
+	pool = taxcache["prefix_pool"]
+	offsets = taxcache["prefix_offsets"]
+	lower = 0
+	upper = len(offsets) - 1
+	while lower < upper:
+		middle = (lower + upper) // 2
+		if pool[offsets[middle]:offsets[middle+1]] < prefixkey:
+			lower = middle + 1
+		else:
+			upper = middle
+	if lower == len(offsets) - 1 or pool[offsets[lower]:offsets[lower+1]] != prefixkey:
+		return []
+	return [k for k in taxcache["prefix_top"][lower*complete_top_k:(lower+1)*complete_top_k] if k >= 0]
+
+def complete_name(taxcache, prefix, k=10):
+	'''return list of up to k tuples of name key, taxid, scientific name, and samples of the clade, for names starting with prefix'''
+	prefixkey = normalize_name(prefix).encode("utf-8")
+	if not prefixkey:
+		return []
+	namekey_samples = taxcache["namekey_samples"]
+	if len(prefixkey) <= complete_prefix_length and k <= complete_top_k:
+		top_keys = short_prefix_top(taxcache, prefixkey)[:k]
+	else:
+		start, end = prefix_key_range(taxcache, prefixkey)
+		if end - start <= complete_scan_limit:
+			candidates = [i for i in range(start, end) if taxcache["namekey_nodes"][i] >= 0]
+			top_keys = heapq.nsmallest(k, candidates, key=lambda i: (-namekey_samples[i], i))
+		else: # very common prefix, so the first keys by samples that are in the range are the top
+			top_keys = list(itertools.islice( (i for i in taxcache["keys_by_samples"] if start <= i < end), k ))
+	completions = []
+	for keyindex in top_keys:
+		node = taxcache["namekey_nodes"][keyindex]
+		completions.append( (namekey_at(taxcache, keyindex).decode("utf-8"), str(node), cache_node_to_name(taxcache, node), namekey_samples[keyindex]) )
+	return completions
+
+def main(argv, wayout):
+	if not len(argv):
+		argv.append('-h')
+	parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=__doc__)
+	parser.add_argument('--cache', required=True, help="folder of taxonomy cache from parse_ncbi_taxonomy.py")
+	parser.add_argument('-s','--samples-table', help="samples table from parse_long_sra_metadata.py, to (re)build the index ranked by samples")
+	parser.add_argument('-p','--prefix', nargs="*", default=[], help="one or more prefixes to complete")
+	parser.add_argument('-k','--top', type=int, default=10, help="number of completions for each prefix [10]")
+	args = parser.parse_args(argv)
+
+	taxcache = get_taxonomy_cache(args.cache)
+	if args.samples_table or not load_completion_index(taxcache, args.cache):
+		if not args.samples_table:
+			# rebuilding without counts would silently lose the ranking of an older index
+			if os.path.isfile(os.path.join(args.cache, COMPLETE_META)):
+				sys.exit("ERROR: COMPLETION INDEX IN {} IS FOR AN OLDER CACHE, REBUILD WITH --samples-table".format(args.cache) )
+			sys.stderr.write("# no --samples-table, completions are in alphabetical order\n")
+		node_samples = count_node_samples(args.samples_table, len(taxcache["parents"])) if args.samples_table else None
+		build_completion_index(taxcache, args.cache, node_samples)
+		load_completion_index(taxcache, args.cache)
+	for prefix in args.prefix:
+		for completion in complete_name(taxcache, prefix, args.top):
+			wayout.write( "{}\t{}\t{}\t{}\t{}\n".format( prefix, *completion ) )
+
+if __name__ == "__main__":
+	main(sys.argv[1:], sys.stdout)
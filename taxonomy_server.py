@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#
+# taxonomy_server.py  created 2026-10-19
+
+'''taxonomy_server.py  last modified 2026-10-19
+    load NCBI Taxonomy once, and answer lookups from other steps over localhost
+
+taxonomy_server.py --cache taxonomy_20220628_cache &
+
+    or from the .dmp files, which is slower to start
+taxonomy_server.py -n names.dmp -o nodes.dmp merged.dmp &
+
+    then annotation runs use --server instead of -n -o or --cache
+parse_ncbi_taxonomy.py --server http://localhost:8765 -i sample_w_exp.tab --numbers --samples --header > sample_kingdom.tab
+parse_ncbi_taxonomy.py --server http://localhost:8765 --csv -i wgs_selector.csv
+
+    single lookups can be made with curl or a browser
+curl "http://localhost:8765/lookup?taxid=9606&name=Danio+rerio"
+
+    batches are sent as json, with lists of taxids and names
+curl -d '{"taxids":["9606","7227"], "names":["Danio rerio"]}' http://localhost:8765/lookup
+
+    replies are json of three dicts, which are
+    nodes: name to taxid, or null if not found
+    names: taxid to scientific name, including all kingdom, phylum and class nodes
+    lineages: taxid to list of kingdom, phylum, class taxids
+
+    with --cache, and the index from taxonomy_autocomplete.py, names can be completed
+curl "http://localhost:8765/complete?prefix=Hormiph&k=10"
+    replies are json of a list of completions, each with key, taxid, name and samples
+'''
+
+import sys
+import json
+import time
+import argparse
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from parse_ncbi_taxonomy import make_lookups
+from taxonomy_autocomplete import load_completion_index, complete_name
+
+def answer_lookups(lookups, taxids, names):
+	'''return dict of node for each name, lineage for each taxid, and names of all nodes that were involved'''
+	get_node, get_name, get_lineage = lookups
+	reply = {"nodes":{}, "names":{}, "lineages":{}}
+	for speciesname in names:
+		node_id = get_node(speciesname)
+		reply["nodes"][speciesname] = node_id
+		if node_id is not None:
+			taxids.append(node_id)
+	for node_id in taxids:
+		if node_id in reply["lineages"]:
+			continue
+		lineage = get_lineage(node_id)
+		reply["lineages"][node_id] = lineage
+		for lineage_id in [node_id] + lineage:
+			if lineage_id is not None and lineage_id != "Deleted":
+				reply["names"][lineage_id] = get_name(lineage_id)
+	return reply
+
+class TaxonomyRequestHandler(BaseHTTPRequestHandler):
+	'''answer GET with taxid= and name= in the query, or POST with a json batch, at /lookup
+	    or GET with prefix= and k= at /complete'''
+	def do_GET(self):
+		parsedpath = urllib.parse.urlparse(self.path)
+		query = urllib.parse.parse_qs(parsedpath.query)
+		if parsedpath.path == "/complete":
+			self.send_completions(query.get("prefix",[""])[0], query.get("k",["10"])[0])
+			return
+		self.send_lookups(parsedpath.path, query.get("taxid",[]), query.get("name",[]))
+
+	def do_POST(self):
+		content_length = int(self.headers.get("Content-Length", 0))
+		try:
+			batch = json.loads(self.rfile.read(content_length).decode("utf-8"))
+		except ValueError:
+			self.send_error(400, "cannot read json from request")
+			return
+		if not isinstance(batch, dict):
+			self.send_error(400, "json must be an object with lists of taxids and names")
+			return
+		taxids = batch.get("taxids",[])
+		names = batch.get("names",[])
+		if not isinstance(taxids, list) or not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+			self.send_error(400, "taxids must be a list, and names must be a list of strings")
+			return
+		self.send_lookups(urllib.parse.urlparse(self.path).path, taxids, names)
+
+	def send_lookups(self, path, taxids, names):
+		if path != "/lookup":
+			self.send_error(404, "only /lookup and /complete are available")
+			return
+		reply = answer_lookups(self.server.lookups, [str(t) for t in taxids], names)
+		with self.server.count_lock:
+			self.server.request_count += 1
+			self.server.lookup_count += len(taxids) + len(names)
+		self.send_json(reply)
+
+	def send_completions(self, prefix, k):
+		if self.server.taxcache is None:
+			self.send_error(404, "no completion index, start with --cache after running taxonomy_autocomplete.py")
+			return
+		if not k.isdigit():
+			self.send_error(400, "k must be a number")
+			return
+		completions = complete_name(self.server.taxcache, prefix, int(k))
+		with self.server.count_lock:
+			self.server.request_count += 1
+		self.send_json( [ {"key":key, "taxid":taxid, "name":name, "samples":samples} for key, taxid, name, samples in completions ] )
+
+	def send_json(self, reply):
+		replydata = json.dumps(reply).encode("utf-8")
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(replydata)))
+		self.end_headers()
+		self.wfile.write(replydata)
+
+	def log_message(self, format, *args):
+		if self.server.verbose:
+			sys.stderr.write("# {} {}\n".format( format % args, time.asctime() ) )
+
+def main(argv, wayout):
+	if not len(argv):
+		argv.append('-h')
+	parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=__doc__)
+	parser.add_argument('-n','--names', help="NCBI taxonomy names.dmp")
+	parser.add_argument('-o','--nodes', nargs="*", help="NCBI taxonomy nodes.dmp, and possibly merged.dmp")
+	parser.add_argument('--cache', help="folder of taxonomy cache, built from -n and -o if it does not exist")
+	parser.add_argument('--host', default="127.0.0.1", help="address to listen, default only allows local connections [127.0.0.1]")
+	parser.add_argument('-p','--port', type=int, default=8765, help="port to listen [8765]")
+	parser.add_argument('-v','--verbose', action="store_true", help="print each request to stderr")
+	args = parser.parse_args(argv)
+
+	if not args.cache and not (args.names and args.nodes):
+		parser.error("need either --cache, or -n and -o")
+
+	# metagenome filtering is left to each client, so one server works for all modes
+	lookups = make_lookups(args.cache, args.names, args.nodes, False)
+
+	server = ThreadingHTTPServer( (args.host, args.port), TaxonomyRequestHandler)
+	server.lookups = (lookups["get_node"], lookups["get_name"], lookups["get_lineage"])
+	server.taxcache = None
+	if args.cache:
+		if load_completion_index(lookups["taxcache"], args.cache):
+			server.taxcache = lookups["taxcache"]
+		else:
+			sys.stderr.write("# no completion index in {}, /complete is not available\n".format(args.cache) )
+	server.verbose = args.verbose
+	# handlers run in threads, so counts are only changed while holding the lock
+	server.count_lock = threading.Lock()
+	server.request_count = 0
+	server.lookup_count = 0
+	sys.stderr.write("# serving taxonomy lookups at http://{}:{}/lookup  {}\n".format( args.host, args.port, time.asctime() ) )
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		sys.stderr.write("# stopping after {} requests of {} lookups  {}\n".format( server.request_count, server.lookup_count, time.asctime() ) )
+	server.server_close()
+
+if __name__ == "__main__":
+	main(sys.argv[1:], sys.stdout)